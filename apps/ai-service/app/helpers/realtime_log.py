@@ -32,6 +32,7 @@ async def log_message(training_id: str, message: str, echo: bool = True):
 class RedisLogHandler:
     def __init__(self, training_id: str):
         self.training_id = training_id
+        self.loop = asyncio.get_event_loop()
 
     def write(self, message: str):
         if message.strip():
@@ -39,7 +40,16 @@ class RedisLogHandler:
                 "trainingId": self.training_id,
                 "data": message.strip()
             }
-            asyncio.create_task(r.publish(os.getenv("REDIS_LOG_CHANNEL", "training-logs"), json.dumps(payload)))
+            publish = r.publish(os.getenv("REDIS_LOG_CHANNEL", "training-logs"), json.dumps(payload))
+            try:
+                running_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                running_loop = None
+            if running_loop is self.loop:
+                asyncio.create_task(publish)
+            else:
+                # Printed from a worker thread: hand the publish to the server loop
+                asyncio.run_coroutine_threadsafe(publish, self.loop)
 
     def flush(self):
         pass
@@ -1,12 +1,11 @@
 from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
-import os
-import glob
 import subprocess
 import requests
 import traceback
 
-from app.services.dataset.dataset import preprocess_all_dataset, augment_dataset_class, augment_dataset_obj, augment_dataset_seg, prepare_dataset
+from app.services.dataset.dataset import configure_dataset, materialize_augmentation, materialize_preprocessing
+from app.services.dataset.ingest import ingestion
 from app.services.model.training import MLTraining, DLTrainingPretrained, ConstructTraining
 from app.models.ml import MachineLearningClassificationRequest
 from app.models.dl import (
@@ -54,34 +53,46 @@ async def status():
 
 @app.post("/training-ml")
 async def training_ml(config: MachineLearningClassificationRequest, request: Request):
-    with redirect_stdout_to_ws(request):
-        ml_training.training_ml_cls(config)
+    # Wait for dataset jobs, which rewrite the tree this reads
+    async with ingestion.lock:
+        with redirect_stdout_to_ws(request):
+            if config.featex:
+                materialize_preprocessing("dataset")
+            materialize_augmentation("dataset")
+            ml_training.training_ml_cls(config)
     return get_model("cls", "ml")
 
 
 @app.post("/training-dl-cls-pt")
 async def training_dl(config: DeepLearningClassification, request: Request):
-    with redirect_stdout_to_ws(request):
-        dl_training_pretrained.train_cls(config)
+    async with ingestion.lock:
+        with redirect_stdout_to_ws(request):
+            dl_training_pretrained.train_cls(config)
     return get_model("cls", "pt")
 
 
 @app.post("/training-dl-cls-construct")
 async def construct_model(config: DeepLearningClassificationConstruct, request: Request):
-    with redirect_stdout_to_ws(request):
-        if config.featex:
-            construct_training.train_cls_featex(config)
-        else:
-            construct_training.train_cls(config)
+    async with ingestion.lock:
+        with redirect_stdout_to_ws(request):
+            if config.featex:
+                materialize_preprocessing("dataset")
+                materialize_augmentation("dataset")
+                construct_training.train_cls_featex(config)
+            else:
+                construct_training.train_cls(config)
     return get_model("cls", "construct")
 
 @app.post("/training-dl-od-construct")
 async def construct_model(config: DeepLearningObjectDetectionConstructRequest, request: Request):
-    with redirect_stdout_to_ws(request):
-        if isinstance(config, DeepLearningObjectDetectionConstructFeatex):
-            construct_training.train_od_featex(config)
-        else:
-            construct_training.train_od(config)
+    async with ingestion.lock:
+        with redirect_stdout_to_ws(request):
+            materialize_preprocessing("dataset")
+            if isinstance(config, DeepLearningObjectDetectionConstructFeatex):
+                materialize_augmentation("dataset")
+                construct_training.train_od_featex(config)
+            else:
+                construct_training.train_od(config)
     return get_model("od", "construct")
 
 
@@ -107,8 +118,11 @@ async def create_venv():
 
 @app.post("/training-yolo-pt")
 async def training_yolo_pretrained(config: DeepLearningYoloRequest, request: Request):
-    with redirect_stdout_to_ws(request):
-        await dl_training_pretrained.train_yolo(config, request.headers.get("X-TRAINING-ID", "default-id"))
+    async with ingestion.lock:
+        with redirect_stdout_to_ws(request):
+            materialize_preprocessing("dataset")
+            materialize_augmentation("dataset")
+            await dl_training_pretrained.train_yolo(config, request.headers.get("X-TRAINING-ID", "default-id"))
     if config.type == "object_detection":
         return get_model("od", "pt", config.model)
     elif config.type == "segmentation":
@@ -121,46 +135,33 @@ async def training_yolo_pretrained(config: DeepLearningYoloRequest, request: Req
 async def create_dataset(data: PrepareDatasetRequest, request: Request):
     with redirect_stdout_to_ws(request):
         delete_all_models()
-        prepare_dataset(data)
+        job = ingestion.submit(data, request.headers.get("X-TRAINING-ID", "default-id"))
+        await job.task
+        if job.status == "failed":
+            raise RuntimeError(job.error)
+
+
+@app.post("/dataset/jobs")
+async def create_dataset_job(data: PrepareDatasetRequest, request: Request):
+    delete_all_models()
+    job = ingestion.submit(data, request.headers.get("X-TRAINING-ID", "default-id"))
+    return JSONResponse(job.to_dict(), status_code=202)
+
+
+@app.get("/dataset/jobs/{job_id}")
+async def get_dataset_job(job_id: str):
+    job = ingestion.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Dataset job not found")
+    return job.to_dict()
 
 
 @app.post("/dataset-config")
 async def config_dataset(config: DatasetConfigRequest, request: Request):
-    with redirect_stdout_to_ws(request):
-        # TODO: Get dataset
-
-        # TODO: Preprocess images
-        if config.preprocess:
-            print("DOING PREPROCESS")
-            dataset_dir = "dataset"
-            preprocess_all_dataset(dataset_dir, config.preprocess)
-
-        # TODO: Augmentation
-        if config.augmentation and config.type:
-            print("DOING AUGMENTATION")
-            training_path = "dataset/train"
-
-            # Count how many training dataset exist
-            image_extensions = ['*.png', '*.jpg']
-            image_count = 0
-            for ext in image_extensions:
-                image_count += len(glob.glob(os.path.join(training_path,
-                                '**', ext), recursive=True))
-
-            total_target_number = config.augmentation.number - image_count
-            print("TOTAL TARGER:", total_target_number)
-
-            # Do Augmentation
-            if total_target_number > 0:
-                if config.type == "classification":
-                    augment_dataset_class(
-                        training_path, config.augmentation)
-                if config.type == "object_detection":
-                    augment_dataset_obj(
-                        training_path, config.augmentation)
-                if config.type == "segmentation":
-                    augment_dataset_seg(
-                        training_path, config.augmentation)
+    async with ingestion.lock:
+        with redirect_stdout_to_ws(request):
+            # TODO: Get dataset
+            configure_dataset(config)
 
 
 @app.post("/use-model")
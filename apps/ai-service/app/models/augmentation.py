@@ -25,6 +25,7 @@ class DataAugmentationConfig(BaseModel):
     random_erasing: Optional[Tuple[float, Tuple[int, int, int, int]]] = Field(None, description="Randomly erase a region (x, y, width, height).")
     elastic_distortion: Optional[Tuple[float, Tuple[int, int]]] = Field(None, description="Apply elastic transformation (Alpha, Sigma).")
     number: int = Field(100, description="Number of final datasets.")
+    seed: Optional[int] = Field(None, description="Seed for reproducible augmentation; random when unset.")
     priority: List[
         Literal[
             'grayscale', 'resize', 'crop', 'rotate', 'flip', 'translate', 'scale', 'brightness', 'contrast_stretching',
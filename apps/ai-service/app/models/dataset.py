@@ -1,4 +1,4 @@
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, Field, model_validator
 from typing import Literal, Optional, List, Union, TypedDict, Tuple
 
 from app.models.preprocessing import ImagePreprocessingConfig
@@ -46,6 +46,9 @@ class PrepareDatasetClassification(BaseModel):
     train_data: List[ClassificationImage]
     test_data: List[ClassificationImage]
     valid_data: List[ClassificationImage]
+    incremental: bool = True
+    dedup: Literal['off', 'flag', 'skip'] = 'off'
+    dedup_distance: int = Field(4, ge=0, le=64)
 
 class PrepareDatasetObjectDetection(BaseModel):
     type: Literal['object_detection']
@@ -53,6 +56,9 @@ class PrepareDatasetObjectDetection(BaseModel):
     train_data: List[ObjectDetectionImage]
     test_data: List[ObjectDetectionImage]
     valid_data: List[ObjectDetectionImage]
+    incremental: bool = True
+    dedup: Literal['off', 'flag', 'skip'] = 'off'
+    dedup_distance: int = Field(4, ge=0, le=64)
 
 class PrepareDatasetSegmentation(BaseModel):
     type: Literal['segmentation']
@@ -60,6 +66,9 @@ class PrepareDatasetSegmentation(BaseModel):
     train_data: List[SegmentationImage]
     test_data: List[SegmentationImage]
     valid_data: List[SegmentationImage]
+    incremental: bool = True
+    dedup: Literal['off', 'flag', 'skip'] = 'off'
+    dedup_distance: int = Field(4, ge=0, le=64)
 
 PrepareDatasetRequest = Union[
     PrepareDatasetClassification,
@@ -71,11 +80,16 @@ class DatasetConfigRequest(BaseModel):
     type: Optional[Literal['classification', 'object_detection', 'segmentation']] = None
     preprocess: Optional[ImagePreprocessingConfig] = None
     augmentation: Optional[DataAugmentationConfig] = None
+    lazy_preprocess: bool = False
+    # Augment training batches as they are loaded instead of writing augmented images
+    online_augmentation: bool = False
     
     @model_validator(mode="after")
     def validate_model(cls, values: "DatasetConfigRequest"):
         if values.augmentation and not values.type:
             raise ValueError("Augmentation requires dataset type.")
+        if values.augmentation and values.online_augmentation and values.type == "segmentation":
+            raise ValueError("Online augmentation supports classification and object detection datasets.")
         return values
 
 class ObjectDetectionBoundingBox(TypedDict):
@@ -11,6 +11,9 @@ class ImagePreprocessingConfig(BaseModel):
         None, description="Perspective transformation: 4 src and 4 dest points."
     )
     thresh_percent: Optional[int] = Field(None, description="Apply thresholding at percentile.")
+    thresh_scope: Literal['image', 'dataset'] = Field(
+        'image', description="Compute the thresh_percent threshold per image, or once over the training images for every split."
+    )
     normalize: Optional[Tuple[int, int]] = Field(None, description="Normalize pixel values (min, max).")
     histogram_equalization: Optional[bool] = Field(None, description="Apply histogram equalization.")
     sharpening: Optional[int] = Field(None, description="Apply sharpening (higher=stronger).")
@@ -1,587 +1,611 @@
+import os
 import cv2
 import numpy as np
-from typing import Optional, Tuple, List
-import random
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
 
 from app.models.augmentation import DataAugmentationConfig
+from app.services.dataset.pointwise import LutChain, PointwiseStep, probe_remap
+
+POINTWISE_AUGMENTATIONS = {'brightness', 'contrast_stretching', 'gamma'}
+
+# The transforms that fired for one sample, in order: dicts holding the
+# transform's key and every parameter it was applied with
+Recipe = List[dict]
+
+
+class Polygons(NamedTuple):
+    """
+    The segmentation polygons of one image, with all vertices in one array.
+
+    `points` holds normalized (x, y) vertices polygon after polygon, and
+    `starts` the index of each polygon's first vertex, so transforms move
+    every vertex of the image at once.
+    """
+    class_ids: np.ndarray
+    points: np.ndarray
+    starts: np.ndarray
+
+    @classmethod
+    def from_rows(cls, rows: List[list]) -> "Polygons":
+        """Build from YOLO segmentation rows: class id, then x y pairs."""
+        rows = [row for row in rows if len(row) >= 3]
+        coordinates = [np.asarray(row[1:1 + (len(row) - 1) // 2 * 2], dtype=np.float64).reshape(-1, 2) for row in rows]
+        sizes = np.array([len(points) for points in coordinates], dtype=np.intp)
+        return cls(
+            np.array([int(row[0]) for row in rows], dtype=np.int64),
+            np.concatenate(coordinates) if coordinates else np.zeros((0, 2)),
+            np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.intp) if rows else np.zeros(0, dtype=np.intp),
+        )
+
+    def rows(self) -> List[list]:
+        return [[int(class_id)] + points.ravel().tolist()
+                for class_id, points in zip(self.class_ids, np.split(self.points, self.starts[1:]))]
+
+    def areas(self) -> np.ndarray:
+        """Shoelace area of every polygon, in normalized units."""
+        x, y = self.points[:, 0], self.points[:, 1]
+        following = np.arange(1, len(x) + 1)
+        ends = np.append(self.starts[1:], len(x))
+        following[ends - 1] = self.starts
+        return 0.5 * np.abs(np.add.reduceat(x * y[following] - x[following] * y, self.starts))
+
+# Tables, kernels and matrices kept per transform for repeated parameters.
+# Callers share the cached arrays and must not modify them; they are not
+# made read-only because OpenCV copies read-only inputs on every call.
+AUGMENT_CACHE_SIZE = int(os.getenv("AUGMENT_CACHE_SIZE", "256"))
+# Fraction of the image size each further zoom blur level crops away
+ZOOM_BLUR_STEP = 0.1
+
+
+def brightness_step(factor: float) -> PointwiseStep:
+    def brightness(image):
+        return cv2.convertScaleAbs(image, alpha=1, beta=factor * 255)
+    return PointwiseStep(brightness, probe_remap(brightness))
+
+
+def contrast_stretching_step(lower: float, upper: float) -> PointwiseStep:
+    in_range = (lower * 255, upper * 255)
+
+    def contrast_stretching(image):
+        return cv2.normalize(
+            image, None, alpha=in_range[0], beta=in_range[1], norm_type=cv2.NORM_MINMAX)
+    return PointwiseStep(contrast_stretching, probe_remap(contrast_stretching))
+
+
+@lru_cache(maxsize=AUGMENT_CACHE_SIZE)
+def gamma_step(gamma: float) -> PointwiseStep:
+    inv_gamma = 1.0 / gamma
+    table = ((np.arange(256) / 255.0) ** inv_gamma * 255).astype("uint8")
+
+    def gamma_correction(image):
+        return cv2.LUT(image, table)
+    return PointwiseStep(gamma_correction, probe_remap(gamma_correction))
+
+
+@lru_cache(maxsize=AUGMENT_CACHE_SIZE)
+def rotation_matrix(cols: int, rows: int, angle: float) -> np.ndarray:
+    return cv2.getRotationMatrix2D((cols / 2, rows / 2), angle, 1)
+
+
+@lru_cache(maxsize=AUGMENT_CACHE_SIZE)
+def translation_matrix(tx: float, ty: float) -> np.ndarray:
+    return np.float32([[1, 0, tx], [0, 1, ty]])
+
+
+@lru_cache(maxsize=AUGMENT_CACHE_SIZE)
+def motion_blur_kernel(kernel_size: int, angle: float) -> np.ndarray:
+    kernel = np.zeros((kernel_size, kernel_size))
+    kernel[int((kernel_size - 1) / 2),
+           :] = np.ones(kernel_size)
+    matrix = cv2.getRotationMatrix2D(
+        (kernel_size / 2, kernel_size / 2), angle, 1)
+    kernel = cv2.warpAffine(
+        kernel, matrix, (kernel_size, kernel_size))
+    return kernel / kernel.sum()
+
+
+@lru_cache(maxsize=AUGMENT_CACHE_SIZE)
+def zoom_blur_regions(cols: int, rows: int, zoom_factor: int) -> Tuple[Tuple[int, int, int, int], ...]:
+    '''
+    The centered (x, y, width, height) region each zoom blur level magnifies.
+
+    Level i covers 1 - i * ZOOM_BLUR_STEP of the image's size; levels stop
+    before the region vanishes.
+    '''
+    regions = []
+    for i in range(1, min(zoom_factor, int(round(1 / ZOOM_BLUR_STEP)))):
+        scale = 1 - i * ZOOM_BLUR_STEP
+        width, height = max(1, round(cols * scale)), max(1, round(rows * scale))
+        regions.append(((cols - width) // 2, (rows - height) // 2, width, height))
+    return tuple(regions)
+
+
+@lru_cache(maxsize=AUGMENT_CACHE_SIZE)
+def sharpening_kernel(factor: float) -> np.ndarray:
+    return np.array(
+        [[0, -factor, 0], [-factor, 1 + 4 * factor, -factor], [0, -factor, 0]])
+
 
 class Augmentation:
     def __init__(self):
         pass
 
-    def augmentation_classification(self, image: np.ndarray, config: DataAugmentationConfig) -> np.ndarray:
+    def draw_recipe(self, config: DataAugmentationConfig, rng: Optional[np.random.Generator] = None) -> Recipe:
         '''
-        Validate input image
+        Draw which transforms fire for one sample, and their random parameters.
+
+        Every draw comes from `rng`, so a generator seeded with the same value
+        gives the same recipe in any process. Transforms that fill arrays with
+        random values (noise, erasing, elastic fields) record a seed for them
+        instead. A recipe does not depend on the image and holds only JSON
+        types, so it can be stored and replayed later with `apply_recipe`.
         '''
-        if image is None or image.size == 0:
-            raise ValueError("Input image is empty or None.")
+        if rng is None:
+            rng = np.random.default_rng()
 
-        # Check if the original image is grayscale
-        is_grayscale = (len(image.shape) == 2) or (
-            len(image.shape) == 3 and image.shape[2] == 1)
+        def seed() -> int:
+            return int(rng.integers(2 ** 63))
 
+        recipe = []
         for key in config.priority:
-            # print(txt_file)
-            # print(f"{key}: {value}")
-
             '''
             Geometric Transformations
             '''
             if key == 'rotate' and config.rotate:
-                if random.random() < config.rotate[0]:  # Probability
-                    rows, cols = image.shape[:2]
-                    angle = random.uniform(-config.rotate[1], config.rotate[1])  # Angle range
-                    matrix = cv2.getRotationMatrix2D(
-                        (cols / 2, rows / 2), angle, 1)
-                    image = cv2.warpAffine(image, matrix, (cols, rows))
+                if rng.random() < config.rotate[0]:  # Probability
+                    angle = float(rng.uniform(-config.rotate[1], config.rotate[1]))  # Angle range
+                    recipe.append({'key': key, 'angle': angle})
 
             if key == 'crop' and config.crop:
-                if random.random() < config.crop[0]:  # Probability
-                    w, h = config.crop[1]  # Crop parameters
-                    x, y = config.crop[2]  # Crop parameters
-                    
-                    # Get actual image size
-                    img_h, img_w = image.shape[:2]
-
-                    # Ensure crop stays within image bounds
-                    if x + w <= img_w and y + h <= img_h:
-                        image = image[y:y + h, x:x + w]
-                    else:
-                        print(f"[WARNING] Crop area ({x},{y},{w},{h}) out of bounds for image size ({img_w},{img_h}). Skipping crop.")
+                if rng.random() < config.crop[0]:
+                    recipe.append({'key': key, 'size': list(config.crop[1]), 'origin': list(config.crop[2])})
 
             if key == 'flip' and config.flip:
-                if random.random() < config.flip[0]:  # Probability
+                if rng.random() < config.flip[0]:
                     # 0 = vertical, 1 = horizontal, -1 = both
-                    direction = config.flip[1]
-                    image = cv2.flip(image, direction)
+                    recipe.append({'key': key, 'direction': config.flip[1]})
 
             if key == 'translate' and config.translate:
-                if random.random() < config.translate[0]:  # Probability
-                    rows, cols = image.shape[:2]
-                    tx, ty = config.translate[1]  # Shift range (x, y)
-                    matrix = np.float32([[1, 0, tx], [0, 1, ty]])
-                    image = cv2.warpAffine(image, matrix, (cols, rows))
-
-            if key == 'scale' and config.scale :
-                if random.random() < config.scale[0]:  # Probability
-                    fx, fy = config.scale[1]  # Scaling factors
-                    image = cv2.resize(image, None, fx=fx,
-                                       fy=fy, interpolation=cv2.INTER_LINEAR)
+                if rng.random() < config.translate[0]:
+                    recipe.append({'key': key, 'shift': list(config.translate[1])})
+
+            if key == 'scale' and config.scale:
+                if rng.random() < config.scale[0]:
+                    recipe.append({'key': key, 'factors': list(config.scale[1])})
 
             if key == 'grayscale' and config.grayscale:
-                if random.random() < config.grayscale:  # Probability
-                    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                if rng.random() < config.grayscale:
+                    recipe.append({'key': key})
 
             '''
             Color and Intensity Adjustments
             '''
             if key == 'brightness' and config.brightness:
-                if random.random() < config.brightness[0]:
-                    factor = random.uniform(-config.brightness[1], config.brightness[1])
-                    image = cv2.convertScaleAbs(
-                        image, alpha=1, beta=factor * 255)
+                if rng.random() < config.brightness[0]:
+                    factor = float(rng.uniform(-config.brightness[1], config.brightness[1]))
+                    recipe.append({'key': key, 'factor': factor})
 
             if key == 'contrast_stretching' and config.contrast_stretching:
-                if random.random() < config.contrast_stretching[0]:
-                    lower = config.contrast_stretching[1]
-                    upper = config.contrast_stretching[2]
-                    in_range = (lower * 255, upper * 255)
-                    image = cv2.normalize(
-                        image, None, alpha=in_range[0], beta=in_range[1], norm_type=cv2.NORM_MINMAX)
+                if rng.random() < config.contrast_stretching[0]:
+                    recipe.append({
+                        'key': key, 'lower': config.contrast_stretching[1], 'upper': config.contrast_stretching[2]})
 
             if key == 'histogram_equalization' and config.histogram_equalization:
-                if random.random() < config.histogram_equalization:
-                    if len(image.shape) == 2:  # Grayscale image
-                        image = cv2.equalizeHist(image)
-                    else:
-                        for i in range(3):  # Equalize each channel
-                            image[:, :, i] = cv2.equalizeHist(image[:, :, i])
+                if rng.random() < config.histogram_equalization:
+                    recipe.append({'key': key})
 
             if key == 'adaptive_equalization' and config.adaptive_equalization:
-                if random.random() < config.adaptive_equalization[0]:
-                    clip_limit = config.adaptive_equalization[1]
-                    clahe = cv2.createCLAHE(
-                        clipLimit=clip_limit, tileGridSize=(8, 8))
-                    if len(image.shape) == 2:  # Grayscale
-                        image = clahe.apply(image)
-                    else:
-                        for i in range(3):
-                            image[:, :, i] = clahe.apply(image[:, :, i])
+                if rng.random() < config.adaptive_equalization[0]:
+                    recipe.append({'key': key, 'clip_limit': config.adaptive_equalization[1]})
 
             if key == 'saturation' and config.saturation:
-                if random.random() < config.saturation[0]:
-                    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-                    hsv[:, :, 1] = cv2.multiply(hsv[:, :, 1], config.saturation[1])
-                    image = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+                if rng.random() < config.saturation[0]:
+                    recipe.append({'key': key, 'factor': config.saturation[1]})
 
             if key == 'hue' and config.hue:
-                if random.random() < config.hue[0]:
-                    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-                    hsv[:, :, 0] = cv2.add(hsv[:, :, 0], config.hue[1])
-                    image = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+                if rng.random() < config.hue[0]:
+                    recipe.append({'key': key, 'shift': config.hue[1]})
 
             if key == 'gamma' and config.gamma:
-                if random.random() < config.gamma[0]:
-                    gamma = config.gamma[1]
-                    inv_gamma = 1.0 / gamma
-                    table = np.array(
-                        [(i / 255.0) ** inv_gamma * 255 for i in range(256)]).astype("uint8")
-                    image = cv2.LUT(image, table)
+                if rng.random() < config.gamma[0]:
+                    recipe.append({'key': key, 'gamma': config.gamma[1]})
 
             '''
             Blurring and Sharpening
             '''
             if key == 'gaussian_blur' and config.gaussian_blur:
-                if random.random() < config.gaussian_blur[0]:
+                if rng.random() < config.gaussian_blur[0]:
                     kernel_size, sigma = config.gaussian_blur[1]
-                    image = cv2.GaussianBlur(
-                        image, (kernel_size, kernel_size), sigma)
+                    recipe.append({'key': key, 'kernel_size': kernel_size, 'sigma': sigma})
 
             if key == 'motion_blur' and config.motion_blur:
-                if random.random() < config.motion_blur[0]:
+                if rng.random() < config.motion_blur[0]:
                     kernel_size, angle = config.motion_blur[1]
-                    kernel = np.zeros((kernel_size, kernel_size))
-                    kernel[int((kernel_size - 1) / 2),
-                           :] = np.ones(kernel_size)
-                    matrix = cv2.getRotationMatrix2D(
-                        (kernel_size / 2, kernel_size / 2), angle, 1)
-                    kernel = cv2.warpAffine(
-                        kernel, matrix, (kernel_size, kernel_size))
-                    kernel = kernel / kernel.sum()
-                    image = cv2.filter2D(image, -1, kernel)
+                    recipe.append({'key': key, 'kernel_size': kernel_size, 'angle': angle})
 
             if key == 'zoom_blur' and config.zoom_blur:
-                if random.random() < config.zoom_blur[0]:
-                    zoom_factor = config.zoom_blur[1]
-                    center = tuple(np.array(image.shape[:2][::-1]) / 2)
-                    original_size = image.shape[:2][::-1]
-                    for i in range(1, zoom_factor):
-                        scale_factor = 1 - i * 0.1
-                        temp = cv2.resize(
-                            image, None, fx=scale_factor, fy=scale_factor)
-                        new_size = temp.shape[:2][::-1]
-
-                        # Calculate margins to crop to the original size
-                        delta_w = (new_size[0] - original_size[0]) // 2
-                        delta_h = (new_size[1] - original_size[1]) // 2
-
-                        if delta_w > 0 and delta_h > 0:
-                            temp = temp[delta_h:-delta_h, delta_w:-delta_w]
-                        elif delta_w > 0:
-                            temp = temp[:, delta_w:-delta_w]
-                        elif delta_h > 0:
-                            temp = temp[delta_h:-delta_h, :]
-
-                        # Ensure temp and image have the same size
-                        temp = cv2.resize(temp, original_size)
-
-                        image = cv2.addWeighted(image, 0.5, temp, 0.5, 0)
+                if rng.random() < config.zoom_blur[0]:
+                    recipe.append({'key': key, 'zoom_factor': config.zoom_blur[1]})
 
             if key == 'sharpening' and config.sharpening:
-                if random.random() < config.sharpening[0]:
-                    factor = config.sharpening[1]
-                    kernel = np.array(
-                        [[0, -factor, 0], [-factor, 1 + 4 * factor, -factor], [0, -factor, 0]])
-                    image = cv2.filter2D(image, -1, kernel)
+                if rng.random() < config.sharpening[0]:
+                    recipe.append({'key': key, 'factor': config.sharpening[1]})
 
             '''
             Noise Injection
             '''
             if key == 'gaussian_noise' and config.gaussian_noise:
-                if random.random() < config.gaussian_noise[0]:
+                if rng.random() < config.gaussian_noise[0]:
                     mean, var = config.gaussian_noise[1]
-                    noise = np.random.normal(mean, var ** 0.5, image.shape)
-                    image = cv2.add(image, noise.astype('uint8'))
+                    recipe.append({'key': key, 'mean': mean, 'var': var, 'seed': seed()})
 
             if key == 'salt_pepper_noise' and config.salt_pepper_noise:
-                if random.random() < config.salt_pepper_noise[0]:
+                if rng.random() < config.salt_pepper_noise[0]:
                     amount, s_vs_p = config.salt_pepper_noise[1]
-                    noisy = image.copy()
-                    num_salt = np.ceil(amount * image.size * s_vs_p)
-                    coords = [np.random.randint(
-                        0, i - 1, int(num_salt)) for i in image.shape]
-                    noisy[tuple(coords)] = 255
-                    num_pepper = np.ceil(amount * image.size * (1. - s_vs_p))
-                    coords = [np.random.randint(
-                        0, i - 1, int(num_pepper)) for i in image.shape]
-                    noisy[tuple(coords)] = 0
-                    image = noisy
+                    recipe.append({'key': key, 'amount': amount, 's_vs_p': s_vs_p, 'seed': seed()})
 
             '''
             Random Erasing
             '''
             if key == 'random_erasing' and config.random_erasing:
-                if random.random() < config.random_erasing[0]:
-                    x, y, w, h = config.random_erasing[1]
-                    image[y:y + h, x:x +
-                          w] = np.random.randint(0, 256, (h, w, 3), dtype=np.uint8)
+                if rng.random() < config.random_erasing[0]:
+                    recipe.append({'key': key, 'region': list(config.random_erasing[1]), 'seed': seed()})
 
             '''
             Elastic Transformation
             '''
             if key == 'elastic_distortion' and config.elastic_distortion:
-                if random.random() < config.elastic_distortion[0]:
+                if rng.random() < config.elastic_distortion[0]:
                     alpha, sigma = config.elastic_distortion[1]
-                    shape = image.shape[:2]
-
-                    # Generate random displacement fields
-                    dx = cv2.GaussianBlur(
-                        (np.random.rand(*shape) * 2 - 1) * alpha, (2 * sigma + 1, 2 * sigma + 1), sigma)
-                    dy = cv2.GaussianBlur(
-                        (np.random.rand(*shape) * 2 - 1) * alpha, (2 * sigma + 1, 2 * sigma + 1), sigma)
-
-                    # Create a grid of coordinates
-                    x, y = np.meshgrid(
-                        np.arange(shape[1]), np.arange(shape[0]))
-
-                    # Apply the displacement fields
-                    map_x = (x + dx).astype('float32')
-                    map_y = (y + dy).astype('float32')
-
-                    # Remap the image
-                    image = cv2.remap(
-                        image, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT_101)
-
-            if is_grayscale and len(image.shape) == 3:
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-        return image
+                    recipe.append({'key': key, 'alpha': alpha, 'sigma': sigma, 'seed': seed()})
 
-    def zoom_out_bounding_box(self, cx, cy, w, h, zoom_factor):
-        # Calculate new width and height
-        new_w = w * zoom_factor
-        new_h = h * zoom_factor
+        return recipe
 
-        # Ensure the new dimensions are within bounds (0, 1)
-        new_w = min(new_w, 1.0)
-        new_h = min(new_h, 1.0)
-
-        # Return the new bounding box
-        return cx, cy, new_w, new_h
-
-    def adjust_bounding_boxes_for_rotation(self, bounding_boxes, angle, scale_factor=0.5):
-        zoom_factor = 1 + abs(angle) / 90 * scale_factor
-        adjusted_boxes = []
-
-        for class_id, cx, cy, w, h in bounding_boxes:
-            new_cx, new_cy, new_w, new_h = self.zoom_out_bounding_box(
-                cx, cy, w, h, zoom_factor)
-            adjusted_boxes.append((class_id, new_cx, new_cy, new_w, new_h))
-
-        return adjusted_boxes
-
-    def zoom_out_bounding_box(self, cx, cy, w, h, zoom_factor):
-        new_w = w * zoom_factor
-        new_h = h * zoom_factor
-        new_w = min(new_w, 1.0)
-        new_h = min(new_h, 1.0)
-        return cx, cy, new_w, new_h
-
-    def adjust_bounding_boxes_for_rotation(self, bounding_boxes, angle, scale_factor=0.5):
-        zoom_factor = 1 + (abs(angle) / 90) * scale_factor
-        adjusted_boxes = []
-        for class_id, cx, cy, w, h in bounding_boxes:
-            new_cx, new_cy, new_w, new_h = self.zoom_out_bounding_box(
-                cx, cy, w, h, zoom_factor)
-            adjusted_boxes.append((class_id, new_cx, new_cy, new_w, new_h))
-        return adjusted_boxes
-
-    def adjust_bounding_boxes_for_translation(self, bounding_boxes, tx, ty, img_width, img_height):
-        adjusted_boxes = []
-        for class_id, cx, cy, w, h in bounding_boxes:
-            new_cx = cx + tx / img_width
-            new_cy = cy + ty / img_height
-            adjusted_boxes.append((class_id, new_cx, new_cy, w, h))
-        return adjusted_boxes
-
-    def adjust_bounding_boxes_for_scaling(self, bounding_boxes, fx, fy):
-        adjusted_boxes = []
-        for class_id, cx, cy, w, h in bounding_boxes:
-            # Calculate new width and height
-            new_w = w * fx
-            new_h = h * fy
-
-            # Adjust the center positions according to the new width and height
-            new_cx = cx * fx
-            new_cy = cy * fy
-
-            # Append the adjusted bounding box
-            adjusted_boxes.append((class_id, new_cx, new_cy, new_w, new_h))
-        return adjusted_boxes
+    def apply_recipe(
+        self,
+        image: np.ndarray,
+        recipe: Recipe,
+        bounding_boxes: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        '''
+        Run the transforms of `recipe` on an image, and on its boxes if given.
+
+        Boxes are an (N, 5) array of class id and normalized center x,
+        center y, width and height, as `DatasetIndex.boxes` returns them.
+        With boxes, warps keep the frame of the original image, as object
+        detection always has. The returned boxes are clipped to the image,
+        without those that ended up entirely outside it. Replaying a stored
+        recipe on the same source image gives the same pixels.
+        '''
+        image, bounding_boxes, _ = self._run_recipe(image, recipe, bounding_boxes=bounding_boxes)
+        return image, bounding_boxes
 
-    def adjust_bounding_boxes_for_flipping(self, bounding_boxes, img_width, img_height, direction):
-        adjusted_boxes = []
-        for class_id, cx, cy, w, h in bounding_boxes:
-            if direction == 1:  # Horizontal flip
-                new_cx = 1 - cx
-                new_cy = cy
-            elif direction == 0:  # Vertical flip
-                new_cx = cx
-                new_cy = 1 - cy
-            else:  # Both flips or unknown direction, handle gracefully
-                new_cx = 1 - cx
-                new_cy = 1 - cy
-            adjusted_boxes.append((class_id, new_cx, new_cy, w, h))
-        return adjusted_boxes
+    def apply_recipe_segmentation(self, image: np.ndarray, recipe: Recipe, polygons: Polygons) -> Tuple[np.ndarray, Polygons]:
+        '''
+        Run the transforms of `recipe` on an image and its polygons.
 
-    def adjust_bounding_boxes_for_cropping(self, bounding_boxes, x, y, img_width, img_height, crop_w, crop_h):
-        adjusted_boxes = []
-        for class_id, cx, cy, w, h in bounding_boxes:
-            new_cx = (cx * img_width - x) / crop_w
-            new_cy = (cy * img_height - y) / crop_h
-            adjusted_boxes.append((class_id, new_cx, new_cy, w, h))
-        return adjusted_boxes
+        Every geometric transform moves the vertices with the matrix or
+        offsets it applies to the pixels; elastic distortion moves each
+        vertex by the displacement at its position. Vertices are clipped
+        to the image, and polygons the transforms leave without area (moved
+        out of the image) are dropped.
+        '''
+        image, _, polygons = self._run_recipe(image, recipe, polygons=polygons)
+        return image, polygons
 
-    def augmentation_object_detection(
+    def _run_recipe(
         self,
         image: np.ndarray,
-        config: DataAugmentationConfig,
-        bounding_boxes: list
-    ) -> (np.ndarray, list):
+        recipe: Recipe,
+        bounding_boxes: Optional[np.ndarray] = None,
+        polygons: Optional[Polygons] = None
+    ) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[Polygons]]:
         if image is None or image.size == 0:
             raise ValueError("Input image is empty or None.")
+        if bounding_boxes is not None:
+            bounding_boxes = np.asarray(bounding_boxes, dtype=np.float64).reshape(-1, 5)
+
+        # Polygon vertices, in pixels of the image as it is transformed; like
+        # the normalized coordinates they are continuous, with pixel i
+        # spanning [i, i + 1), while OpenCV warps map pixel centers
+        points = None
+        if polygons is not None:
+            points = polygons.points * [image.shape[1], image.shape[0]]
+            had_area = polygons.areas() > 0 if len(points) else None
 
         # Check if the original image is grayscale
         is_grayscale = (len(image.shape) == 2) or (
             len(image.shape) == 3 and image.shape[2] == 1)
 
-        rows, cols = image.shape[:2]
+        original_rows, original_cols = image.shape[:2]
 
-        for key in config.priority:
-            if key == 'rotate' and config.rotate:
-                if random.random() < config.rotate[0]:
-                    angle = random.uniform(-config.rotate[1], config.rotate[1])
-                    matrix = cv2.getRotationMatrix2D(
-                        (cols / 2, rows / 2), angle, 1)
-                    image = cv2.warpAffine(image, matrix, (cols, rows))
+        # Per-pixel adjustments are deferred and applied as one lookup table
+        pointwise = LutChain()
+
+        for step in recipe:
+            key = step['key']
+            if key not in POINTWISE_AUGMENTATIONS:
+                image = pointwise.flush(image)
+            if bounding_boxes is None:
+                rows, cols = image.shape[:2]
+            else:
+                rows, cols = original_rows, original_cols
+
+            '''
+            Geometric Transformations
+            '''
+            if key == 'rotate':
+                angle = step['angle']
+                matrix = rotation_matrix(cols, rows, angle)
+                image = cv2.warpAffine(image, matrix, (cols, rows))
+                if points is not None:
+                    points = (points - 0.5) @ matrix[:, :2].T + matrix[:, 2] + 0.5
+                if bounding_boxes is not None:
                     bounding_boxes = self.adjust_bounding_boxes_for_rotation(
                         bounding_boxes, angle)
 
-            if key == 'translate' and config.translate:
-                if random.random() < config.translate[0]:
-                    tx, ty = config.translate[1]
-                    matrix = np.float32([[1, 0, tx], [0, 1, ty]])
-                    image = cv2.warpAffine(image, matrix, (cols, rows))
+            if key == 'crop':
+                w, h = step['size']
+                x, y = step['origin']
+
+                # Get actual image size
+                img_h, img_w = image.shape[:2]
+
+                # Crops past the image bounds are skipped; the dataset is checked once when they are configured
+                if x + w <= img_w and y + h <= img_h:
+                    image = image[y:y + h, x:x + w]
+                    if points is not None:
+                        points = points - [x, y]
+                    if bounding_boxes is not None:
+                        bounding_boxes = self.adjust_bounding_boxes_for_cropping(
+                            bounding_boxes, x, y, cols, rows, w, h)
+
+            if key == 'flip':
+                direction = step['direction']
+                image = cv2.flip(image, direction)
+                if points is not None:
+                    # 1 mirrors x, 0 mirrors y, anything else both
+                    points = points.copy()
+                    if direction != 0:
+                        points[:, 0] = cols - points[:, 0]
+                    if direction != 1:
+                        points[:, 1] = rows - points[:, 1]
+                if bounding_boxes is not None:
+                    bounding_boxes = self.adjust_bounding_boxes_for_flipping(
+                        bounding_boxes, cols, rows, direction)
+
+            if key == 'translate':
+                tx, ty = step['shift']
+                image = cv2.warpAffine(image, translation_matrix(tx, ty), (cols, rows))
+                if points is not None:
+                    points = points + [tx, ty]
+                if bounding_boxes is not None:
                     bounding_boxes = self.adjust_bounding_boxes_for_translation(
                         bounding_boxes, tx, ty, cols, rows)
 
-            if key == 'scale' and config.scale:
-                if random.random() < config.scale[0]:
-                    fx, fy = config.scale[1]
-                    # Debugging output
-                    print(f"Scaling factors: fx={fx}, fy={fy}")
-                    # Apply scaling
-                    scaled_image = cv2.resize(
-                        image, None, fx=fx, fy=fy, interpolation=cv2.INTER_LINEAR)
-                    # Debugging output
-                    print(
-                        f"Original size: {image.shape}, Scaled size: {scaled_image.shape}")
-
-                    # Adjust bounding boxes according to scale
+            if key == 'scale':
+                fx, fy = step['factors']
+                image = cv2.resize(image, None, fx=fx,
+                                   fy=fy, interpolation=cv2.INTER_LINEAR)
+                if points is not None:
+                    # By the rounded size resize actually produced
+                    points = points * [image.shape[1] / cols, image.shape[0] / rows]
+                if bounding_boxes is not None:
                     bounding_boxes = self.adjust_bounding_boxes_for_scaling(
                         bounding_boxes, fx, fy)
 
-                    image = scaled_image
-
-            if key == 'flip' and config.flip:
-                if random.random() < config.flip[0]:
-                    direction = config.flip[1]
-                    image = cv2.flip(image, direction)
-                    bounding_boxes = self.adjust_bounding_boxes_for_flipping(
-                        bounding_boxes, cols, rows, direction)
-
-            if key == 'crop' and config.crop:
-                if random.random() < config.crop[0]:
-                    w, h = config.crop[1]
-                    x, y = config.crop[2]
-
-                    # Get actual image size
-                    img_h, img_w = image.shape[:2]
-
-                    # Ensure crop stays within image bounds
-                    if x + w <= img_w and y + h <= img_h:
-                        image = image[y:y + h, x:x + w]
-                    else:
-                        print(f"[WARNING] Crop area ({x},{y},{w},{h}) out of bounds for image size ({img_w},{img_h}). Skipping crop.")
-
-                    bounding_boxes = self.adjust_bounding_boxes_for_cropping(
-                        bounding_boxes, x, y, cols, rows, w, h)
-
-            if key == 'grayscale' and config.grayscale:
-                if random.random() < config.grayscale:  # Probability
-                    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            if key == 'grayscale':
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
             '''
             Color and Intensity Adjustments
             '''
-            if key == 'brightness' and config.brightness:
-                if random.random() < config.brightness[0]:
-                    factor = random.uniform(-config.brightness[1], config.brightness[1])
-                    image = cv2.convertScaleAbs(
-                        image, alpha=1, beta=factor * 255)
-
-            if key == 'contrast_stretching' and config.contrast_stretching:
-                if random.random() < config.contrast_stretching[0]:
-                    lower = config.contrast_stretching[1]
-                    upper = config.contrast_stretching[2]
-                    in_range = (lower * 255, upper * 255)
-                    image = cv2.normalize(
-                        image, None, alpha=in_range[0], beta=in_range[1], norm_type=cv2.NORM_MINMAX)
-
-            if key == 'histogram_equalization' and config.histogram_equalization:
-                if random.random() < config.histogram_equalization:
-                    if len(image.shape) == 2:  # Grayscale image
-                        image = cv2.equalizeHist(image)
-                    else:
-                        for i in range(3):  # Equalize each channel
-                            image[:, :, i] = cv2.equalizeHist(image[:, :, i])
-
-            if key == 'adaptive_equalization' and config.adaptive_equalization:
-                if random.random() < config.adaptive_equalization[0]:
-                    clip_limit = config.adaptive_equalization[1]
-                    clahe = cv2.createCLAHE(
-                        clipLimit=clip_limit, tileGridSize=(8, 8))
-                    if len(image.shape) == 2:  # Grayscale
-                        image = clahe.apply(image)
-                    else:
-                        for i in range(3):
-                            image[:, :, i] = clahe.apply(image[:, :, i])
-
-            if key == 'saturation' and config.saturation:
-                if random.random() < config.saturation[0]:
-                    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-                    hsv[:, :, 1] = cv2.multiply(hsv[:, :, 1], config.saturation[1])
-                    image = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-
-            if key == 'hue' and config.hue:
-                if random.random() < config.hue[0]:
-                    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-                    hsv[:, :, 0] = cv2.add(hsv[:, :, 0], config.hue[1])
-                    image = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-
-            if key == 'gamma' and config.gamma:
-                if random.random() < config.gamma[0]:
-                    gamma = config.gamma[1]
-                    inv_gamma = 1.0 / gamma
-                    table = np.array(
-                        [(i / 255.0) ** inv_gamma * 255 for i in range(256)]).astype("uint8")
-                    image = cv2.LUT(image, table)
+            if key == 'brightness':
+                pointwise.add(brightness_step(step['factor']))
+
+            if key == 'contrast_stretching':
+                pointwise.add(contrast_stretching_step(step['lower'], step['upper']))
+
+            if key == 'histogram_equalization':
+                if len(image.shape) == 2:  # Grayscale image
+                    image = cv2.equalizeHist(image)
+                else:
+                    for i in range(3):  # Equalize each channel
+                        image[:, :, i] = cv2.equalizeHist(image[:, :, i])
+
+            if key == 'adaptive_equalization':
+                clahe = cv2.createCLAHE(
+                    clipLimit=step['clip_limit'], tileGridSize=(8, 8))
+                if len(image.shape) == 2:  # Grayscale
+                    image = clahe.apply(image)
+                else:
+                    for i in range(3):
+                        image[:, :, i] = clahe.apply(image[:, :, i])
+
+            if key == 'saturation':
+                hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+                hsv[:, :, 1] = cv2.multiply(hsv[:, :, 1], step['factor'])
+                image = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+            if key == 'hue':
+                hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+                hsv[:, :, 0] = cv2.add(hsv[:, :, 0], step['shift'])
+                image = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+            if key == 'gamma':
+                pointwise.add(gamma_step(step['gamma']))
 
             '''
             Blurring and Sharpening
             '''
-            if key == 'gaussian_blur' and config.gaussian_blur:
-                if random.random() < config.gaussian_blur[0]:
-                    kernel_size, sigma = config.gaussian_blur[1]
-                    image = cv2.GaussianBlur(
-                        image, (kernel_size, kernel_size), sigma)
-
-            if key == 'motion_blur' and config.motion_blur:
-                if random.random() < config.motion_blur[0]:
-                    kernel_size, angle = config.motion_blur[1]
-                    kernel = np.zeros((kernel_size, kernel_size))
-                    kernel[int((kernel_size - 1) / 2),
-                           :] = np.ones(kernel_size)
-                    matrix = cv2.getRotationMatrix2D(
-                        (kernel_size / 2, kernel_size / 2), angle, 1)
-                    kernel = cv2.warpAffine(
-                        kernel, matrix, (kernel_size, kernel_size))
-                    kernel = kernel / kernel.sum()
-                    image = cv2.filter2D(image, -1, kernel)
-
-            if key == 'zoom_blur' and config.zoom_blur:
-                if random.random() < config.zoom_blur[0]:
-                    zoom_factor = config.zoom_blur[1]
-                    center = tuple(np.array(image.shape[:2][::-1]) / 2)
-                    original_size = image.shape[:2][::-1]
-                    for i in range(1, zoom_factor):
-                        scale_factor = 1 - i * 0.1
-                        temp = cv2.resize(
-                            image, None, fx=scale_factor, fy=scale_factor)
-                        new_size = temp.shape[:2][::-1]
-
-                        # Calculate margins to crop to the original size
-                        delta_w = (new_size[0] - original_size[0]) // 2
-                        delta_h = (new_size[1] - original_size[1]) // 2
-
-                        if delta_w > 0 and delta_h > 0:
-                            temp = temp[delta_h:-delta_h, delta_w:-delta_w]
-                        elif delta_w > 0:
-                            temp = temp[:, delta_w:-delta_w]
-                        elif delta_h > 0:
-                            temp = temp[delta_h:-delta_h, :]
-
-                        # Ensure temp and image have the same size
-                        temp = cv2.resize(temp, original_size)
-
-                        image = cv2.addWeighted(image, 0.5, temp, 0.5, 0)
-
-            if key == 'sharpening' and config.sharpening:
-                if random.random() < config.sharpening[0]:
-                    factor = config.sharpening[1]
-                    kernel = np.array(
-                        [[0, -factor, 0], [-factor, 1 + 4 * factor, -factor], [0, -factor, 0]])
-                    image = cv2.filter2D(image, -1, kernel)
+            if key == 'gaussian_blur':
+                kernel_size = step['kernel_size']
+                image = cv2.GaussianBlur(
+                    image, (kernel_size, kernel_size), step['sigma'])
+
+            if key == 'motion_blur':
+                kernel = motion_blur_kernel(step['kernel_size'], step['angle'])
+                image = cv2.filter2D(image, -1, kernel)
+
+            if key == 'zoom_blur':
+                # Every level magnifies the source image into one reused
+                # buffer and is summed into one total, so all levels weigh
+                # the same; ten levels of 8-bit pixels fit in 16 bits
+                size = image.shape[1], image.shape[0]
+                regions = zoom_blur_regions(*size, step['zoom_factor'])
+                if regions:
+                    total = image.astype(np.uint16)
+                    level = np.empty_like(image)
+                    for x, y, w, h in regions:
+                        cv2.resize(image[y:y + h, x:x + w], size, dst=level)
+                        np.add(total, level, out=total)
+                    image = cv2.convertScaleAbs(total, level, alpha=1 / (len(regions) + 1))
+
+            if key == 'sharpening':
+                image = cv2.filter2D(image, -1, sharpening_kernel(step['factor']))
 
             '''
             Noise Injection
             '''
-            if key == 'gaussian_noise' and config.gaussian_noise:
-                if random.random() < config.gaussian_noise[0]:
-                    mean, var = config.gaussian_noise[1]
-                    noise = np.random.normal(mean, var ** 0.5, image.shape)
-                    image = cv2.add(image, noise.astype('uint8'))
-
-            if key == 'salt_pepper_noise' and config.salt_pepper_noise:
-                if random.random() < config.salt_pepper_noise[0]:
-                    amount, s_vs_p = config.salt_pepper_noise[1]
-                    noisy = image.copy()
-                    num_salt = np.ceil(amount * image.size * s_vs_p)
-                    coords = [np.random.randint(
-                        0, i - 1, int(num_salt)) for i in image.shape]
-                    noisy[tuple(coords)] = 255
-                    num_pepper = np.ceil(amount * image.size * (1. - s_vs_p))
-                    coords = [np.random.randint(
-                        0, i - 1, int(num_pepper)) for i in image.shape]
-                    noisy[tuple(coords)] = 0
-                    image = noisy
+            if key == 'gaussian_noise':
+                noise_rng = np.random.default_rng(step['seed'])
+                noise = noise_rng.normal(step['mean'], step['var'] ** 0.5, image.shape)
+                image = cv2.add(image, noise.astype('uint8'))
+
+            if key == 'salt_pepper_noise':
+                noise_rng = np.random.default_rng(step['seed'])
+                amount, s_vs_p = step['amount'], step['s_vs_p']
+                noisy = image.copy()
+                num_salt = np.ceil(amount * image.size * s_vs_p)
+                coords = [noise_rng.integers(
+                    0, i - 1, int(num_salt)) for i in image.shape]
+                noisy[tuple(coords)] = 255
+                num_pepper = np.ceil(amount * image.size * (1. - s_vs_p))
+                coords = [noise_rng.integers(
+                    0, i - 1, int(num_pepper)) for i in image.shape]
+                noisy[tuple(coords)] = 0
+                image = noisy
 
             '''
             Random Erasing
             '''
-            if key == 'random_erasing' and config.random_erasing:
-                if random.random() < config.random_erasing[0]:
-                    x, y, w, h = config.random_erasing[1]
-                    image[y:y + h, x:x +
-                          w] = np.random.randint(0, 256, (h, w, 3), dtype=np.uint8)
+            if key == 'random_erasing':
+                noise_rng = np.random.default_rng(step['seed'])
+                x, y, w, h = step['region']
+                image[y:y + h, x:x +
+                      w] = noise_rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
 
             '''
             Elastic Transformation
             '''
-            if key == 'elastic_distortion' and config.elastic_distortion:
-                if random.random() < config.elastic_distortion[0]:
-                    alpha, sigma = config.elastic_distortion[1]
-                    shape = image.shape[:2]
+            if key == 'elastic_distortion':
+                noise_rng = np.random.default_rng(step['seed'])
+                alpha, sigma = step['alpha'], step['sigma']
+                shape = image.shape[:2]
+
+                # Generate random displacement fields
+                dx = cv2.GaussianBlur(
+                    (noise_rng.random(shape) * 2 - 1) * alpha, (2 * sigma + 1, 2 * sigma + 1), sigma)
+                dy = cv2.GaussianBlur(
+                    (noise_rng.random(shape) * 2 - 1) * alpha, (2 * sigma + 1, 2 * sigma + 1), sigma)
+
+                # Apply the displacement fields; the coordinate rows and
+                # columns broadcast against them instead of a full grid
+                map_x = (np.arange(shape[1]) + dx).astype('float32')
+                map_y = (np.arange(shape[0])[:, None] + dy).astype('float32')
+
+                # Remap the image
+                image = cv2.remap(
+                    image, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT_101)
+
+                if points is not None:
+                    # A pixel comes from its position plus the displacement,
+                    # so a vertex moves back by the displacement where it is
+                    column = np.clip(np.floor(points[:, 0]), 0, shape[1] - 1).astype(np.intp)
+                    row = np.clip(np.floor(points[:, 1]), 0, shape[0] - 1).astype(np.intp)
+                    points = points - np.column_stack([dx[row, column], dy[row, column]])
+
+            if is_grayscale and len(image.shape) == 3:
+                image = cv2.cvtColor(pointwise.flush(image), cv2.COLOR_BGR2GRAY)
+
+        if bounding_boxes is not None:
+            bounding_boxes = self.clip_bounding_boxes(bounding_boxes)
+        if points is not None:
+            points = np.clip(points / [image.shape[1], image.shape[0]], 0.0, 1.0)
+            polygons = Polygons(polygons.class_ids, points, polygons.starts)
+            if len(points):
+                keep = (polygons.areas() > 0) | ~had_area
+                if not keep.all():
+                    polygons = Polygons.from_rows([row for row, kept in zip(polygons.rows(), keep) if kept])
+        return pointwise.flush(image), bounding_boxes, polygons
+
+    def augmentation_classification(
+        self,
+        image: np.ndarray,
+        config: DataAugmentationConfig,
+        rng: Optional[np.random.Generator] = None
+    ) -> np.ndarray:
+        image, _ = self.apply_recipe(image, self.draw_recipe(config, rng))
+        return image
+
+    def adjust_bounding_boxes_for_rotation(self, bounding_boxes, angle, scale_factor=0.5):
+        # Boxes grow with the angle around their centers, up to the full image
+        zoom_factor = 1 + abs(angle) / 90 * scale_factor
+        adjusted_boxes = bounding_boxes.copy()
+        adjusted_boxes[:, 3:5] = np.minimum(bounding_boxes[:, 3:5] * zoom_factor, 1.0)
+        return adjusted_boxes
 
-                    # Generate random displacement fields
-                    dx = cv2.GaussianBlur(
-                        (np.random.rand(*shape) * 2 - 1) * alpha, (2 * sigma + 1, 2 * sigma + 1), sigma)
-                    dy = cv2.GaussianBlur(
-                        (np.random.rand(*shape) * 2 - 1) * alpha, (2 * sigma + 1, 2 * sigma + 1), sigma)
+    def adjust_bounding_boxes_for_translation(self, bounding_boxes, tx, ty, img_width, img_height):
+        adjusted_boxes = bounding_boxes.copy()
+        adjusted_boxes[:, 1] = bounding_boxes[:, 1] + tx / img_width
+        adjusted_boxes[:, 2] = bounding_boxes[:, 2] + ty / img_height
+        return adjusted_boxes
 
-                    # Create a grid of coordinates
-                    x, y = np.meshgrid(
-                        np.arange(shape[1]), np.arange(shape[0]))
+    def adjust_bounding_boxes_for_scaling(self, bounding_boxes, fx, fy):
+        # Centers and sizes scale alike
+        adjusted_boxes = bounding_boxes.copy()
+        adjusted_boxes[:, 1:5] = bounding_boxes[:, 1:5] * np.array([fx, fy, fx, fy])
+        return adjusted_boxes
 
-                    # Apply the displacement fields
-                    map_x = (x + dx).astype('float32')
-                    map_y = (y + dy).astype('float32')
+    def adjust_bounding_boxes_for_flipping(self, bounding_boxes, img_width, img_height, direction):
+        adjusted_boxes = bounding_boxes.copy()
+        if direction != 0:  # Horizontal flip, or both flips / unknown direction
+            adjusted_boxes[:, 1] = 1 - bounding_boxes[:, 1]
+        if direction != 1:  # Vertical flip, or both flips / unknown direction
+            adjusted_boxes[:, 2] = 1 - bounding_boxes[:, 2]
+        return adjusted_boxes
 
-                    # Remap the image
-                    image = cv2.remap(
-                        image, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT_101)
+    def adjust_bounding_boxes_for_cropping(self, bounding_boxes, x, y, img_width, img_height, crop_w, crop_h):
+        adjusted_boxes = bounding_boxes.copy()
+        adjusted_boxes[:, 1] = (bounding_boxes[:, 1] * img_width - x) / crop_w
+        adjusted_boxes[:, 2] = (bounding_boxes[:, 2] * img_height - y) / crop_h
+        return adjusted_boxes
 
-            if is_grayscale and len(image.shape) == 3:
-                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    def clip_bounding_boxes(self, bounding_boxes):
+        # Keep the part of each box inside the image, and drop boxes left without area
+        half_sizes = bounding_boxes[:, 3:5] / 2
+        lower = np.clip(bounding_boxes[:, 1:3] - half_sizes, 0.0, 1.0)
+        upper = np.clip(bounding_boxes[:, 1:3] + half_sizes, 0.0, 1.0)
+        clipped_boxes = bounding_boxes.copy()
+        clipped_boxes[:, 1:3] = (lower + upper) / 2
+        clipped_boxes[:, 3:5] = upper - lower
+        return clipped_boxes[(clipped_boxes[:, 3:5] > 0).all(axis=1)]
 
-        return image, bounding_boxes
+    def augmentation_object_detection(
+        self,
+        image: np.ndarray,
+        config: DataAugmentationConfig,
+        bounding_boxes: np.ndarray,
+        rng: Optional[np.random.Generator] = None
+    ) -> (np.ndarray, np.ndarray):
+        return self.apply_recipe(image, self.draw_recipe(config, rng), bounding_boxes)
+
+    def augmentation_segmentation(
+        self,
+        image: np.ndarray,
+        config: DataAugmentationConfig,
+        polygons: Polygons,
+        rng: Optional[np.random.Generator] = None
+    ) -> Tuple[np.ndarray, Polygons]:
+        return self.apply_recipe_segmentation(image, self.draw_recipe(config, rng), polygons)
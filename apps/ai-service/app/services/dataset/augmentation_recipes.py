@@ -0,0 +1,29 @@
+import os
+
+from typing import Dict
+from app.services.dataset.json_file import atomic_write_json, read_json, remove_file
+
+RECIPES_FILENAME = ".augmentations.json"
+
+
+def recipes_path(dataset_dir: str) -> str:
+    return os.path.join(dataset_dir, RECIPES_FILENAME)
+
+
+def load_recipes(dataset_dir: str) -> Dict[str, dict]:
+    """
+    Return the recorded augmentations of `dataset_dir`.
+
+    Keys are the augmented images and values hold the source image,
+    annotation paths and source boxes or polygons, the seed and the recipe
+    that produced them; every path is relative to `dataset_dir`.
+    """
+    return read_json(recipes_path(dataset_dir)) or {}
+
+
+def save_recipes(dataset_dir: str, recipes: Dict[str, dict]):
+    atomic_write_json(recipes_path(dataset_dir), recipes)
+
+
+def clear_recipes(dataset_dir: str):
+    remove_file(recipes_path(dataset_dir))
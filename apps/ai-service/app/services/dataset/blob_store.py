@@ -0,0 +1,149 @@
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from collections import Counter
+from typing import Dict, Optional, Tuple
+from app.services.dataset.json_file import atomic_write_json, read_json
+
+
+class BlobStore:
+    """
+    Persistent content-addressed store of blobs, looked up by key.
+
+    Blobs live under `<root>/blobs/<sha256[:2]>/<sha256>`, so keys whose
+    bytes are identical share one blob. `index.json` maps each key to the
+    digest of its blob, its size, the last time it was used and any
+    fields the subclass records. A blob's reference count is the number of
+    keys pointing at it; least recently used keys are evicted once the
+    blobs grow past `max_bytes`, and a blob is deleted with its last key.
+    Blobs may be written from any process; only the process that owns the
+    store records keys and saves the index.
+    """
+
+    # How eviction reports the store
+    name = "blob store"
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(root, "blobs")
+        self.index_path = os.path.join(root, "index.json")
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = self._load_index()
+
+    def _load_index(self) -> Dict[str, dict]:
+        return read_json(self.index_path) or {}
+
+    def index_key(self, key: str) -> str:
+        """The form `key` is stored under."""
+        return key
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def lookup(self, key: str) -> Optional[dict]:
+        """Return the entry for `key` if its blob is still on disk."""
+        key = self.index_key(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not os.path.exists(self.blob_path(entry["digest"])):
+                del self._entries[key]
+                return None
+            return dict(entry)
+
+    def touch(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.get(self.index_key(key))
+            if entry is not None:
+                entry["last_access"] = time.time()
+
+    def open_writer(self) -> "BlobWriter":
+        return BlobWriter(self)
+
+    def record(self, key: str, digest: str, size: int, **fields) -> None:
+        with self._lock:
+            self._entries[self.index_key(key)] = {
+                "digest": digest, **fields, "size": size, "last_access": time.time(),
+            }
+
+    def link(self, digest: str, dest: str) -> None:
+        """Materialize a blob at `dest`, hardlinking when the filesystem allows it."""
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        try:
+            os.link(self.blob_path(digest), dest)
+        except OSError:
+            shutil.copyfile(self.blob_path(digest), dest)
+
+    def evict(self) -> None:
+        """Drop least recently used keys, and blobs no key refers to, until the store fits in `max_bytes`."""
+        with self._lock:
+            refcounts = Counter(entry["digest"] for entry in self._entries.values())
+            sizes = {entry["digest"]: entry["size"] for entry in self._entries.values()}
+            total = sum(sizes.values())
+            if total <= self.max_bytes:
+                return
+
+            evicted_keys, removed = [], 0
+            for key, entry in sorted(self._entries.items(), key=lambda item: item[1]["last_access"]):
+                if total <= self.max_bytes:
+                    break
+                evicted_keys.append(key)
+                refcounts[entry["digest"]] -= 1
+                if refcounts[entry["digest"]] == 0:
+                    try:
+                        os.remove(self.blob_path(entry["digest"]))
+                    except FileNotFoundError:
+                        pass
+                    total -= entry["size"]
+                    removed += 1
+
+            for key in evicted_keys:
+                del self._entries[key]
+        print(f"Evicted {removed} images from the {self.name}")
+
+    def save(self) -> None:
+        with self._lock:
+            entries = {key: dict(entry) for key, entry in self._entries.items()}
+        os.makedirs(self.root, exist_ok=True)
+        atomic_write_json(self.index_path, entries)
+
+
+class BlobWriter:
+    """Incrementally hash and write one blob, then move it into the store."""
+
+    def __init__(self, store: BlobStore):
+        self.store = store
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        os.makedirs(store.blob_dir, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.blob_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self._hasher.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> Tuple[str, int]:
+        self._file.close()
+        digest = self._hasher.hexdigest()
+        path = self.store.blob_path(digest)
+        if os.path.exists(path):
+            os.remove(self.tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(self.tmp_path, 0o644)
+            os.replace(self.tmp_path, path)
+        return digest, self.size
+
+    def abort(self) -> None:
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
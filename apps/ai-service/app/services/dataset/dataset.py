@@ -1,19 +1,35 @@
 import os
 import cv2
-import requests
+import glob
 import random
 import shutil
+import json
+import hashlib
+import numpy as np
 
-from PIL import Image
 from urllib.parse import urlparse
-from io import BytesIO
-from typing import List
-from collections import defaultdict
-from app.services.dataset.preprocessing import Preprocessing
-from app.services.dataset.augmentation import Augmentation
+from typing import Callable, List, Optional, Tuple
+from app.services.dataset.preprocessing import Preprocessing, PreprocessingPlan
+from app.services.dataset.augmentation import Augmentation, Polygons, Recipe
+from app.services.dataset.augmentation_recipes import clear_recipes, load_recipes, save_recipes
+from app.services.dataset.online_augmentation import clear_augmentation_plan, load_augmentation_plan, save_augmentation_plan
+from app.services.dataset.image_cache import ImageCache
+from app.services.dataset.derived_cache import DerivedCache, config_digest, derived_key
+from app.services.dataset.lazy_preprocessing import clear_preprocess_plan, load_preprocess_config, save_preprocess_plan
+from app.services.dataset.image_format import encode_image, intermediate_path, with_intermediate, write_image
+from app.services.dataset.image_header import probe_image_size
+from app.services.dataset.manifest import (
+    invalidate_manifest, manifest_sources, mark_manifest_stale, read_manifest, save_manifest
+)
+from app.services.dataset.shards import pack_dataset, invalidate_shards
+from app.services.dataset.parallel import Throughput, parallel_map
+from app.services.dataset.pointwise import histogram_percentile, pixel_histogram
+from app.services.dataset.dedup import HammingIndex, dhash
+from app.services.dataset.dataset_index import DatasetIndex, invalidate_index, parse_annotation, split_of
 from app.models.preprocessing import ImagePreprocessingConfig
 from app.models.augmentation import DataAugmentationConfig
 from app.models.dataset import (
+    DatasetConfigRequest,
     PrepareDatasetRequest,
     ObjectDetectionPlot,
     SegmentationPlot,
@@ -23,55 +39,447 @@ from app.models.dataset import (
 
 preprocess = Preprocessing()
 augmentation = Augmentation()
+image_cache = ImageCache()
+preprocess_cache = DerivedCache()
+
+_worker_preprocess_plan: Optional[PreprocessingPlan] = None
+_worker_preprocess_cache: Optional[DerivedCache] = None
+_worker_config_digest: Optional[str] = None
+
+def init_preprocess_worker(config_preprocess: ImagePreprocessingConfig, threshold_value: Optional[float], cache_root: str):
+    global _worker_preprocess_plan, _worker_preprocess_cache, _worker_config_digest
+    _worker_preprocess_plan = preprocess.compile(config_preprocess, threshold_value)
+    # Read-only view of the cache as saved before this run
+    _worker_preprocess_cache = DerivedCache(cache_root)
+    _worker_config_digest = config_digest(config_preprocess, threshold_value=threshold_value)
+
+def init_threshold_worker(config_preprocess: ImagePreprocessingConfig):
+    global _worker_preprocess_plan
+    _worker_preprocess_plan = preprocess.compile_prefix(config_preprocess, 'thresh_percent')
 
-def preprocess_all_dataset(dataset_dir: str, config_preprocess: ImagePreprocessingConfig):
+def threshold_histogram_file(file_path: str) -> Optional[np.ndarray]:
+    """Pixel histogram of one image as it reaches the thresholding step."""
+    try:
+        image = cv2.imread(file_path)
+        if image is None:
+            return None
+        image = _worker_preprocess_plan(image)
+    except Exception:
+        # Reported by the preprocessing pass itself
+        return None
+    if image.dtype != np.uint8:
+        return None
+    return pixel_histogram(image)
+
+def dataset_threshold(file_paths: List[str], config_preprocess: ImagePreprocessingConfig) -> Optional[float]:
+    """
+    One `thresh_percent` threshold over every pixel of `file_paths`.
+
+    Each image only contributes its 256-bin histogram, so this is a single
+    streaming pass that never holds more than one image per worker.
+    """
+    hist = np.zeros(256, dtype=np.int64)
+    results = parallel_map(
+        threshold_histogram_file, file_paths, initializer=init_threshold_worker, initargs=(config_preprocess,))
+    for image_hist in results:
+        if image_hist is not None:
+            hist += image_hist
+    if not hist.any():
+        return None
+    return histogram_percentile(hist, config_preprocess.thresh_percent)
+
+def image_files(dataset_dir: str) -> List[str]:
+    file_paths = []
     for root, dirs, files in os.walk(dataset_dir):
         for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-                file_path = os.path.join(root, file)
-                try:
-                    image = cv2.imread(file_path)
-                    if image is not None:
-                        # Preprocess the image
-                        image = preprocess.preprocess(image, config_preprocess)
-                        # Save the resized image back to the same file path
-                        cv2.imwrite(file_path, image)
-                        # print(f"Saved: {file_path}")
-                    else:
-                        print(f"Failed to read image: {file_path}")
-                except Exception as e:
-                    print(f"Failed to process {file_path}: {e}")
-
-
-def augment_class_images(class_path: str, target_number_per_class: int, config_augmentation: DataAugmentationConfig):
-    # Collect only original images before augmentation
-    images = [os.path.join(class_path, f) for f in os.listdir(
-        class_path) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    # Copy the list to avoid modifying it during augmentation
-    original_images = list(images)
-    augmented_images = []  # To store newly created augmented images
+            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif')):
+                file_paths.append(os.path.join(root, file))
+    return file_paths
+
+def preprocess_tasks(dataset_dir: str, file_paths: List[str]) -> List[dict]:
+    """
+    Where the unprocessed pixels of each image in `file_paths` are.
+
+    Synced images are read from the image cache blob the manifest records
+    for them, never from the tree, where an earlier config may have replaced
+    them; `materialized` is the preprocessing key a file already holds.
+    Images the manifest does not know are their own source.
+    """
+    manifest = read_manifest(dataset_dir)
+    sources = manifest_sources(manifest)
+    preprocessed = (manifest or {}).get("preprocessed", {})
+    tasks = []
+    for file_path in file_paths:
+        rel_path = os.path.relpath(file_path, dataset_dir)
+        record = preprocessed.get(rel_path)
+        if record is not None:
+            source_path, source_digest, materialized = record["source_path"], record["source"], record["key"]
+        else:
+            source_path, source_digest, materialized = rel_path, sources.get(rel_path), None
+        tasks.append({
+            "path": file_path,
+            "source_path": os.path.join(dataset_dir, source_path),
+            "source_digest": source_digest,
+            "blob": None if source_digest is None else image_cache.blob_path(source_digest),
+            "materialized": materialized,
+        })
+    return tasks
+
+def readable_source(task: dict) -> str:
+    if task["blob"] is not None and os.path.exists(task["blob"]):
+        return task["blob"]
+    return task["path"]
+
+def preprocess_file(task: dict) -> Tuple[Optional[str], Optional[dict]]:
+    """
+    Put the preprocessed version of one image in the tree, from the preprocessing cache when possible.
+
+    The source is read as planned by `preprocess_tasks` and never modified.
+    A file that already holds the result for its source and config is left
+    alone; on a cache miss the source is preprocessed and the result added
+    to the cache. Returns (error message, record for the parent to save).
+    """
+    file_path = task["path"]
+    try:
+        output_path = intermediate_path(task["source_path"])
+        if output_path != file_path and os.path.exists(output_path):
+            # Never replace a different image that already has the target name
+            output_path = file_path
+        extension = os.path.splitext(output_path)[1]
+
+        source_digest = task["source_digest"]
+        if source_digest is not None and output_path == file_path:
+            key = derived_key(source_digest, _worker_config_digest, extension)
+            if key == task["materialized"]:
+                return None, {"key": key, "source": source_digest, "path": output_path, "skipped": True}
+
+        source = readable_source(task)
+        if source == file_path:
+            # Not synced, or evicted from the image cache: the file is all there is
+            source_digest = None
+        with open(source, "rb") as f:
+            data = f.read()
+        if source_digest is None:
+            source_digest = hashlib.sha256(data).hexdigest()
+        key = derived_key(source_digest, _worker_config_digest, extension)
+
+        entry = _worker_preprocess_cache.lookup(key)
+        hit = entry is not None
+        if not hit:
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                return f"Failed to read image: {source}", None
+            # Preprocess the image
+            image = _worker_preprocess_plan(image)
+            encoded = encode_image(output_path, image)
+            writer = _worker_preprocess_cache.open_writer()
+            try:
+                writer.write(encoded)
+                digest, size = writer.commit()
+            except BaseException:
+                writer.abort()
+                raise
+            entry = {"digest": digest, "size": size}
+        # A new inode, so hardlinked cache blobs are never modified in place
+        _worker_preprocess_cache.link(entry["digest"], output_path)
+        if output_path != file_path:
+            os.remove(file_path)
+        return None, {
+            "key": key, "source": source_digest, "path": output_path, "skipped": False,
+            "digest": entry["digest"], "size": entry["size"], "hit": hit,
+        }
+    except Exception as e:
+        return f"Failed to process {file_path}: {e}", None
+
+def refresh_augmentations(dataset_dir: str, changed: List[str], renamed: dict):
+    """Regenerate the augmented images whose source, relative to `dataset_dir`, was `changed` or `renamed`."""
+    recipes = load_recipes(dataset_dir)
+    paths = []
+    for path, entry in recipes.items():
+        if entry["source"] in changed:
+            entry["source"] = renamed.get(entry["source"], entry["source"])
+            paths.append(path)
+    if not paths:
+        return
+    save_recipes(dataset_dir, recipes)
+    print(f"Regenerating {len(paths)} augmented images from their changed sources")
+    regenerate_augmentations(dataset_dir, paths)
+
+def restore_sources(dataset_dir: str) -> bool:
+    """
+    Put the synced images back in place of their preprocessed versions.
+
+    Returns whether any file changed; augmented images of restored sources
+    are regenerated from their recipes.
+    """
+    manifest = read_manifest(dataset_dir)
+    preprocessed = (manifest or {}).get("preprocessed")
+    if not preprocessed:
+        return False
+
+    kept, changed, renamed = {}, [], {}
+    for rel_output, record in preprocessed.items():
+        output_path = os.path.join(dataset_dir, rel_output)
+        source_path = os.path.join(dataset_dir, record["source_path"])
+        if not os.path.exists(image_cache.blob_path(record["source"])):
+            print(f"Source of {output_path} is no longer cached; keeping its preprocessed version")
+            kept[rel_output] = record
+            continue
+        image_cache.link(record["source"], source_path)
+        if source_path != output_path and os.path.lexists(output_path):
+            os.unlink(output_path)
+        changed.append(rel_output)
+        renamed[rel_output] = record["source_path"]
+
+    print(f"Restored {len(changed)} unprocessed images")
+    mark_manifest_stale(dataset_dir, preprocessed=kept)
+    invalidate_shards(dataset_dir)
+    refresh_augmentations(dataset_dir, changed, renamed)
+    return True
+
+def preprocess_all_dataset(
+    dataset_dir: str,
+    config_preprocess: ImagePreprocessingConfig,
+    lazy: bool = False,
+    threshold_value: Optional[float] = None,
+):
+    """
+    Preprocess every image of `dataset_dir` from its unprocessed source.
+
+    Synced images are read from the image cache, so a config replaces the
+    previous one rather than applying on top of it, and files that already
+    hold the result are skipped. Augmented images are not preprocessed
+    again but regenerated from their recipes once their source changed.
+
+    With `lazy`, the files are restored to their sources and the config is
+    stored next to the dataset for the training loaders to apply at load
+    time.
+    """
+    if lazy and restore_sources(dataset_dir):
+        DatasetIndex.build(dataset_dir).save()
+        pack_dataset(dataset_dir)
+
+    augmented = load_recipes(dataset_dir)
+    tasks = preprocess_tasks(dataset_dir, [
+        path for path in image_files(dataset_dir) if os.path.relpath(path, dataset_dir) not in augmented
+    ])
+
+    if threshold_value is None and config_preprocess.thresh_scope == 'dataset' and config_preprocess.thresh_percent and 'thresh_percent' in config_preprocess.priority:
+        # Fitted on the training images only, so validation and test pixels never shape the inputs
+        train_dir = os.path.join(dataset_dir, "train") + os.sep
+        threshold_value = dataset_threshold(
+            [readable_source(task) for task in tasks if task["path"].startswith(train_dir)], config_preprocess)
+        print(f"Training set threshold at the {config_preprocess.thresh_percent}th percentile: {threshold_value}")
+
+    if lazy:
+        save_preprocess_plan(dataset_dir, config_preprocess, threshold_value)
+        print(f"Preprocessing of {len(tasks)} images deferred to load time")
+        return
 
-    current_number = len(images)
-    more_aug_needed = target_number_per_class - current_number
+    preprocess_cache.save()
+    throughput = Throughput("Preprocessed", len(tasks))
+    results = parallel_map(
+        preprocess_file, tasks, initializer=init_preprocess_worker,
+        initargs=(config_preprocess, threshold_value, preprocess_cache.root))
+    hits = skipped = 0
+    preprocessed, changed, renamed = {}, [], {}
+    for task, (error, record) in zip(tasks, results):
+        if error:
+            print(error)
+        if record:
+            rel_path = os.path.relpath(task["path"], dataset_dir)
+            rel_output = os.path.relpath(record["path"], dataset_dir)
+            preprocessed[rel_output] = {
+                "source_path": os.path.relpath(task["source_path"], dataset_dir),
+                "source": record["source"],
+                "key": record["key"],
+            }
+            if record["skipped"]:
+                skipped += 1
+            else:
+                preprocess_cache.record(record["key"], record["digest"], record["size"])
+                hits += record["hit"]
+                changed.append(rel_path)
+                renamed[rel_path] = rel_output
+        throughput.update()
+    throughput.report()
+    print(f"Reused {hits} preprocessed images from the preprocessing cache, {skipped} already in place")
+    preprocess_cache.evict()
+    preprocess_cache.save()
+    mark_manifest_stale(dataset_dir, preprocessed=preprocessed)
+    refresh_augmentations(dataset_dir, changed, renamed)
+    # Names and sizes may have changed, and later stages read them from the index
+    DatasetIndex.build(dataset_dir).save()
+
+def materialize_preprocessing(dataset_dir: str):
+    """
+    Write a pending lazy preprocessing plan into the image files.
+
+    Needed by stages that change the files and by consumers that read them
+    directly rather than through the classification loaders.
+    """
+    stored = load_preprocess_config(dataset_dir)
+    if stored is None:
+        return
+    print("Applying deferred preprocessing")
+    invalidate_shards(dataset_dir)
+    config_preprocess, threshold_value = stored
+    preprocess_all_dataset(dataset_dir, config_preprocess, threshold_value=threshold_value)
+    clear_preprocess_plan(dataset_dir)
+    pack_dataset(dataset_dir)
+
+_worker_augmentation_config: Optional[DataAugmentationConfig] = None
+
+def init_augmentation_worker(config_augmentation: DataAugmentationConfig):
+    global _worker_augmentation_config
+    _worker_augmentation_config = config_augmentation
+
+def augment_file(task: dict) -> Tuple[Optional[str], Optional[Recipe], Optional[str]]:
+    """
+    Write one augmented image, and its annotation, as planned in `task`.
+
+    The recipe is drawn from a generator seeded with the task's seed, unless
+    the task replays a recorded one, so the output does not depend on which
+    worker runs it. Returns (error message, recipe, path written).
+    """
+    try:
+        image = cv2.imread(task["source"])
+        if image is None:
+            return f"Failed to read image: {task['source']}", None, None
+
+        recipe = task["recipe"]
+        if recipe is None:
+            recipe = augmentation.draw_recipe(_worker_augmentation_config, np.random.default_rng(task["seed"]))
+        if task["polygons"] is not None:
+            augmented_img, polygons = augmentation.apply_recipe_segmentation(image, recipe, task["polygons"])
+            annotation = "".join(" ".join(str(value) for value in row) + "\n" for row in polygons.rows())
+        elif task["boxes"] is not None:
+            augmented_img, adjusted_bounding_box = augmentation.apply_recipe(image, recipe, task["boxes"])
+            annotation = "".join(
+                f"{int(class_id)} {x_center} {y_center} {width} {height}\n"
+                for class_id, x_center, y_center, width, height in adjusted_bounding_box.tolist())
+        else:
+            augmented_img, _ = augmentation.apply_recipe(image, recipe)
+            annotation = None
+            if task["annotation_source"] is not None:
+                with open(task["annotation_source"], "r") as src:
+                    annotation = src.read()
+
+        written = write_image(task["target"], augmented_img)
+        if annotation is not None:
+            with open(task["annotation_target"], "w") as file:
+                file.write(annotation)
+        return None, recipe, written
+    except Exception as e:
+        return f"Failed to augment {task['source']}: {e}", None, None
+
+def augmentation_task(source: str, target: str, boxes: Optional[np.ndarray] = None,
+                      annotation_source: Optional[str] = None, annotation_target: Optional[str] = None,
+                      recipe: Optional[Recipe] = None, polygons: Optional[Polygons] = None) -> dict:
+    return {
+        "source": source,
+        "target": target,
+        "boxes": boxes,
+        "polygons": polygons,
+        "annotation_source": annotation_source,
+        "annotation_target": annotation_target,
+        "recipe": recipe,
+    }
+
+class AugmentationNames:
+    """Collision-free names for augmented images: a counter that skips names already taken."""
+
+    def __init__(self):
+        self.counter = 0
+        self.taken = set()
+
+    def next(self, directory: str, name_for: Callable[[int], str]) -> Tuple[str, int]:
+        while True:
+            number = self.counter
+            self.counter += 1
+            path = os.path.join(directory, name_for(number))
+            written = intermediate_path(path)
+            if written not in self.taken and not os.path.exists(written):
+                self.taken.add(written)
+                return path, number
+
+def run_augmentation(dataset_dir: str, tasks: List[dict], config_augmentation: Optional[DataAugmentationConfig]):
+    """
+    Generate the planned augmentations in a process pool.
 
+    Every new task gets its own seed from one `SeedSequence`, seeded with
+    `config_augmentation.seed`, so a seeded run produces the same images on
+    any number of workers. The recipe of each image written is recorded in the
+    dataset's recipe file, from which it can be regenerated.
+    """
+    new_tasks = [task for task in tasks if task["recipe"] is None]
+    seed = None if config_augmentation is None else config_augmentation.seed
+    seeds = np.random.SeedSequence(seed).generate_state(len(new_tasks))
+    for task, seed in zip(new_tasks, seeds):
+        task["seed"] = int(seed)
+
+    def relative(path: Optional[str]) -> Optional[str]:
+        return None if path is None else os.path.relpath(path, dataset_dir)
+
+    recipes = load_recipes(dataset_dir)
+    throughput = Throughput("Augmented", len(tasks))
+    results = parallel_map(
+        augment_file, tasks, initializer=init_augmentation_worker, initargs=(config_augmentation,))
+    for task, (error, recipe, written) in zip(tasks, results):
+        if error:
+            print(error)
+        else:
+            recipes[relative(written)] = {
+                "source": relative(task["source"]),
+                "boxes": None if task["boxes"] is None else task["boxes"].tolist(),
+                "polygons": None if task["polygons"] is None else task["polygons"].rows(),
+                "annotation_source": relative(task["annotation_source"]),
+                "annotation_target": relative(task["annotation_target"]),
+                "seed": task["seed"],
+                "recipe": recipe,
+            }
+        throughput.update()
+    save_recipes(dataset_dir, recipes)
+    throughput.report()
+
+def regenerate_augmentations(dataset_dir: str, paths: Optional[List[str]] = None):
+    """Rewrite augmented images, all or `paths` relative to `dataset_dir`, from their recorded recipes."""
+    recipes = load_recipes(dataset_dir)
+
+    def absolute(path: Optional[str]) -> Optional[str]:
+        return None if path is None else os.path.join(dataset_dir, path)
+
+    tasks = []
+    for path in (recipes if paths is None else paths):
+        entry = recipes[path]
+        boxes, polygons = entry["boxes"], entry.get("polygons")
+        task = augmentation_task(
+            absolute(entry["source"]), absolute(path),
+            boxes=None if boxes is None else np.asarray(boxes, dtype=np.float64).reshape(-1, 5),
+            annotation_source=absolute(entry["annotation_source"]),
+            annotation_target=absolute(entry["annotation_target"]),
+            recipe=entry["recipe"],
+            polygons=None if polygons is None else Polygons.from_rows(polygons))
+        task["seed"] = entry["seed"]
+        tasks.append(task)
+    run_augmentation(dataset_dir, tasks, None)
+
+def class_augmentation_tasks(class_path: str, target_number_per_class: int, names: AugmentationNames,
+                             rng: random.Random) -> List[dict]:
+    # Collect only original images before augmentation
+    original_images = sorted(os.path.join(class_path, f) for f in os.listdir(
+        class_path) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')))
+    if not original_images:
+        return []
+
+    tasks = []
+    more_aug_needed = target_number_per_class - len(original_images)
     for _ in range(more_aug_needed):
         # Select from original images only
-        random_image_path = random.choice(original_images)
-        image = cv2.imread(random_image_path)
-        if image is not None:
-            augmented_img = augmentation.augmentation_classification(
-                image, config_augmentation)  # Perform your augmentation
-            # Generate a new filename for the augmented image
-            new_filename = f"aug_{random.randint(0, 1e6)}.jpg"
-            new_file_path = os.path.join(class_path, new_filename)
-            cv2.imwrite(new_file_path, augmented_img)
-            # Keep track of the new augmented image
-            augmented_images.append(new_file_path)
-            print(f"Augmented image saved to: {new_file_path}")
-
-    # Append newly augmented images to the original list
-    images.extend(augmented_images)
-
+        random_image_path = rng.choice(original_images)
+        new_file_path, _ = names.next(class_path, lambda number: f"aug_{number}.jpg")
+        tasks.append(augmentation_task(random_image_path, new_file_path))
+    return tasks
 
 def augment_dataset_class(training_path: str, config_augmentation: DataAugmentationConfig):
     # List all class directories
@@ -81,151 +489,195 @@ def augment_dataset_class(training_path: str, config_augmentation: DataAugmentat
 
     # Calculate target number per class
     target_number_per_class = config_augmentation.number // number_of_classes
-    for class_name in class_dirs:
+    names = AugmentationNames()
+    rng = random.Random(config_augmentation.seed)
+    tasks = []
+    for class_name in sorted(class_dirs):
         class_path = os.path.join(training_path, class_name)
-        augment_class_images(
-            class_path, target_number_per_class, config_augmentation)
+        tasks.extend(class_augmentation_tasks(class_path, target_number_per_class, names, rng))
+    run_augmentation(split_of(training_path)[0], tasks, config_augmentation)
 
 
-def augment_dataset_obj(folder_path: str, config_augmentation: DataAugmentationConfig):
-    # Get all images and corresponding .txt files in the folder
-    image_files = [f for f in os.listdir(folder_path) if f.endswith('.jpg')]
-    txt_files = [f.replace('.jpg', '.txt') for f in image_files]
-
-    # Group images by class based on the content of their .txt files
-    class_to_images = defaultdict(list)
-    for image_file, txt_file in zip(image_files, txt_files):
-        txt_path = os.path.join(folder_path, txt_file)
-        with open(txt_path, 'r') as file:
-            # Assuming each line in the .txt file starts with the class label
-            class_label = file.readline().split()[0]
-        class_to_images[class_label].append((image_file, txt_file))
-
-    total_current_images = len(image_files)
+def augmentations_per_class(class_to_images: dict, config_augmentation: DataAugmentationConfig) -> Optional[dict]:
+    total_current_images = sum(len(images) for images in class_to_images.values())
     num_augmentations_needed = config_augmentation.number - total_current_images
     if num_augmentations_needed <= 0:
         print("Target number of images already met or exceeded.")
-        return
+        return None
 
     # Calculate number of augmentations needed per class
-    augmentations_per_class = {}
-    total_classes = len(class_to_images)
-    for class_label, images in class_to_images.items():
-        current_count = len(images)
-        augmentations_per_class[class_label] = max(
-            0, int(num_augmentations_needed * (current_count / total_current_images)))
+    return {
+        class_label: max(0, int(num_augmentations_needed * (len(images) / total_current_images)))
+        for class_label, images in class_to_images.items()
+    }
+
 
-    # Perform augmentations
+def augment_dataset_obj(folder_path: str, config_augmentation: DataAugmentationConfig):
+    # Group images by the class of their first box, as recorded in the dataset index
+    base_dir, split = split_of(folder_path)
+    class_to_images = DatasetIndex.load(base_dir).group_by_first_class(split, with_intermediate(('.jpg',)))
+    needed = augmentations_per_class(class_to_images, config_augmentation)
+    if needed is None:
+        return
+
+    # Box arrays of each source image, built once however often it is picked
+    boxes = {}
+
+    # Plan augmentations
+    names = AugmentationNames()
+    rng = random.Random(config_augmentation.seed)
+    tasks = []
     for class_label, images in class_to_images.items():
-        needed_augmentations = augmentations_per_class[class_label]
-        for _ in range(needed_augmentations):
-            # Randomly select an image and its corresponding .txt file
-            image_file, txt_file = random.choice(images)
-
-            # Load the image
-            image_path = os.path.join(folder_path, image_file)
-            image = cv2.imread(image_path)
-
-            # Load the bounding boxes from the .txt file
-            txt_path = os.path.join(folder_path, txt_file)
-            bounding_box = []
-
-            with open(txt_path, 'r') as file:
-                lines = file.readlines()
-                for line in lines:
-                    values = line.strip().split()
-                    class_id = int(values[0])
-                    x_center = float(values[1])
-                    y_center = float(values[2])
-                    width = float(values[3])
-                    height = float(values[4])
-                    bounding_box.append(
-                        (class_id, x_center, y_center, width, height))
-
-            # Apply augmentation
-            augmented_img, adjusted_bounding_box = augmentation.augmentation_object_detection(
-                image, config_augmentation, bounding_box)
-
-            # Generate a unique suffix
-            unique_suffix = random.randint(1000, 9999)
-
-            # Save the augmented image
-            augmented_image_path = os.path.join(
-                folder_path, f"aug_{unique_suffix}_{image_file}")
-            cv2.imwrite(augmented_image_path, augmented_img)
-
-            # Save the adjusted bounding boxes back to a .txt file with the same name as the image
-            adjusted_txt_path = os.path.join(
-                folder_path, f"aug_{unique_suffix}_{image_file}.txt")
-            with open(adjusted_txt_path, 'w') as file:
-                for box in adjusted_bounding_box:
-                    class_id, x_center, y_center, width, height = box
-                    file.write(
-                        f"{class_id} {x_center} {y_center} {width} {height}\n")
+        for _ in range(needed[class_label]):
+            # Randomly select an image and its bounding boxes
+            entry = rng.choice(images)
+            image_file = entry["path"]
+            if image_file not in boxes:
+                boxes[image_file] = DatasetIndex.boxes(entry)
+            bounding_box = boxes[image_file]
+
+            # The adjusted bounding boxes go to a .txt file named after the augmented image
+            augmented_image_path, _ = names.next(folder_path, lambda number: f"aug_{number}_{image_file}")
+            tasks.append(augmentation_task(
+                os.path.join(folder_path, image_file), augmented_image_path, boxes=bounding_box,
+                annotation_target=os.path.splitext(intermediate_path(augmented_image_path))[0] + ".txt"))
+    run_augmentation(base_dir, tasks, config_augmentation)
 
 
 def augment_dataset_seg(folder_path: str, config_augmentation: DataAugmentationConfig):
-    # Get all images and corresponding .txt files in the folder
-    image_files = [f for f in os.listdir(folder_path) if f.endswith('.jpg')]
-    txt_files = [f.replace('.jpg', '.txt') for f in image_files]
-
-    # Group images by class based on the content of their .txt files
-    class_to_images = defaultdict(list)
-    for image_file, txt_file in zip(image_files, txt_files):
-        txt_path = os.path.join(folder_path, txt_file)
-        with open(txt_path, 'r') as file:
-            # Get first value in the first line
-            class_label = file.readline().split()[0]
-        class_to_images[class_label].append((image_file, txt_file))
-
-    total_current_images = len(image_files)
-    num_augmentations_needed = config_augmentation.number - total_current_images
-    if num_augmentations_needed <= 0:
-        print("Target number of images already met or exceeded.")
+    # Group images by the class of their first polygon, as recorded in the dataset index
+    base_dir, split = split_of(folder_path)
+    class_to_images = DatasetIndex.load(base_dir).group_by_first_class(split, with_intermediate(('.jpg',)))
+    needed = augmentations_per_class(class_to_images, config_augmentation)
+    if needed is None:
         return
 
-    # Calculate number of augmentations needed per class
-    augmentations_per_class = {}
-    total_classes = len(class_to_images)
-    for class_label, images in class_to_images.items():
-        current_count = len(images)
-        augmentations_per_class[class_label] = max(
-            0, int(num_augmentations_needed * (current_count / total_current_images)))
+    # Polygon arrays of each source image, built once however often it is picked
+    polygons = {}
 
-    # Perform augmentations
+    # Plan augmentations
+    names = AugmentationNames()
+    rng = random.Random(config_augmentation.seed)
+    tasks = []
     for class_label, images in class_to_images.items():
-        needed_augmentations = augmentations_per_class[class_label]
-        for _ in range(needed_augmentations):
-
+        for _ in range(needed[class_label]):
             # Randomly choose an image
-            image_file, txt_file = random.choice(images)
-            # Load the image
-            image_path = os.path.join(folder_path, image_file)
-            image = cv2.imread(image_path)
-
-            # Load the bounding boxes from the .txt file (if it exists)
-            txt_path = os.path.join(folder_path, txt_file)
-            if os.path.exists(txt_path):
-                with open(txt_path, "r") as src:
-                    content = src.read()  # Read the entire file
-
-            # Apply augmentation
-            augmented_img = augmentation.augmentation_classification(
-                image, config_augmentation)
-
-            # Generate a unique suffix
-            unique_suffix = random.randint(1000, 9999)
-
-            # Save the augmented image
-            augmented_image_path = os.path.join(
-                folder_path, f"aug_{unique_suffix}_{image_file}")
-            cv2.imwrite(augmented_image_path, augmented_img)
-
-            # Save bounding box file with the same name and location
-            adjusted_txt_path = os.path.join(
-                folder_path, f"aug_{unique_suffix}_{txt_file}")
-            with open(adjusted_txt_path, 'w') as file:
-                file.write(content)  # Corrected to use 'file.write'
+            entry = rng.choice(images)
+            image_file = entry["path"]
+            txt_file = os.path.splitext(image_file)[0] + '.txt'
+            if image_file not in polygons:
+                polygons[image_file] = Polygons.from_rows(entry["annotation"])
+
+            # The transformed polygons go to a .txt file with the same name and location
+            augmented_image_path, number = names.next(folder_path, lambda number: f"aug_{number}_{image_file}")
+            tasks.append(augmentation_task(
+                os.path.join(folder_path, image_file), augmented_image_path,
+                annotation_target=os.path.join(folder_path, f"aug_{number}_{txt_file}"),
+                polygons=polygons[image_file]))
+    run_augmentation(base_dir, tasks, config_augmentation)
+
+def configure_dataset(config: DatasetConfigRequest, dataset_dir: str = "dataset"):
+    """
+    Apply a /dataset-config request to `dataset_dir`.
+
+    Preprocessing always starts from the synced sources, so a new config
+    replaces a pending lazy plan instead of being applied on top of it.
+    The plan is only written into the files when offline augmentation
+    needs the preprocessed pixels and no new config is given.
+    """
+    augment = bool(config.augmentation and config.type) and not config.online_augmentation
+    # Augmentation works on the preprocessed pixels, so it needs them on disk
+    lazy = config.lazy_preprocess and not augment
+    if config.preprocess and not lazy:
+        clear_preprocess_plan(dataset_dir)
+    elif augment and not config.preprocess:
+        materialize_preprocessing(dataset_dir)
+    files_changed = bool((config.preprocess and not lazy) or augment)
+    if files_changed:
+        # Files are about to change; next /dataset must rebuild the tree
+        mark_manifest_stale(dataset_dir)
+        invalidate_shards(dataset_dir)
+
+    # TODO: Preprocess images
+    if config.preprocess:
+        print("DOING PREPROCESS")
+        preprocess_all_dataset(dataset_dir, config.preprocess, lazy=lazy)
+
+    if config.augmentation:
+        clear_augmentation_plan(dataset_dir)
+        if config.online_augmentation:
+            # Training batches are augmented as they are built
+            save_augmentation_plan(dataset_dir, config.augmentation)
+
+    # TODO: Augmentation
+    if augment:
+        augment_dataset(dataset_dir, config.type, config.augmentation)
+
+    if files_changed:
+        DatasetIndex.build(dataset_dir).save()
+        pack_dataset(dataset_dir)
+    if config.augmentation:
+        check_crop(dataset_dir, config.augmentation)
+
+def augment_dataset(dataset_dir: str, dataset_type: str, config_augmentation: DataAugmentationConfig):
+    """Write augmented training images until the training split holds `config_augmentation.number`."""
+    print("DOING AUGMENTATION")
+    training_path = os.path.join(dataset_dir, "train")
+
+    # Count how many training dataset exist
+    image_extensions = ['*.png', '*.jpg', '*.webp']
+    image_count = 0
+    for ext in image_extensions:
+        image_count += len(glob.glob(os.path.join(training_path,
+                        '**', ext), recursive=True))
+
+    total_target_number = config_augmentation.number - image_count
+    print("TOTAL TARGER:", total_target_number)
+
+    # Do Augmentation
+    if total_target_number > 0:
+        if dataset_type == "classification":
+            augment_dataset_class(
+                training_path, config_augmentation)
+        if dataset_type == "object_detection":
+            augment_dataset_obj(
+                training_path, config_augmentation)
+        if dataset_type == "segmentation":
+            augment_dataset_seg(
+                training_path, config_augmentation)
+
+def materialize_augmentation(dataset_dir: str):
+    """
+    Turn a pending online augmentation plan into augmented image files.
+
+    Needed by trainers that read the files directly rather than through
+    the batches the plan is applied to.
+    """
+    config_augmentation = load_augmentation_plan(dataset_dir)
+    if config_augmentation is None:
+        return
+    print("Writing online augmentation to the files, which this trainer reads directly")
+    materialize_preprocessing(dataset_dir)
+    dataset_type = (read_manifest(dataset_dir) or {}).get("type")
+    mark_manifest_stale(dataset_dir)
+    invalidate_shards(dataset_dir)
+    augment_dataset(dataset_dir, dataset_type, config_augmentation)
+    clear_augmentation_plan(dataset_dir)
+    DatasetIndex.build(dataset_dir).save()
+    pack_dataset(dataset_dir)
+
+def check_crop(dataset_dir: str, config_augmentation: DataAugmentationConfig):
+    """Warn once about training images too small for the configured crop, which augmentation leaves uncropped."""
+    if not config_augmentation.crop or 'crop' not in config_augmentation.priority:
+        return
+    (w, h), (x, y) = config_augmentation.crop[1], config_augmentation.crop[2]
+    entries = DatasetIndex.load(dataset_dir).entries("train")
+    too_small = sum(1 for entry in entries if x + w > entry["width"] or y + h > entry["height"])
+    if too_small:
+        print(
+            f"[WARNING] Crop area ({x},{y},{w},{h}) out of bounds for {too_small} of {len(entries)} "
+            f"training images. Skipping crop for them."
+        )
 
 def normalize(value: int, max_value: int) -> float:
     return value / max_value
@@ -304,63 +756,275 @@ def reverse_convert_segmentation(annotation: List[SegmentationPredict], img_widt
     
     return result
 
-def prepare_dataset(request: PrepareDatasetRequest):
-    base_dir = "dataset"
-    if os.path.exists(base_dir):
-        shutil.rmtree(base_dir)
-    os.makedirs(os.path.join(base_dir, "train"), exist_ok=True)
-    os.makedirs(os.path.join(base_dir, "test"), exist_ok=True)
-    os.makedirs(os.path.join(base_dir, "valid"), exist_ok=True)
-
-    datasets = {
-        "train": request.train_data,
-        "test": request.test_data,
-        "valid": request.valid_data
-    }
-    
-    # sorted_labels = sorted(request.labels)
-    sorted_labels = request.labels
-
-    if request.type in ["object_detection", "segmentation"]:
-        label_content = "\n".join(sorted_labels)
-        for split in datasets.keys():
-            label_path = os.path.join(base_dir, split, "label.txt")
-            with open(label_path, "w") as f:
-                f.write(label_content)
-
-    for split, images in datasets.items():
-        split_dir = os.path.join(base_dir, split)
-
-        for img in images:
-            parsed_url = urlparse(img.url)
-            image_filename = os.path.basename(parsed_url.path)
-
-            response = requests.get(img.url, stream=True)
-            if response.status_code == 200:
-                image = Image.open(BytesIO(response.content))
-                img_width, img_height = image.size
-
-                if request.type == "classification":
-                    class_folder = os.path.join(split_dir, img.annotation.label)
-                    os.makedirs(class_folder, exist_ok=True)
-                    image_path = os.path.join(class_folder, image_filename)
-                else:
-                    image_path = os.path.join(split_dir, image_filename)
-
-                with open(image_path, 'wb') as file:
-                    file.write(response.content)
-
-                if request.type == "object_detection":
-                    annotation_text = convert_object_detection(
-                        img.annotation.annotation, sorted_labels, img_width, img_height
-                    )
-                elif request.type == "segmentation":
-                    annotation_text = convert_segmentation(
-                        img.annotation.annotation, sorted_labels, img_width, img_height
-                    )
-                else:
-                    continue
-
-                annotation_path = image_path.replace(".png", ".txt").replace(".jpg", ".txt")
-                with open(annotation_path, "w") as f:
-                    f.write(annotation_text)
\ No newline at end of file
+def image_relpath(request: PrepareDatasetRequest, split: str, img) -> str:
+    image_filename = os.path.basename(urlparse(img.url).path)
+    if request.type == "classification":
+        return os.path.join(split, img.annotation.label, image_filename)
+    return os.path.join(split, image_filename)
+
+def annotation_relpath(image_path: str) -> str:
+    return image_path.replace(".png", ".txt").replace(".jpg", ".txt")
+
+def convert_annotation(request: PrepareDatasetRequest, img, labels: List[str], img_width: int, img_height: int) -> Optional[str]:
+    if request.type == "object_detection":
+        return convert_object_detection(img.annotation.annotation, labels, img_width, img_height)
+    if request.type == "segmentation":
+        return convert_segmentation(img.annotation.annotation, labels, img_width, img_height)
+    return None
+
+def remove_empty_dirs(base_dir: str):
+    for root, dirs, files in os.walk(base_dir, topdown=False):
+        if root != base_dir and os.path.dirname(root) != base_dir and not os.listdir(root):
+            os.rmdir(root)
+
+class DatasetSync:
+    """
+    Materialize a `PrepareDatasetRequest` under `dataset/`.
+
+    The previous run's manifest records, per image path, the source URL, the
+    cached blob digest, the image size and a hash of the annotation file. When
+    `request.incremental` is set and the manifest matches the dataset type,
+    only the difference is applied: stale files are removed, known URLs are
+    relinked from the image cache at their new path, changed annotations are
+    rewritten, and only URLs never seen before need to be fetched.
+
+    `plan()` applies everything that needs no network and returns the images
+    still to download; each downloaded blob is then passed to `add()`, and
+    `finish()` deduplicates and writes the manifest.
+
+    With `request.dedup` set, images are compared in train, test, valid order
+    and each one that is an exact or perceptual (dHash within
+    `request.dedup_distance` bits) copy of an earlier image is flagged in
+    `dedup_report.json`, or also left out of the tree in "skip" mode.
+    """
+
+    def __init__(self, request: PrepareDatasetRequest, base_dir: str = "dataset", log: Callable[[str], None] = print):
+        self.request = request
+        self.base_dir = base_dir
+        self.log = log
+        # sorted_labels = sorted(request.labels)
+        self.labels = request.labels
+        self.old_entries = {}
+        self.entries = {}
+        self.desired = {}
+        self.fetched = 0
+        self.moved = 0
+        self.removed = 0
+        self.rewritten = 0
+
+    def is_skipped(self, entry: dict) -> bool:
+        return self.request.dedup == "skip" and entry.get("duplicate_of") is not None
+
+    def plan(self) -> List[Tuple[str, object]]:
+        request = self.request
+        base_dir = self.base_dir
+        manifest = read_manifest(base_dir) if request.incremental else None
+        if manifest is None or manifest.get("type") != request.type:
+            if os.path.exists(base_dir):
+                shutil.rmtree(base_dir)
+            manifest = {"type": request.type, "labels": None, "entries": {}}
+        elif manifest.get("stale"):
+            # Later stages changed the files; rebuild the tree, relinking
+            # every known image from the cache instead of downloading it
+            shutil.rmtree(base_dir)
+            manifest = {"type": request.type, "labels": None, "entries": manifest["entries"]}
+
+        os.makedirs(os.path.join(base_dir, "train"), exist_ok=True)
+        os.makedirs(os.path.join(base_dir, "test"), exist_ok=True)
+        os.makedirs(os.path.join(base_dir, "valid"), exist_ok=True)
+        # Keep the manifest and packed shards out of the way until the tree is consistent again
+        invalidate_manifest(base_dir)
+        invalidate_shards(base_dir)
+        invalidate_index(base_dir)
+        # The synced files are unprocessed again
+        clear_preprocess_plan(base_dir)
+        clear_recipes(base_dir)
+        clear_augmentation_plan(base_dir)
+
+        datasets = {
+            "train": request.train_data,
+            "test": request.test_data,
+            "valid": request.valid_data
+        }
+
+        if request.type in ["object_detection", "segmentation"] and manifest["labels"] != self.labels:
+            label_content = "\n".join(self.labels)
+            for split in datasets.keys():
+                label_path = os.path.join(base_dir, split, "label.txt")
+                with open(label_path, "w") as f:
+                    f.write(label_content)
+
+        self.old_entries = manifest["entries"]
+        known = {entry["url"]: entry for entry in self.old_entries.values()}
+
+        for split, images in datasets.items():
+            for img in images:
+                self.desired[image_relpath(request, split, img)] = img
+
+        pending = []
+        for rel_path, img in self.desired.items():
+            entry = known.get(ImageCache.url_key(img.url))
+            if entry and os.path.exists(image_cache.blob_path(entry["digest"])):
+                self.entries[rel_path] = dict(entry)
+                # Still in use, so the last to be evicted
+                image_cache.touch(img.url)
+            else:
+                pending.append((rel_path, img))
+
+        # Remove images that are no longer wanted at their old path
+        wanted_urls = {ImageCache.url_key(img.url) for img in self.desired.values()}
+        for rel_path, entry in self.old_entries.items():
+            current = self.entries.get(rel_path)
+            if current is None or current["digest"] != entry["digest"]:
+                for path in {rel_path, annotation_relpath(rel_path)}:
+                    path = os.path.join(base_dir, path)
+                    if os.path.lexists(path):
+                        os.unlink(path)
+                if entry["url"] not in wanted_urls:
+                    self.removed += 1
+        remove_empty_dirs(base_dir)
+
+        # Relink known images that moved (split or label change)
+        for rel_path, entry in self.entries.items():
+            if self.is_skipped(entry):
+                continue
+            old_entry = self.old_entries.get(rel_path)
+            image_path = os.path.join(base_dir, rel_path)
+            if old_entry is None or old_entry["digest"] != entry["digest"] or not os.path.exists(image_path):
+                os.makedirs(os.path.dirname(image_path), exist_ok=True)
+                image_cache.link(entry["digest"], image_path)
+                self.moved += 1
+            if self.write_annotation(rel_path, self.desired[rel_path], entry):
+                self.rewritten += 1
+
+        return pending
+
+    def write_annotation(self, rel_path: str, img, entry: dict) -> bool:
+        annotation_text = convert_annotation(self.request, img, self.labels, entry["width"], entry["height"])
+        if annotation_text is None:
+            return False
+        annotation_hash = hashlib.sha1(annotation_text.encode()).hexdigest()
+        annotation_path = os.path.join(self.base_dir, annotation_relpath(rel_path))
+        old_entry = self.old_entries.get(rel_path)
+        if old_entry and old_entry.get("annotation") == annotation_hash and os.path.exists(annotation_path):
+            return False
+        with open(annotation_path, "w") as f:
+            f.write(annotation_text)
+        entry["annotation"] = annotation_hash
+        return True
+
+    def add(self, rel_path: str, img, digest: str):
+        img_width, img_height = probe_image_size(image_cache.blob_path(digest))
+
+        image_path = os.path.join(self.base_dir, rel_path)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        image_cache.link(digest, image_path)
+
+        entry = {
+            "url": ImageCache.url_key(img.url),
+            "digest": digest,
+            "width": img_width,
+            "height": img_height,
+            "annotation": None,
+        }
+        self.write_annotation(rel_path, img, entry)
+        self.entries[rel_path] = entry
+        self.fetched += 1
+
+    def build_index(self) -> DatasetIndex:
+        """Index the synced images from the manifest entries, without walking the tree."""
+        index = DatasetIndex(self.base_dir)
+        for rel_path, entry in sorted(self.entries.items()):
+            if self.is_skipped(entry):
+                continue
+            img = self.desired[rel_path]
+            split, path = rel_path.split(os.sep, 1)
+            label = img.annotation.label if self.request.type == "classification" else None
+            annotation_text = convert_annotation(self.request, img, self.labels, entry["width"], entry["height"])
+            annotation = parse_annotation(annotation_text) if annotation_text is not None else None
+            index.add(split, path, label, entry["width"], entry["height"], annotation)
+        return index
+
+    def dedup(self):
+        report_path = os.path.join(self.base_dir, "dedup_report.json")
+        if self.request.dedup == "off":
+            for entry in self.entries.values():
+                entry.pop("duplicate_of", None)
+            if os.path.exists(report_path):
+                os.remove(report_path)
+            return
+
+        index = HammingIndex(self.request.dedup_distance)
+        originals = {}
+        duplicates = []
+        for rel_path, img in self.desired.items():
+            entry = self.entries.get(rel_path)
+            if entry is None:
+                continue
+            was_skipped = self.is_skipped(entry)
+            entry.pop("duplicate_of", None)
+
+            match = None
+            if entry["digest"] in originals:
+                match = (originals[entry["digest"]], 0)
+            else:
+                if "phash" not in entry:
+                    phash = dhash(image_cache.blob_path(entry["digest"]))
+                    entry["phash"] = None if phash is None else format(phash, "016x")
+                if entry["phash"] is not None:
+                    match = index.query(int(entry["phash"], 16))
+                if match is None:
+                    originals[entry["digest"]] = rel_path
+                    if entry["phash"] is not None:
+                        index.add(int(entry["phash"], 16), rel_path)
+
+            if match is not None:
+                original, distance = match
+                entry["duplicate_of"] = original
+                duplicates.append({
+                    "path": rel_path,
+                    "duplicate_of": original,
+                    "distance": distance,
+                    "exact": entry["digest"] == self.entries[original]["digest"],
+                    "cross_split": rel_path.split(os.sep, 1)[0] != original.split(os.sep, 1)[0],
+                })
+                if self.request.dedup == "skip":
+                    for path in {rel_path, annotation_relpath(rel_path)}:
+                        path = os.path.join(self.base_dir, path)
+                        if os.path.lexists(path):
+                            os.unlink(path)
+            elif was_skipped:
+                # No longer a duplicate: bring the image back
+                image_path = os.path.join(self.base_dir, rel_path)
+                os.makedirs(os.path.dirname(image_path), exist_ok=True)
+                image_cache.link(entry["digest"], image_path)
+                self.write_annotation(rel_path, img, entry)
+        remove_empty_dirs(self.base_dir)
+
+        with open(report_path, "w") as f:
+            json.dump({
+                "mode": self.request.dedup,
+                "max_distance": self.request.dedup_distance,
+                "checked": len(self.entries),
+                "duplicates": duplicates,
+            }, f, indent=2)
+
+        exact = sum(1 for duplicate in duplicates if duplicate["exact"])
+        cross_split = sum(1 for duplicate in duplicates if duplicate["cross_split"])
+        action = "skipped" if self.request.dedup == "skip" else "flagged"
+        self.log(
+            f"Dedup: {exact} exact and {len(duplicates) - exact} near duplicates {action} "
+            f"({cross_split} across splits)"
+        )
+
+    def finish(self):
+        self.dedup()
+        self.log(
+            f"Dataset sync: {self.fetched} fetched, {self.moved} relinked, {self.removed} removed, "
+            f"{self.rewritten} annotations rewritten"
+        )
+        save_manifest(self.base_dir, {"type": self.request.type, "labels": self.labels, "entries": self.entries})
+        self.build_index().save()
+        pack_dataset(self.base_dir)
+        image_cache.evict()
+        image_cache.save()
@@ -0,0 +1,153 @@
+import os
+import numpy as np
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from app.services.dataset.image_header import probe_image_size
+from app.services.dataset.json_file import atomic_write_json, read_json, remove_file
+
+INDEX_FILENAME = ".index.json"
+SPLITS = ["train", "test", "valid"]
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+# base_dir -> (index file mtime, DatasetIndex)
+_loaded: Dict[str, Tuple[float, "DatasetIndex"]] = {}
+
+
+def index_path(base_dir: str) -> str:
+    return os.path.join(base_dir, INDEX_FILENAME)
+
+
+def split_of(split_dir: str) -> Tuple[str, str]:
+    """Split a path like `./dataset/train/` into ("./dataset", "train")."""
+    split_dir = os.path.normpath(split_dir)
+    return os.path.dirname(split_dir), os.path.basename(split_dir)
+
+
+def parse_annotation(text: str) -> List[List[float]]:
+    """Parse YOLO-style lines into rows of numbers, class id first."""
+    rows = []
+    for line in text.splitlines():
+        values = line.split()
+        if values:
+            rows.append([int(values[0])] + [float(v) for v in values[1:]])
+    return rows
+
+
+class DatasetIndex:
+    """
+    Everything the pipeline needs to know about `dataset/` without walking it.
+
+    Per split, each entry records the image path relative to the split, its
+    class folder (classification) or None, the image size, and the parsed
+    annotation rows (object detection and segmentation) or None. The index is
+    built once the dataset is materialized and rebuilt after it is modified.
+    """
+
+    def __init__(self, base_dir: str, splits: Optional[Dict[str, List[dict]]] = None):
+        self.base_dir = os.path.normpath(base_dir)
+        self.splits = splits or {split: [] for split in SPLITS}
+
+    @classmethod
+    def build(cls, base_dir: str) -> "DatasetIndex":
+        index = cls(base_dir)
+        for split in SPLITS:
+            split_dir = os.path.join(base_dir, split)
+            if not os.path.isdir(split_dir):
+                continue
+            for root, dirs, files in os.walk(split_dir):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                for file in sorted(files):
+                    if not file.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    file_path = os.path.join(root, file)
+                    rel_path = os.path.relpath(file_path, split_dir)
+
+                    annotation = None
+                    annotation_path = os.path.splitext(file_path)[0] + ".txt"
+                    if os.path.exists(annotation_path):
+                        with open(annotation_path, "r") as f:
+                            annotation = parse_annotation(f.read())
+
+                    try:
+                        width, height = probe_image_size(file_path)
+                    except Exception as e:
+                        print(f"Skipping unreadable image {file_path}: {e}")
+                        continue
+                    index.add(split, rel_path, os.path.dirname(rel_path) or None, width, height, annotation)
+        return index
+
+    @classmethod
+    def load(cls, base_dir: str = "dataset") -> "DatasetIndex":
+        """Return the saved index for `base_dir`, building and saving it if missing."""
+        base_dir = os.path.normpath(base_dir)
+        path = index_path(base_dir)
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            index = cls.build(base_dir)
+            index.save()
+            return index
+
+        cached = _loaded.get(base_dir)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        stored = read_json(path)
+        if stored is None:
+            index = cls.build(base_dir)
+            index.save()
+            return index
+        index = cls(base_dir, stored["splits"])
+        _loaded[base_dir] = (mtime, index)
+        return index
+
+    def save(self):
+        if not os.path.isdir(self.base_dir):
+            return
+        atomic_write_json(index_path(self.base_dir), {"splits": self.splits})
+        _loaded[self.base_dir] = (os.path.getmtime(index_path(self.base_dir)), self)
+
+    def add(self, split: str, path: str, label: Optional[str], width: int, height: int, annotation: Optional[list]):
+        self.splits.setdefault(split, []).append({
+            "path": path,
+            "label": label,
+            "width": width,
+            "height": height,
+            "annotation": annotation,
+        })
+
+    def entries(self, split: str, extensions: Tuple[str, ...] = IMAGE_EXTENSIONS) -> List[dict]:
+        return [entry for entry in self.splits.get(split, []) if entry["path"].lower().endswith(extensions)]
+
+    def image_shape(self, split: str) -> Optional[Tuple[int, int, int]]:
+        """(height, width, 3) of the first image, as `cv2.imread` would return it."""
+        entries = self.entries(split)
+        if not entries:
+            return None
+        return entries[0]["height"], entries[0]["width"], 3
+
+    def max_class_id(self, split: str) -> int:
+        return max((row[0] for entry in self.entries(split) for row in entry["annotation"] or []), default=-1)
+
+    def max_boxes(self, split: str) -> int:
+        return max((len(entry["annotation"]) for entry in self.entries(split) if entry["annotation"] is not None), default=0)
+
+    def group_by_first_class(self, split: str, extensions: Tuple[str, ...] = IMAGE_EXTENSIONS) -> Dict[str, List[dict]]:
+        """Group annotated images by the class of their first annotation line."""
+        groups = defaultdict(list)
+        for entry in self.entries(split, extensions):
+            if entry["annotation"]:
+                groups[str(entry["annotation"][0][0])].append(entry)
+        return groups
+
+    @staticmethod
+    def boxes(entry: dict) -> np.ndarray:
+        """Annotation rows of an object detection entry as an (N, 5) array."""
+        return np.asarray(entry["annotation"] or [], dtype=np.float64).reshape(-1, 5)
+
+
+def invalidate_index(base_dir: str):
+    base_dir = os.path.normpath(base_dir)
+    _loaded.pop(base_dir, None)
+    remove_file(index_path(base_dir))
@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+
+from collections import defaultdict
+from typing import Any, List, Optional, Tuple
+
+# Below this many bits per band, bucket lookups stop narrowing the search
+MIN_BAND_BITS = 8
+# Number of set bits in every byte value
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(path: str) -> Optional[int]:
+    """
+    64-bit difference hash: compare neighbouring pixels of a 9x8 grayscale thumbnail.
+
+    JPEGs are decoded at 1/8 scale, which is all a 9x8 thumbnail needs.
+    Returns None when the image cannot be decoded.
+    """
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None or min(image.shape[:2]) < 8:
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+    thumbnail = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = thumbnail[:, 1:] > thumbnail[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distances(hashes: np.ndarray, value: int) -> np.ndarray:
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    if hasattr(np, "bitwise_count"):
+        # numpy >= 2.0
+        return np.bitwise_count(xor)
+    return POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class HammingIndex:
+    """
+    Nearest-neighbour lookup of 64-bit hashes within `max_distance` bits.
+
+    Hashes are split into `max_distance + 1` disjoint bands, and every band
+    value maps to the hashes that contain it. Two hashes at most
+    `max_distance` bits apart must agree on at least one band, so the
+    candidates come from one dict lookup per band. Their distances are then
+    computed in one vectorized popcount. Distances too large to leave
+    useful bands fall back to a vectorized scan over every hash.
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        self.keys: List[Any] = []
+        self.hashes = np.zeros(1024, dtype=np.uint64)
+        band_bits = 64 // (max_distance + 1)
+        self.band_bits = band_bits if band_bits >= MIN_BAND_BITS else 0
+        self.bands = [defaultdict(list) for _ in range(max_distance + 1)] if self.band_bits else []
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _band_values(self, value: int) -> List[int]:
+        mask = (1 << self.band_bits) - 1
+        return [(value >> (self.band_bits * band)) & mask for band in range(len(self.bands))]
+
+    def add(self, value: int, key: Any):
+        i = len(self.keys)
+        if i == len(self.hashes):
+            self.hashes = np.concatenate([self.hashes, np.zeros_like(self.hashes)])
+        self.hashes[i] = value
+        self.keys.append(key)
+        for band, band_value in enumerate(self._band_values(value)):
+            self.bands[band][band_value].append(i)
+
+    def query(self, value: int) -> Optional[Tuple[Any, int]]:
+        """Return (key, distance) of the closest hash within `max_distance`, if any."""
+        if self.bands:
+            candidates = set()
+            for band, band_value in enumerate(self._band_values(value)):
+                candidates.update(self.bands[band].get(band_value, ()))
+            # Sorted so that ties resolve to the hash added first
+            candidates = np.array(sorted(candidates), dtype=np.int64)
+        else:
+            candidates = np.arange(len(self.keys))
+        if len(candidates) == 0:
+            return None
+
+        distances = hamming_distances(self.hashes[candidates], value)
+        best = int(np.argmin(distances))
+        if distances[best] > self.max_distance:
+            return None
+        return self.keys[candidates[best]], int(distances[best])
@@ -0,0 +1,38 @@
+import os
+import json
+import hashlib
+
+from pydantic import BaseModel
+
+from app.services.dataset.blob_store import BlobStore
+
+PREPROCESS_CACHE_DIR = os.getenv("PREPROCESS_CACHE_DIR", os.path.join(".cache", "preprocessed"))
+PREPROCESS_CACHE_MAX_BYTES = int(os.getenv("PREPROCESS_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))
+# Bump when preprocessing output changes for the same config, to orphan old results
+PREPROCESS_CACHE_VERSION = 1
+
+
+def config_digest(config: BaseModel, **extra) -> str:
+    """Digest of a config's settings, independent of field and key order."""
+    payload = {"version": PREPROCESS_CACHE_VERSION, "config": config.model_dump(mode="json"), **extra}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def derived_key(source_digest: str, config_hash: str, extension: str) -> str:
+    # The extension picks the encoder, so the same pixels differ per format
+    return hashlib.sha256(f"{source_digest}:{config_hash}:{extension.lower()}".encode()).hexdigest()
+
+
+class DerivedCache(BlobStore):
+    """
+    Persistent store of images derived from a source image and a config.
+
+    Keys come from `derived_key`; keys that produce identical bytes share
+    one blob. Workers write blobs directly; only the process that owns the
+    cache records keys and saves the index.
+    """
+
+    name = "preprocessing cache"
+
+    def __init__(self, root: str = PREPROCESS_CACHE_DIR, max_bytes: int = PREPROCESS_CACHE_MAX_BYTES):
+        super().__init__(root, max_bytes)
@@ -0,0 +1,48 @@
+import os
+import time
+
+from typing import Any, NamedTuple, Optional
+
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "16"))
+DOWNLOAD_PER_HOST = int(os.getenv("DOWNLOAD_PER_HOST", "8"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_BACKOFF = float(os.getenv("DOWNLOAD_BACKOFF", "0.5"))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "30"))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+REPORT_INTERVAL = 5.0
+
+
+class DownloadResult(NamedTuple):
+    key: Any
+    url: str
+    digest: Optional[str]
+    error: Optional[str]
+    cached: bool = False
+    size: int = 0
+
+
+class DownloadStats:
+    def __init__(self, total: int = 0):
+        self.total = total
+        self.completed = 0
+        self.failed = 0
+        self.cached = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def record(self, result: DownloadResult):
+        self.completed += 1
+        if result.digest is None:
+            self.failed += 1
+        elif result.cached:
+            self.cached += 1
+        else:
+            self.bytes += result.size
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return (
+            f"Downloaded {self.completed - self.failed}/{self.total} images "
+            f"({self.completed / elapsed:.1f} img/s, {self.bytes / elapsed / 1e6:.2f} MB/s, "
+            f"{self.cached} from cache, {self.failed} failed)"
+        )
@@ -0,0 +1,43 @@
+import os
+
+from urllib.parse import urlparse, urlunparse
+from typing import Optional
+
+from app.services.dataset.blob_store import BlobStore
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(".cache", "images"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+
+
+class ImageCache(BlobStore):
+    """
+    Persistent content-addressed store for downloaded images.
+
+    Keys are URLs without their query string, so re-signed storage URLs
+    still match, and each entry also records the server ETag /
+    Last-Modified validators. Entries are revalidated with a conditional
+    request.
+    """
+
+    name = "image cache"
+
+    def __init__(self, root: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        super().__init__(root, max_bytes)
+
+    @staticmethod
+    def url_key(url: str) -> str:
+        parsed = urlparse(url)
+        return urlunparse((parsed.scheme, parsed.netloc, parsed.path, "", "", ""))
+
+    def index_key(self, key: str) -> str:
+        return self.url_key(key)
+
+    def record(
+        self,
+        url: str,
+        digest: str,
+        size: int,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        super().record(url, digest, size, etag=etag, last_modified=last_modified)
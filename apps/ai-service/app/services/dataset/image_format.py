@@ -0,0 +1,48 @@
+import os
+import cv2
+import numpy as np
+
+from typing import Tuple
+
+# Format of the images pipeline stages write: "source" keeps each file's own
+# format, "png" and "webp" are lossless so repeated stages add no JPEG loss
+INTERMEDIATE_FORMAT = os.getenv("INTERMEDIATE_FORMAT", "source")
+INTERMEDIATE_EXTENSIONS = {"png": ".png", "webp": ".webp"}
+ENCODE_PARAMS = {
+    # Fastest zlib level; the files are rewritten or read again soon
+    ".png": [cv2.IMWRITE_PNG_COMPRESSION, 1],
+    # Quality above 100 selects lossless WebP
+    ".webp": [cv2.IMWRITE_WEBP_QUALITY, 101],
+}
+
+
+def intermediate_path(path: str) -> str:
+    """Where a pipeline stage writes its version of the image at `path`."""
+    extension = INTERMEDIATE_EXTENSIONS.get(INTERMEDIATE_FORMAT)
+    if extension is None:
+        return path
+    return os.path.splitext(path)[0] + extension
+
+
+def with_intermediate(extensions: Tuple[str, ...]) -> Tuple[str, ...]:
+    """`extensions`, plus the intermediate format, for filters written for the source format."""
+    extension = INTERMEDIATE_EXTENSIONS.get(INTERMEDIATE_FORMAT)
+    if extension is None or extension in extensions:
+        return extensions
+    return extensions + (extension,)
+
+
+def encode_image(path: str, image: np.ndarray) -> bytes:
+    extension = os.path.splitext(path)[1].lower()
+    ok, encoded = cv2.imencode(extension, image, ENCODE_PARAMS.get(extension, []))
+    if not ok:
+        raise ValueError(f"Failed to encode image: {path}")
+    return encoded.tobytes()
+
+
+def write_image(path: str, image: np.ndarray) -> str:
+    """Write `image` for `path` in the intermediate format and return the path written."""
+    path = intermediate_path(path)
+    with open(path, "wb") as f:
+        f.write(encode_image(path, image))
+    return path
@@ -0,0 +1,74 @@
+import struct
+
+from PIL import Image
+from typing import BinaryIO, Optional, Tuple
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Start-of-frame markers carry the frame size; DHT (C4), JPG (C8) and DAC (CC) share the range
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers without a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+
+def _png_size(f: BinaryIO) -> Optional[Tuple[int, int]]:
+    header = f.read(24)
+    if len(header) < 24 or header[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", header[16:24])
+    return width, height
+
+
+def _jpeg_size(f: BinaryIO) -> Optional[Tuple[int, int]]:
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+
+        marker = byte[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of scan before any frame header
+            return None
+
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack(">H", length_bytes)[0]
+
+        if marker in JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">HH", frame[1:5])
+            return width, height
+
+        f.seek(length - 2, 1)
+
+
+def probe_image_size(path: str) -> Tuple[int, int]:
+    """
+    Return (width, height) of an image file without decoding pixels.
+
+    JPEG and PNG sizes are read straight from the header bytes; any other
+    format falls back to PIL, which also only parses the header on open.
+    """
+    with open(path, "rb") as f:
+        signature = f.read(8)
+        size = None
+        if signature.startswith(PNG_SIGNATURE):
+            f.seek(0)
+            size = _png_size(f)
+        elif signature.startswith(b"\xff\xd8"):
+            size = _jpeg_size(f)
+        if size is not None:
+            return size
+
+    with Image.open(path) as image:
+        return image.size
@@ -0,0 +1,264 @@
+import time
+import uuid
+import asyncio
+import httpx
+
+from urllib.parse import urlparse
+from collections import OrderedDict, defaultdict
+from typing import Any, AsyncIterator, Iterable, Optional, Tuple
+
+from app.models.dataset import PrepareDatasetRequest
+from app.helpers.realtime_log import log_message
+from app.services.dataset.dataset import DatasetSync, image_cache
+from app.services.dataset.image_cache import ImageCache
+from app.services.dataset.downloader import (
+    DownloadResult,
+    DownloadStats,
+    DOWNLOAD_WORKERS,
+    DOWNLOAD_PER_HOST,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_BACKOFF,
+    DOWNLOAD_TIMEOUT,
+    DOWNLOAD_CHUNK_SIZE,
+    REPORT_INTERVAL,
+)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_FINISHED_JOBS = 100
+
+
+class AsyncImageDownloader:
+    """
+    Downloads images into the `ImageCache` from the event loop.
+
+    Downloads run as `max_workers` coroutines sharing one pooled
+    `httpx.AsyncClient`, limited to `per_host` concurrent requests per host
+    and retried with exponential backoff on transport errors and 429/5xx.
+    Bodies stream into the `ImageCache`, with the blocking file writes
+    offloaded to threads. Keys whose URLs match once the query string is
+    dropped share a single download.
+    """
+
+    def __init__(
+        self,
+        cache: ImageCache,
+        max_workers: int = DOWNLOAD_WORKERS,
+        per_host: int = DOWNLOAD_PER_HOST,
+        retries: int = DOWNLOAD_RETRIES,
+        backoff: float = DOWNLOAD_BACKOFF,
+        timeout: float = DOWNLOAD_TIMEOUT,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        if retries < 0:
+            raise ValueError(f"retries must be >= 0, got {retries}")
+        self.cache = cache
+        self.max_workers = max(1, max_workers)
+        self.per_host = max(1, per_host)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.transport = transport
+
+    def _create_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.max_workers,
+            max_keepalive_connections=self.max_workers,
+        )
+        return httpx.AsyncClient(
+            limits=limits,
+            timeout=self.timeout,
+            transport=self.transport,
+            follow_redirects=True,
+        )
+
+    async def fetch(self, client: httpx.AsyncClient, key: Any, url: str) -> DownloadResult:
+        entry = await asyncio.to_thread(self.cache.lookup, url)
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                async with client.stream("GET", url, headers=headers) as response:
+                    if last_attempt or response.status_code not in RETRY_STATUSES:
+                        return await self._store(response, key, url, entry)
+            except httpx.TransportError:
+                if last_attempt:
+                    raise
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+
+    async def _store(self, response: httpx.Response, key: Any, url: str, entry: Optional[dict]) -> DownloadResult:
+        if response.status_code == 304 and entry:
+            self.cache.touch(url)
+            return DownloadResult(key, url, entry["digest"], None, cached=True)
+        if response.status_code != 200:
+            raise httpx.HTTPStatusError(
+                f"HTTP {response.status_code}", request=response.request, response=response)
+
+        writer = await asyncio.to_thread(self.cache.open_writer)
+        try:
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                await asyncio.to_thread(writer.write, chunk)
+            digest, size = await asyncio.to_thread(writer.commit)
+        except BaseException:
+            await asyncio.to_thread(writer.abort)
+            raise
+        self.cache.record(url, digest, size, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return DownloadResult(key, url, digest, None, size=size)
+
+    async def _fetch_result(self, client: httpx.AsyncClient, key: Any, url: str) -> DownloadResult:
+        try:
+            return await self.fetch(client, key, url)
+        except Exception as e:
+            return DownloadResult(key, url, None, str(e))
+
+    async def download_all(self, items: Iterable[Tuple[Any, str]]) -> AsyncIterator[DownloadResult]:
+        """Download every (key, url) pair and yield results as they complete."""
+        keys_by_url: "OrderedDict[str, list]" = OrderedDict()
+        total = 0
+        for key, url in items:
+            keys_by_url.setdefault(ImageCache.url_key(url), []).append((key, url))
+            total += 1
+        queue = asyncio.Queue()
+        for group in keys_by_url.values():
+            queue.put_nowait(group)
+        results = asyncio.Queue()
+        host_slots = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+
+        async with self._create_client() as client:
+            async def worker():
+                while True:
+                    try:
+                        (key, url), *duplicates = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    async with host_slots[urlparse(url).netloc]:
+                        result = await self._fetch_result(client, key, url)
+                    await results.put(result)
+                    for key, url in duplicates:
+                        await results.put(result._replace(key=key, url=url, cached=result.digest is not None))
+
+            workers = [asyncio.create_task(worker()) for _ in range(min(self.max_workers, len(keys_by_url)))]
+            try:
+                for _ in range(total):
+                    yield await results.get()
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+
+class IngestJob:
+    def __init__(self, request: PrepareDatasetRequest, training_id: str):
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.training_id = training_id
+        self.status = "queued"
+        self.stage = None
+        self.stats = DownloadStats()
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "total": self.stats.total,
+            "completed": self.stats.completed,
+            "failed": self.stats.failed,
+            "cached": self.stats.cached,
+            "bytes": self.stats.bytes,
+            "elapsed": round((self.finished_at or time.time()) - self.created_at, 3),
+            "error": self.error,
+        }
+
+
+class DatasetIngestion:
+    """
+    Runs dataset preparation as background asyncio jobs.
+
+    Jobs are serialized because they all write to the same `dataset/` tree;
+    while one runs, the event loop stays free to serve health checks and
+    progress queries. Other stages that read or write the tree take `lock`
+    too, so they never see it half synced.
+    """
+
+    def __init__(self, downloader: AsyncImageDownloader):
+        self.downloader = downloader
+        self.jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self.lock = asyncio.Lock()
+
+    def submit(self, request: PrepareDatasetRequest, training_id: str) -> IngestJob:
+        job = IngestJob(request, training_id)
+        self.jobs[job.id] = job
+        self._forget_finished()
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self.jobs.get(job_id)
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    async def _run(self, job: IngestJob):
+        async with self.lock:
+            job.status = "running"
+            try:
+                await self._ingest(job)
+                job.status = "completed"
+            except Exception as e:
+                job.status = "failed"
+                job.error = f"{type(e).__name__}: {e}"
+                await self._log(job, f"Dataset ingestion failed: {job.error}")
+            finally:
+                job.finished_at = time.time()
+
+    async def _log(self, job: IngestJob, message: str):
+        try:
+            await log_message(job.training_id, message)
+        except Exception as e:
+            print(f"Failed to publish log for job {job.id}: {e}")
+
+    async def _ingest(self, job: IngestJob):
+        loop = asyncio.get_running_loop()
+
+        def log(message: str):
+            asyncio.run_coroutine_threadsafe(self._log(job, message), loop)
+
+        sync = DatasetSync(job.request, log=log)
+
+        job.stage = "planning"
+        pending = await asyncio.to_thread(sync.plan)
+
+        job.stage = "downloading"
+        job.stats = DownloadStats(len(pending))
+        last_report = time.monotonic()
+        async for result in self.downloader.download_all((item, item[1].url) for item in pending):
+            job.stats.record(result)
+            rel_path, img = result.key
+            if result.digest is None:
+                await self._log(job, f"Failed to download {result.url}: {result.error}")
+            else:
+                await asyncio.to_thread(sync.add, rel_path, img, result.digest)
+
+            now = time.monotonic()
+            if now - last_report >= REPORT_INTERVAL:
+                await self._log(job, job.stats.summary())
+                last_report = now
+        await self._log(job, job.stats.summary())
+
+        job.stage = "finalizing"
+        await asyncio.to_thread(sync.finish)
+        job.stage = None
+
+
+ingestion = DatasetIngestion(AsyncImageDownloader(image_cache))
@@ -0,0 +1,32 @@
+import os
+import json
+import tempfile
+
+
+def read_json(path: str):
+    """Return the JSON stored at `path`, or None if it is missing or unreadable."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def atomic_write_json(path: str, data) -> None:
+    """Write `data` to a temporary file next to `path` and move it into place, so readers never see half a file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,60 @@
+import os
+import cv2
+import numpy as np
+
+from io import BytesIO
+from typing import Optional, Tuple, Union
+from app.models.preprocessing import ImagePreprocessingConfig
+from app.services.dataset.json_file import atomic_write_json, read_json, remove_file
+from app.services.dataset.preprocessing import Preprocessing, PreprocessingPlan
+
+PLAN_FILENAME = ".preprocess.json"
+
+
+def plan_path(dataset_dir: str) -> str:
+    return os.path.join(dataset_dir, PLAN_FILENAME)
+
+
+def save_preprocess_plan(dataset_dir: str, config: ImagePreprocessingConfig, threshold_value: Optional[float] = None):
+    """Store `config` next to the dataset, to be applied when images are loaded."""
+    atomic_write_json(plan_path(dataset_dir), {"config": config.model_dump(mode="json"), "threshold_value": threshold_value})
+
+
+def load_preprocess_config(dataset_dir: str) -> Optional[Tuple[ImagePreprocessingConfig, Optional[float]]]:
+    """Return the pending (config, dataset-wide threshold) of `dataset_dir`, if any."""
+    stored = read_json(plan_path(dataset_dir))
+    if stored is None:
+        return None
+    return ImagePreprocessingConfig.model_validate(stored["config"]), stored["threshold_value"]
+
+
+def load_preprocess_plan(dataset_dir: str) -> Optional[PreprocessingPlan]:
+    stored = load_preprocess_config(dataset_dir)
+    if stored is None:
+        return None
+    return Preprocessing().compile(*stored)
+
+
+def clear_preprocess_plan(dataset_dir: str):
+    remove_file(plan_path(dataset_dir))
+
+
+def read_preprocessed(source: Union[str, BytesIO], plan: PreprocessingPlan, channels: Optional[int] = None) -> np.ndarray:
+    """
+    Decode an image and apply `plan`, as if the file had been preprocessed on disk.
+
+    Returns RGB pixels, or a single channel when the plan produces grayscale,
+    which is what the loaders' own decoders return for a preprocessed file.
+    `channels=3` expands grayscale to RGB, like decoders in RGB mode do.
+    """
+    if isinstance(source, str):
+        image = cv2.imread(source)
+    else:
+        image = cv2.imdecode(np.frombuffer(source.getvalue(), dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Failed to read image")
+
+    image = plan(image)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB) if channels == 3 else image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -0,0 +1,48 @@
+import os
+
+from typing import Dict, Optional
+from app.services.dataset.json_file import atomic_write_json, read_json, remove_file
+
+MANIFEST_FILENAME = ".manifest.json"
+
+
+def manifest_path(dataset_dir: str) -> str:
+    return os.path.join(dataset_dir, MANIFEST_FILENAME)
+
+
+def read_manifest(dataset_dir: str) -> Optional[dict]:
+    """Return the manifest written by the last completed sync, stale or not."""
+    return read_json(manifest_path(dataset_dir))
+
+
+def save_manifest(dataset_dir: str, manifest: dict) -> None:
+    atomic_write_json(manifest_path(dataset_dir), manifest)
+
+
+def invalidate_manifest(dataset_dir: str) -> None:
+    """Forget the manifest so the next sync rebuilds from scratch."""
+    remove_file(manifest_path(dataset_dir))
+
+
+def mark_manifest_stale(dataset_dir: str, **fields) -> None:
+    """
+    Record that the files no longer match the synced images, updating `fields`.
+
+    The entries still say which cached image each path was synced from, so
+    stages can read the unprocessed source and the next sync can relink it,
+    but the tree itself is rebuilt.
+    """
+    manifest = read_manifest(dataset_dir)
+    if manifest is None:
+        if not fields:
+            return
+        manifest = {"entries": {}}
+    manifest.update(fields, stale=True)
+    save_manifest(dataset_dir, manifest)
+
+
+def manifest_sources(manifest: Optional[dict]) -> Dict[str, str]:
+    """Image path, relative to the dataset, to the digest of the cached image synced there."""
+    if manifest is None:
+        return {}
+    return {rel_path: entry["digest"] for rel_path, entry in manifest.get("entries", {}).items()}
@@ -0,0 +1,94 @@
+import os
+import cv2
+import numpy as np
+
+from typing import Optional, Tuple
+from app.models.augmentation import DataAugmentationConfig
+from app.services.dataset.augmentation import Augmentation, Recipe
+from app.services.dataset.json_file import atomic_write_json, read_json, remove_file
+from app.services.dataset.parallel import available_cpus
+
+AUGMENTATION_PLAN_FILENAME = ".augmentation.json"
+# Threads building augmented batches during training; OpenCV releases the GIL
+AUGMENT_WORKERS = int(os.getenv("AUGMENT_WORKERS", str(available_cpus())))
+
+augmentation = Augmentation()
+
+
+def augmentation_plan_path(dataset_dir: str) -> str:
+    return os.path.join(dataset_dir, AUGMENTATION_PLAN_FILENAME)
+
+
+def save_augmentation_plan(dataset_dir: str, config: DataAugmentationConfig):
+    """Store `config` next to the dataset, to be applied to training batches as they are built."""
+    atomic_write_json(augmentation_plan_path(dataset_dir), config.model_dump(mode="json"))
+
+
+def load_augmentation_plan(dataset_dir: str) -> Optional[DataAugmentationConfig]:
+    stored = read_json(augmentation_plan_path(dataset_dir))
+    if stored is None:
+        return None
+    return DataAugmentationConfig.model_validate(stored)
+
+
+def clear_augmentation_plan(dataset_dir: str):
+    remove_file(augmentation_plan_path(dataset_dir))
+
+
+def scale_region(x: int, y: int, w: int, h: int, fx: float, fy: float) -> list:
+    """Scale a pixel rectangle by (fx, fy); one that fit the image before still fits it after."""
+    x0, y0 = int(x * fx), int(y * fy)
+    return [x0, y0, int(round((x + w) * fx)) - x0, int(round((y + h) * fy)) - y0]
+
+
+def scale_recipe(recipe: Recipe, source_size: Tuple[int, int], size: Tuple[int, int]) -> Recipe:
+    """
+    Rescale the pixel parameters of `recipe` from a `source_size` image to a `size` one, both (height, width).
+
+    Crops, translations and erased regions are configured in pixels of the
+    images on disk, but a loaded sample may have been resized since.
+    """
+    (source_height, source_width), (height, width) = source_size, size
+    fx, fy = width / source_width, height / source_height
+    scaled = []
+    for step in recipe:
+        key = step['key']
+        if key == 'crop':
+            x, y, w, h = scale_region(*step['origin'], *step['size'], fx, fy)
+            step = {**step, 'size': [w, h], 'origin': [x, y]}
+        elif key == 'translate':
+            tx, ty = step['shift']
+            step = {**step, 'shift': [tx * fx, ty * fy]}
+        elif key == 'random_erasing':
+            step = {**step, 'region': scale_region(*step['region'], fx, fy)}
+        scaled.append(step)
+    return scaled
+
+
+def augment_sample(
+    image: np.ndarray,
+    config: DataAugmentationConfig,
+    rng: np.random.Generator,
+    bounding_boxes: Optional[np.ndarray] = None,
+    source_size: Optional[Tuple[int, int]] = None,
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Augment one loaded training sample: RGB floats in [0, 1], as the loaders return them.
+
+    The transforms run on the 8-bit BGR pixels the sample was decoded
+    from, like offline augmentation does on the files. The result keeps
+    the sample's shape, so it can go into the same batch; boxes are
+    normalized and stay valid after resizing back. `source_size` is the
+    (height, width) of the image the sample was resized from, if it was.
+    """
+    pixels = np.clip(np.rint(image * 255), 0, 255).astype(np.uint8)
+    pixels = cv2.cvtColor(pixels, cv2.COLOR_RGB2BGR)
+    recipe = scale_recipe(augmentation.draw_recipe(config, rng), source_size or image.shape[:2], image.shape[:2])
+    pixels, bounding_boxes = augmentation.apply_recipe(pixels, recipe, bounding_boxes)
+
+    if pixels.ndim == 2:
+        pixels = cv2.cvtColor(pixels, cv2.COLOR_GRAY2BGR)
+    if pixels.shape[:2] != image.shape[:2]:
+        pixels = cv2.resize(pixels, (image.shape[1], image.shape[0]))
+    pixels = cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB)
+    return pixels.astype(np.float32) / 255.0, bounding_boxes
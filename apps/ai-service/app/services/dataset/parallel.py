@@ -0,0 +1,85 @@
+import os
+import cv2
+import time
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+PARALLEL_WORKERS = int(os.getenv("PARALLEL_WORKERS", str(available_cpus())))
+PARALLEL_CHUNK_SIZE = int(os.getenv("PARALLEL_CHUNK_SIZE", "16"))
+# OpenCV threads per worker; more than one oversubscribes the cores the pool already uses
+PARALLEL_CV2_THREADS = int(os.getenv("PARALLEL_CV2_THREADS", "1"))
+REPORT_INTERVAL = float(os.getenv("REPORT_INTERVAL", "5.0"))
+
+
+def _init_worker(cv2_threads: int, initializer: Optional[Callable], initargs: Sequence[Any]):
+    cv2.setNumThreads(cv2_threads)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def parallel_map(
+    func: Callable,
+    items: Iterable,
+    workers: int = PARALLEL_WORKERS,
+    chunk_size: int = PARALLEL_CHUNK_SIZE,
+    initializer: Optional[Callable] = None,
+    initargs: Sequence[Any] = (),
+) -> Iterator:
+    """
+    Yield `func(item)` for every item, in order, using a process pool.
+
+    Items are sent to the workers in chunks of `chunk_size`. `initializer`
+    runs once per worker to set up per-process state, and the workers are
+    spawned rather than forked so they never inherit the server's threads
+    or event loop. With a single worker, or too few items to fill two
+    chunks, everything runs in the calling process instead.
+    `func` and `initializer` must be module-level functions.
+    """
+    items = list(items)
+    workers = min(workers, -(-len(items) // max(1, chunk_size)))
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(func, items)
+        return
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(PARALLEL_CV2_THREADS, initializer, tuple(initargs)),
+    ) as pool:
+        yield from pool.map(func, items, chunksize=chunk_size)
+
+
+class Throughput:
+    """Count processed images and print progress and the rate in img/s."""
+
+    def __init__(self, label: str, total: int):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.start = time.monotonic()
+        self.last_report = self.start
+
+    def update(self, count: int = 1):
+        self.done += count
+        now = time.monotonic()
+        if now - self.last_report >= REPORT_INTERVAL:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        print(f"{self.label} {self.done}/{self.total} images in {elapsed:.1f}s ({self.done / elapsed:.1f} img/s)")
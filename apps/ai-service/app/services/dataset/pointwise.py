@@ -0,0 +1,137 @@
+import cv2
+import numpy as np
+
+from typing import Callable, List, NamedTuple
+
+# (distinct pixel values as a (1, k) uint8 array, how often each occurs) -> new values
+Remap = Callable[[np.ndarray, np.ndarray], np.ndarray]
+
+
+class PointwiseStep(NamedTuple):
+    """
+    A step that maps every pixel value independently of its position.
+
+    `apply` is the original per-image operation. `remap` computes the same
+    mapping for the distinct values of the image. Steps whose mapping
+    depends on image statistics (min/max, histogram) derive them from the
+    values and counts, so consecutive steps compose into one lookup table.
+    """
+    apply: Callable[[np.ndarray], np.ndarray]
+    remap: Remap
+    # Cheaper as a lookup table even on its own (e.g. float round trips)
+    fuse_alone: bool = False
+    # Only per-pixel on single-channel images
+    grayscale_only: bool = False
+
+
+def probe_remap(apply: Callable[[np.ndarray], np.ndarray]) -> Remap:
+    """
+    Remap by running `apply` on the distinct values themselves.
+
+    Exact for operations whose statistics only depend on which values are
+    present, such as min/max normalization, since the probe has the same
+    minimum and maximum as the image.
+    """
+    return lambda values, counts: apply(values)
+
+
+def value_histogram(values: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    return np.bincount(values.ravel(), weights=counts, minlength=256).astype(np.int64)
+
+
+def equalize_remap(values: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """`cv2.equalizeHist`, computed from the histogram the same way OpenCV does."""
+    hist = value_histogram(values, counts)
+    total = int(hist.sum())
+    first = int(np.flatnonzero(hist)[0])
+    if hist[first] == total:
+        return np.full_like(values, first)
+
+    scale = np.float32(255.0) / np.float32(total - hist[first])
+    cumulative = np.cumsum(hist) - hist[first]
+    lut = np.clip(np.rint(cumulative.astype(np.float32) * scale), 0, 255).astype(np.uint8)
+    lut[:first + 1] = 0
+    return lut[values]
+
+
+def histogram_percentile(hist: np.ndarray, percent: float) -> float:
+    """
+    `np.percentile` (linear method) of the pixels counted in a 256-bin histogram.
+
+    The virtual index and interpolation follow numpy's formulas step by
+    step, so the result is the same float as on the flattened pixels.
+    """
+    count = int(hist.sum())
+    q = np.true_divide(percent, 100)
+    virtual_index = (count - 1) * q
+    if virtual_index < 0:
+        previous_index = next_index = 0
+    elif virtual_index >= count - 1:
+        previous_index = next_index = count - 1
+    else:
+        previous_index = int(np.floor(virtual_index))
+        next_index = previous_index + 1
+
+    # Value at each sorted position: the first bin whose running count passes it
+    cumulative = np.cumsum(hist)
+    previous, following = np.searchsorted(cumulative, [previous_index, next_index], side="right")
+    gamma = virtual_index - np.floor(virtual_index)
+    diff = float(following - previous)
+    if gamma >= 0.5:
+        return float(following - diff * (1 - gamma))
+    return float(previous + diff * gamma)
+
+
+def threshold_remap(percent: float) -> Remap:
+    def remap(values, counts):
+        threshold_value = histogram_percentile(value_histogram(values, counts), percent)
+        _, thresholded = cv2.threshold(values, threshold_value, 255, cv2.THRESH_BINARY)
+        return thresholded
+    return remap
+
+
+def pixel_histogram(image: np.ndarray) -> np.ndarray:
+    """256-bin histogram over all channels of a uint8 image."""
+    if image.size < 2 ** 24:
+        # calcHist counts in float32, which is exact below 2**24 per bin
+        hist = cv2.calcHist([image.reshape(-1, 1)], [0], None, [256], [0, 256])
+        return hist.ravel().astype(np.int64)
+    return np.bincount(image.ravel(), minlength=256)
+
+
+def run_pointwise(image: np.ndarray, steps: List[PointwiseStep]) -> np.ndarray:
+    """Apply `steps` in order, as a single `cv2.LUT` pass whenever that is exact."""
+    if not steps:
+        return image
+    fusable = image.dtype == np.uint8 and (len(steps) > 1 or steps[0].fuse_alone)
+    if any(step.grayscale_only for step in steps) and image.ndim != 2:
+        fusable = False
+    if not fusable:
+        for step in steps:
+            image = step.apply(image)
+        return image
+
+    hist = pixel_histogram(image)
+    values = np.flatnonzero(hist)
+    counts = hist[values]
+    current = values.astype(np.uint8).reshape(1, -1)
+    for step in steps:
+        current = step.remap(current, counts)
+
+    lut = np.zeros(256, dtype=np.uint8)
+    lut[values] = current.ravel()
+    return cv2.LUT(image, lut)
+
+
+class LutChain:
+    """Collects consecutive per-pixel steps until the image is needed."""
+
+    def __init__(self):
+        self.steps: List[PointwiseStep] = []
+
+    def add(self, step: PointwiseStep):
+        self.steps.append(step)
+
+    def flush(self, image: np.ndarray) -> np.ndarray:
+        steps, self.steps = self.steps, []
+        return run_pointwise(image, steps)
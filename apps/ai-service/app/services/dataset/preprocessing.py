@@ -1,152 +1,268 @@
 import cv2
 import numpy as np
 
+from typing import Callable, List, Optional, Union
 from app.models.preprocessing import ImagePreprocessingConfig
+from app.services.dataset.pointwise import (
+    PointwiseStep, equalize_remap, histogram_percentile, pixel_histogram, probe_remap, run_pointwise, threshold_remap
+)
+
+Step = Callable[[np.ndarray], np.ndarray]
+
+
+def _raise(error: Exception) -> Step:
+    """A step that fails on every image, like the invalid setting always did."""
+    def step(image):
+        raise error
+    return step
+
+
+class PreprocessingPlan:
+    """
+    An `ImagePreprocessingConfig` compiled into the list of operations to run.
+
+    There is one slot per `config.priority` entry, holding None when that
+    entry is disabled, so the input is still validated before every entry
+    exactly as `Preprocessing.preprocess` always did.
+    """
+
+    def __init__(self, steps: List[Optional[Step]]):
+        self.steps = steps
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        for step in self.steps:
+            if image is None or image.size == 0:
+                raise ValueError("Input image is empty or None.")
+            if step is not None:
+                image = step(image)
+        return image
+
+
+def fuse_pointwise(steps: List[Union[Step, PointwiseStep, None]]) -> List[Optional[Step]]:
+    """
+    Merge each run of per-pixel steps into one step that applies a single LUT.
+
+    The merged step takes the slot of the first step of the run and the
+    other slots become no-ops. Disabled entries inside a run do not break it.
+    """
+    fused: List[Optional[Step]] = []
+    run, run_slot = [], None
+
+    def close_run():
+        if run:
+            steps = list(run)
+            fused[run_slot] = lambda image: run_pointwise(image, steps)
+            run.clear()
+
+    for step in steps:
+        if isinstance(step, PointwiseStep):
+            if not run:
+                run_slot = len(fused)
+            run.append(step)
+            fused.append(None)
+        elif step is None:
+            fused.append(None)
+        else:
+            close_run()
+            fused.append(step)
+    close_run()
+    return fused
+
 
 class Preprocessing:
     def __init__(self):
         pass
 
     def preprocess(self, image: np.ndarray, config: ImagePreprocessingConfig) -> np.ndarray:
-        for key in config.priority:
-            '''
-            Validate input image
-            '''
-            if image is None or image.size == 0:
-                raise ValueError("Input image is empty or None.")
+        return self.compile(config)(image)
+
+    def compile(self, config: ImagePreprocessingConfig, threshold_value: Optional[float] = None) -> PreprocessingPlan:
+        """
+        Build the plan once so each image only pays for the OpenCV calls.
+
+        `threshold_value` replaces the per-image percentile of every
+        `thresh_percent` entry with a fixed, dataset-wide threshold.
+        """
+        steps = [self.compile_step(key, config, threshold_value) for key in config.priority]
+        return PreprocessingPlan(fuse_pointwise(steps))
+
+    def compile_prefix(self, config: ImagePreprocessingConfig, key: str) -> PreprocessingPlan:
+        """The plan for the `config.priority` entries before the first `key`."""
+        priority = config.priority[:config.priority.index(key)] if key in config.priority else config.priority
+        return PreprocessingPlan(fuse_pointwise([self.compile_step(k, config) for k in priority]))
+
+    def compile_step(
+        self, key: str, config: ImagePreprocessingConfig, threshold_value: Optional[float] = None
+    ) -> Union[Step, PointwiseStep, None]:
+        '''
+        Basic Image operations 
+        '''
 
-            '''
-            Basic Image operations 
-            '''
-            
-            if key == 'grayscale' and config.grayscale:
-                image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-            
-            if key == 'resize' and config.resize:
-                image = cv2.resize(image, config.resize)
-
-            # Crop
-            if key == 'crop' and config.crop:
-                crop_width, crop_height = config.crop[0]
-                x, y = config.crop[1]
+        if key == 'grayscale' and config.grayscale:
+            return lambda image: cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
 
+        if key == 'resize' and config.resize:
+            size = config.resize
+            return lambda image: cv2.resize(image, size)
+
+        # Crop
+        if key == 'crop' and config.crop:
+            crop_width, crop_height = config.crop[0]
+            x, y = config.crop[1]
+
+            def crop(image):
                 # Validate crop dimensions
                 if (x + crop_width > image.shape[1]) or (y + crop_height > image.shape[0]):
                     raise ValueError("Crop size exceeds image dimensions.")
+                return image[y:y + crop_height, x:x + crop_width]
+            return crop
+
+        # Rotation
+        if key == 'rotate' and config.rotate:
+            angle = config.rotate
+            rotation_matrices = {}
+
+            def rotate(image):
+                size = (image.shape[1], image.shape[0])
+                if size not in rotation_matrices:
+                    center = (image.shape[1] // 2, image.shape[0] // 2)
+                    rotation_matrices[size] = cv2.getRotationMatrix2D(center, angle, 1.0)
+                return cv2.warpAffine(image, rotation_matrices[size], size)
+            return rotate
+
+        # Flipping
+        if key == 'flip' and config.flip:
+            flip_code = config.flip
+            if flip_code not in [0, 1, -1]:
+                return _raise(ValueError("Invalid flip direction. Use 0 (vertical), 1 (horizontal), or -1 (both)."))
+            return lambda image: cv2.flip(image, flip_code)
+
+        # Perspective Transformation
+        if key == 'pers_trans' and config.pers_trans:
+            if len(config.pers_trans[0]) != 4 or len(config.pers_trans[1]) != 4:
+                return _raise(ValueError("Perspective transformation requires exactly 4 source and 4 destination points."))
+
+            src_points = np.array(config.pers_trans[0], dtype=np.float32)
+            dst_points = np.array(config.pers_trans[1], dtype=np.float32)
+            matrix = cv2.getPerspectiveTransform(src_points, dst_points)
+            return lambda image: cv2.warpPerspective(image, matrix, (image.shape[1], image.shape[0]))
+
+        '''
+        Thresholding
+        '''
+        if key == 'thresh_percent' and config.thresh_percent:
+            percent = config.thresh_percent
+
+            if threshold_value is not None:
+                def thresh_fixed(image):
+                    _, image = cv2.threshold(image, threshold_value, 255, cv2.THRESH_BINARY)
+                    return image
+                return PointwiseStep(thresh_fixed, probe_remap(thresh_fixed))
+
+            def thresh_percent(image):
+                if image.dtype == np.uint8:
+                    # Same value as np.percentile, read off the cumulative histogram
+                    image_threshold = histogram_percentile(pixel_histogram(image), percent)
+                else:
+                    image_threshold = np.percentile(image.flatten(), percent)
+                _, image = cv2.threshold(image, image_threshold, 255, cv2.THRESH_BINARY)
+                return image
+            return PointwiseStep(thresh_percent, threshold_remap(percent))
+
+        '''
+        Image Enhancement
+        '''
+        # Normalization
+        if key == 'normalize' and config.normalize:
+            min_value, max_value = config.normalize
 
-                image = image[y:y + crop_height, x:x + crop_width]
-
-            # Rotation
-            if key == 'rotate' and config.rotate:
-                center = (image.shape[1] // 2, image.shape[0] // 2)
-                rotation_matrix = cv2.getRotationMatrix2D(center, config.rotate, 1.0)
-                image = cv2.warpAffine(image, rotation_matrix, (image.shape[1], image.shape[0]))
-
-            # Flipping
-            if key == 'flip' and config.flip:
-                if config.flip not in [0, 1, -1]:
-                    raise ValueError("Invalid flip direction. Use 0 (vertical), 1 (horizontal), or -1 (both).")
-                image = cv2.flip(image, config.flip)
-
-            # Perspective Transformation
-            if key == 'pers_trans' and config.pers_trans:
-                if len(config.pers_trans[0]) != 4 or len(config.pers_trans[1]) != 4:
-                    raise ValueError("Perspective transformation requires exactly 4 source and 4 destination points.")
-
-                src_points = np.array(config.pers_trans[0], dtype=np.float32)
-                dst_points = np.array(config.pers_trans[1], dtype=np.float32)
-                matrix = cv2.getPerspectiveTransform(src_points, dst_points)
-                image = cv2.warpPerspective(image, matrix, (image.shape[1], image.shape[0]))
-
-            '''
-            Thresholding
-            '''
-            if key == 'thresh_percent' and config.thresh_percent:
-                flattened = image.flatten()
-                threshold_value = np.percentile(flattened, config.thresh_percent)
-                _, image = cv2.threshold(image, threshold_value, 255, cv2.THRESH_BINARY)
-
-            '''
-            Image Enhancement
-            '''
-            # Normalization
-            if key == 'normalize' and config.normalize:
-                min_value, max_value = config.normalize
-                image = cv2.normalize(image, None, min_value, max_value, cv2.NORM_MINMAX)
-
-            # Histogram Equalization
-            if key == 'histogram_equalization' and config.histogram_equalization:
+            def normalize(image):
+                return cv2.normalize(image, None, min_value, max_value, cv2.NORM_MINMAX)
+            return PointwiseStep(normalize, probe_remap(normalize))
+
+        # Histogram Equalization
+        if key == 'histogram_equalization' and config.histogram_equalization:
+            def histogram_equalization(image):
                 if len(image.shape) == 2:  # Grayscale image
-                    image = cv2.equalizeHist(image)
-                else:  # Color image
-                    image_yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)
-                    image_yuv[:, :, 0] = cv2.equalizeHist(image_yuv[:, :, 0])
-                    image = cv2.cvtColor(image_yuv, cv2.COLOR_YUV2BGR)
-
-            # Sharpening
-            if key == 'sharpening' and config.sharpening:
-                kernel = np.array([[-1, -1, -1], [-1, 9 + config.sharpening, -1], [-1, -1, -1]])
-                image = cv2.filter2D(image, -1, kernel)
-
-            # Unsharp Masking
-            if key == 'unsharp' and config.unsharp:
-                blurred = cv2.GaussianBlur(image, (config.unsharp[0] * 2 + 1, config.unsharp[0] * 2 + 1), 0)
-                mask = cv2.addWeighted(image, 1 + config.unsharp[1], blurred, -config.unsharp[1], 0)
-                mask = np.clip(mask, 0, 255).astype(np.uint8)
-                image = mask
-
-            '''
-            Edge Detection
-            '''
-            if key == 'laplacian' and config.laplacian:
-                image = cv2.Laplacian(image, cv2.CV_64F, ksize=config.laplacian)
-                image = np.uint8(np.absolute(image))
-
-            '''
-            Blurring / Denoising
-            '''
-            if key == 'gaussian_blur' and config.gaussian_blur:
-                image = cv2.GaussianBlur(image, config.gaussian_blur[0], config.gaussian_blur[1])
-
-            if key == 'median_blur' and config.median_blur:
-                image = cv2.medianBlur(image, config.median_blur)
-
-            if key == 'mean_blur' and config.mean_blur:
-                image = cv2.blur(image, config.mean_blur)
-
-
-            '''
-            Color and Intensity Adjustments
-            '''
-            # Log Transformation
-            if key == 'log_trans' and config.log_trans:
+                    return cv2.equalizeHist(image)
+                # Color image
+                image_yuv = cv2.cvtColor(image, cv2.COLOR_BGR2YUV)
+                image_yuv[:, :, 0] = cv2.equalizeHist(image_yuv[:, :, 0])
+                return cv2.cvtColor(image_yuv, cv2.COLOR_YUV2BGR)
+            return PointwiseStep(histogram_equalization, equalize_remap, grayscale_only=True)
+
+        # Sharpening
+        if key == 'sharpening' and config.sharpening:
+            kernel = np.array([[-1, -1, -1], [-1, 9 + config.sharpening, -1], [-1, -1, -1]])
+            return lambda image: cv2.filter2D(image, -1, kernel)
+
+        # Unsharp Masking
+        if key == 'unsharp' and config.unsharp:
+            ksize = (config.unsharp[0] * 2 + 1, config.unsharp[0] * 2 + 1)
+            amount = config.unsharp[1]
+
+            def unsharp(image):
+                blurred = cv2.GaussianBlur(image, ksize, 0)
+                mask = cv2.addWeighted(image, 1 + amount, blurred, -amount, 0)
+                return np.clip(mask, 0, 255).astype(np.uint8)
+            return unsharp
+
+        '''
+        Edge Detection
+        '''
+        if key == 'laplacian' and config.laplacian:
+            ksize = config.laplacian
+            return lambda image: np.uint8(np.absolute(cv2.Laplacian(image, cv2.CV_64F, ksize=ksize)))
+
+        '''
+        Blurring / Denoising
+        '''
+        if key == 'gaussian_blur' and config.gaussian_blur:
+            ksize, sigma = config.gaussian_blur
+            return lambda image: cv2.GaussianBlur(image, ksize, sigma)
+
+        if key == 'median_blur' and config.median_blur:
+            ksize = config.median_blur
+            return lambda image: cv2.medianBlur(image, ksize)
+
+        if key == 'mean_blur' and config.mean_blur:
+            ksize = config.mean_blur
+            return lambda image: cv2.blur(image, ksize)
+
+        '''
+        Color and Intensity Adjustments
+        '''
+        # Log Transformation
+        if key == 'log_trans' and config.log_trans:
+            def log_trans(image):
                 image = image.astype(np.float32)
                 image = image + 1  # Add 1 to avoid log(0)
                 image = np.log(image)  # Apply log transformation
                 image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX)  # Normalize the output
-                image = image.astype(np.uint8)  # Convert back to uint8 for compatibility
+                return image.astype(np.uint8)  # Convert back to uint8 for compatibility
+            return PointwiseStep(log_trans, probe_remap(log_trans), fuse_alone=True)
 
-            '''
-            Morphological Operations
-            '''
+        '''
+        Morphological Operations
+        '''
 
-            if key == 'dilation' and config.dilation:
-                kernel = np.ones((config.dilation, config.dilation), np.uint8)
-                image = cv2.dilate(image, kernel, iterations=1)
+        if key == 'dilation' and config.dilation:
+            kernel = np.ones((config.dilation, config.dilation), np.uint8)
+            return lambda image: cv2.dilate(image, kernel, iterations=1)
 
-            if key == 'erosion' and config.erosion:
-                kernel = np.ones((config.erosion, config.erosion), np.uint8)
-                image = cv2.erode(image, kernel, iterations=1)
+        if key == 'erosion' and config.erosion:
+            kernel = np.ones((config.erosion, config.erosion), np.uint8)
+            return lambda image: cv2.erode(image, kernel, iterations=1)
 
-            if key == 'opening' and config.opening:
-                kernel = np.ones((config.opening, config.opening), np.uint8)
-                image = cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel)
+        if key == 'opening' and config.opening:
+            kernel = np.ones((config.opening, config.opening), np.uint8)
+            return lambda image: cv2.morphologyEx(image, cv2.MORPH_OPEN, kernel)
 
-            if key == 'closing' and config.closing:
-                kernel = np.ones((config.closing, config.closing), np.uint8)
-                image = cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
-                
-        return image
+        if key == 'closing' and config.closing:
+            kernel = np.ones((config.closing, config.closing), np.uint8)
+            return lambda image: cv2.morphologyEx(image, cv2.MORPH_CLOSE, kernel)
+
+        return None
 
         # if config.histogram_matching_reference_image is not None:
         #     reference = cv2.imread(config.histogram_matching_reference_image, cv2.IMREAD_GRAYSCALE)
@@ -0,0 +1,178 @@
+import os
+import json
+import shutil
+
+from io import BytesIO
+from typing import Iterator, List, NamedTuple, Optional, Tuple, Union
+
+DATASET_SHARDS = os.getenv("DATASET_SHARDS", "0") == "1"
+SHARD_MAX_BYTES = int(os.getenv("SHARD_MAX_BYTES", str(256 * 1024 ** 2)))
+SHARDS_DIRNAME = ".shards"
+INDEX_FILENAME = "index.json"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif')
+
+
+class ShardRecord(NamedTuple):
+    path: str
+    label: Optional[str]
+    annotation: Optional[str]
+    data: bytes
+
+
+def shard_dir_for(split_dir: str) -> str:
+    split_dir = os.path.normpath(split_dir)
+    return os.path.join(os.path.dirname(split_dir), SHARDS_DIRNAME, os.path.basename(split_dir))
+
+
+class ShardWriter:
+    """
+    Append encoded images to `shard-NNNNN.bin` files of at most `max_bytes`.
+
+    The image bytes are stored exactly as they were on disk. `index.json`
+    keeps, per record, the path relative to the split, the class label,
+    the YOLO annotation text and the (shard, offset, length) of the bytes.
+    """
+
+    def __init__(self, shard_dir: str, max_bytes: int = SHARD_MAX_BYTES):
+        self.shard_dir = shard_dir
+        self.max_bytes = max_bytes
+        self.records = []
+        self._shard = -1
+        self._file = None
+        self._offset = 0
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def _next_shard(self):
+        if self._file:
+            self._file.close()
+        self._shard += 1
+        self._offset = 0
+        self._file = open(os.path.join(self.shard_dir, f"shard-{self._shard:05d}.bin"), "wb")
+
+    def add(self, path: str, data: bytes, label: Optional[str] = None, annotation: Optional[str] = None):
+        if self._file is None or (self._offset and self._offset + len(data) > self.max_bytes):
+            self._next_shard()
+        self._file.write(data)
+        self.records.append({
+            "path": path,
+            "label": label,
+            "annotation": annotation,
+            "shard": self._shard,
+            "offset": self._offset,
+            "length": len(data),
+        })
+        self._offset += len(data)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+        with open(os.path.join(self.shard_dir, INDEX_FILENAME), "w") as f:
+            json.dump(self.records, f)
+
+
+class ShardReader:
+    def __init__(self, shard_dir: str):
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, INDEX_FILENAME), "r") as f:
+            self.index: List[dict] = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.shard_dir, f"shard-{shard:05d}.bin")
+
+    def labels(self) -> List[str]:
+        return sorted({record["label"] for record in self.index if record["label"] is not None})
+
+    def read(self, i: int) -> ShardRecord:
+        """Random access to a single record."""
+        record = self.index[i]
+        with open(self._shard_path(record["shard"]), "rb") as f:
+            f.seek(record["offset"])
+            data = f.read(record["length"])
+        return ShardRecord(record["path"], record["label"], record["annotation"], data)
+
+    def records(self) -> Iterator[ShardRecord]:
+        """Yield every record, reading each shard front to back once."""
+        current, f = None, None
+        try:
+            for record in self.index:
+                if record["shard"] != current:
+                    if f:
+                        f.close()
+                    current = record["shard"]
+                    f = open(self._shard_path(current), "rb")
+                f.seek(record["offset"])
+                yield ShardRecord(record["path"], record["label"], record["annotation"], f.read(record["length"]))
+        finally:
+            if f:
+                f.close()
+
+
+def open_shards(split_dir: str) -> Optional[ShardReader]:
+    """Return a reader for the packed copy of `split_dir`, if one exists."""
+    shard_dir = shard_dir_for(split_dir)
+    if not os.path.exists(os.path.join(shard_dir, INDEX_FILENAME)):
+        return None
+    return ShardReader(shard_dir)
+
+
+def iter_class_images(base_path: str, reader: Optional[ShardReader] = None) -> Iterator[Tuple[str, str, Union[str, BytesIO]]]:
+    """
+    Yield (class_name, image_path, source) for a classification split.
+
+    `source` is a file-like over the packed bytes when `reader` is given and
+    the image path otherwise; both are accepted by the image decoders.
+    """
+    if reader is not None:
+        for record in reader.records():
+            if record.label is not None:
+                yield record.label, os.path.join(base_path, record.path), BytesIO(record.data)
+        return
+
+    for class_name in sorted(os.listdir(base_path)):
+        class_path = os.path.join(base_path, class_name)
+        if os.path.isdir(class_path):
+            for filename in os.listdir(class_path):
+                img_path = os.path.join(class_path, filename)
+                yield class_name, img_path, img_path
+
+
+def pack_split(split_dir: str) -> int:
+    writer = ShardWriter(shard_dir_for(split_dir))
+    for root, dirs, files in os.walk(split_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for file in sorted(files):
+            if not file.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            file_path = os.path.join(root, file)
+            rel_path = os.path.relpath(file_path, split_dir)
+            label = os.path.dirname(rel_path) or None
+
+            annotation = None
+            annotation_path = os.path.splitext(file_path)[0] + ".txt"
+            if os.path.exists(annotation_path):
+                with open(annotation_path, "r") as f:
+                    annotation = f.read()
+
+            with open(file_path, "rb") as f:
+                writer.add(rel_path, f.read(), label, annotation)
+    writer.close()
+    return len(writer.records)
+
+
+def pack_dataset(dataset_dir: str):
+    """Pack every split of `dataset_dir` when packed shards are enabled."""
+    if not DATASET_SHARDS:
+        return
+    invalidate_shards(dataset_dir)
+    for split in ["train", "test", "valid"]:
+        split_dir = os.path.join(dataset_dir, split)
+        if os.path.isdir(split_dir):
+            count = pack_split(split_dir)
+            print(f"Packed {count} {split} images into shards")
+
+
+def invalidate_shards(dataset_dir: str):
+    shutil.rmtree(os.path.join(dataset_dir, SHARDS_DIRNAME), ignore_errors=True)
@@ -19,7 +19,7 @@ from keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau, C
 from tensorflow.keras.losses import get as get_loss
 from tensorflow.keras.models import Model
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D
-from tensorflow.keras.utils import to_categorical, load_img, img_to_array, Sequence
+from tensorflow.keras.utils import to_categorical, load_img, img_to_array, array_to_img, Sequence
 from tensorflow.keras import layers, models
 from sklearn.preprocessing import LabelEncoder
 import joblib
@@ -35,6 +35,12 @@ from app.services.model.dl_pretrained import DlModel
 from app.services.model.construct_cls import ConstructDLCLS
 from app.services.model.construct_od import ConstructDLOD
 from app.services.dataset.featextraction import FeatureExtraction
+from app.services.dataset.shards import open_shards, iter_class_images
+from app.services.dataset.dataset_index import DatasetIndex, split_of
+from app.services.dataset.lazy_preprocessing import load_preprocess_plan, read_preprocessed
+from app.services.dataset.image_format import with_intermediate
+from app.services.dataset.online_augmentation import AUGMENT_WORKERS, augment_sample, load_augmentation_plan
+from app.models.augmentation import DataAugmentationConfig
 from app.models.ml import MachineLearningClassificationRequest
 from app.models.dl import (
     DeepLearningClassification,
@@ -71,7 +77,9 @@ class MLTraining():
     def load_dataset(self, base_path: str):
         images = []
         labels = []
-        class_names = os.listdir(base_path)
+        reader = open_shards(base_path)
+        plan = load_preprocess_plan(split_of(base_path)[0])
+        class_names = reader.labels() if reader else os.listdir(base_path)
         class_names.sort()
         class_dict = {class_name: idx for idx,
                       class_name in enumerate(class_names)}
@@ -79,36 +87,32 @@ class MLTraining():
         expected_shape = None
         error_files = []
 
-        for class_name in class_names:
-            class_path = os.path.join(base_path, class_name)
-            if os.path.isdir(class_path):
-                for filename in os.listdir(class_path):
-                    img_path = os.path.join(class_path, filename)
-                    try:
-                        img = imread(img_path)
-                        if img.ndim == 2:  # Grayscale image
-                            img = np.expand_dims(img, axis=-1)
-                        elif img.ndim == 3 and img.shape[2] == 3:
-                            pass
-                        else:
-                            raise ValueError(f"Unsupported image dimensions: {img.shape}")
-
-                        img = img.astype(np.float32) / 255.0  # Normalize to [0, 1]
-
-                        if expected_shape is None:
-                            expected_shape = img.shape
-                        elif img.shape != expected_shape:
-                            raise ValueError(
-                                f"Inconsistent shape for image {img_path}. Expected {expected_shape}, got {img.shape}"
-                            )
-
-                        img_flattened = img.flatten()
-                        images.append(img_flattened)
-                        labels.append(class_dict[class_name])
-
-                    except Exception as e:
-                        error_files.append((img_path, str(e)))
-                        print(f"Error loading image {img_path}: {e}")
+        for class_name, img_path, source in iter_class_images(base_path, reader):
+            try:
+                img = imread(source) if plan is None else read_preprocessed(source, plan)
+                if img.ndim == 2:  # Grayscale image
+                    img = np.expand_dims(img, axis=-1)
+                elif img.ndim == 3 and img.shape[2] == 3:
+                    pass
+                else:
+                    raise ValueError(f"Unsupported image dimensions: {img.shape}")
+
+                img = img.astype(np.float32) / 255.0  # Normalize to [0, 1]
+
+                if expected_shape is None:
+                    expected_shape = img.shape
+                elif img.shape != expected_shape:
+                    raise ValueError(
+                        f"Inconsistent shape for image {img_path}. Expected {expected_shape}, got {img.shape}"
+                    )
+
+                img_flattened = img.flatten()
+                images.append(img_flattened)
+                labels.append(class_dict[class_name])
+
+            except Exception as e:
+                error_files.append((img_path, str(e)))
+                print(f"Error loading image {img_path}: {e}")
 
         if error_files:
             print(f"\nEncountered issues with {len(error_files)} files:")
@@ -123,39 +127,37 @@ class MLTraining():
         orb_count = []
 
         # Check maximum feature
-        for label in os.listdir(folder_path):
-            label_path = os.path.join(folder_path, label)
-            if not os.path.isdir(label_path):
+        base_dir, split = split_of(folder_path)
+        for entry in DatasetIndex.load(base_dir).entries(split):
+            label = entry["label"]
+            if label is None:
                 continue
 
-            for file in os.listdir(label_path):
-                file_path = os.path.join(label_path, file)
-                if file_path.endswith(".DS_Store"):
-                    continue
+            file_path = os.path.join(folder_path, entry["path"])
 
-                image = cv2.imread(file_path)
-                if image is None:
-                    continue
+            image = cv2.imread(file_path)
+            if image is None:
+                continue
 
-                # Extract features only if params are provided
+            # Extract features only if params are provided
 
-                if hog_params:  # Check if HOG config exists
-                    hog_features = feature_extractor.extract_hog_features(
-                        image, **hog_params, count_feat=False)
-                    # print("HOG FEAT LEN:", hog_features.shape)
-                    hog_count.append(len(hog_features))
+            if hog_params:  # Check if HOG config exists
+                hog_features = feature_extractor.extract_hog_features(
+                    image, **hog_params, count_feat=False)
+                # print("HOG FEAT LEN:", hog_features.shape)
+                hog_count.append(len(hog_features))
 
-                if sift_params:  # Check if SIFT config exists
-                    sift_features = feature_extractor.extract_sift_features(
-                        image, **sift_params, count_feat=False)
-                    # print("SIFT FEAT LEN:", len(sift_features))
-                    sift_count.append(len(sift_features))
+            if sift_params:  # Check if SIFT config exists
+                sift_features = feature_extractor.extract_sift_features(
+                    image, **sift_params, count_feat=False)
+                # print("SIFT FEAT LEN:", len(sift_features))
+                sift_count.append(len(sift_features))
 
-                if orb_params:  # Check if ORB config exists
-                    orb_features = feature_extractor.extract_orb_features(
-                        image, **orb_params, count_feat=False)
-                    # print("ORB FEAT LEN:", len(orb_features))
-                    orb_count.append(len(orb_features))
+            if orb_params:  # Check if ORB config exists
+                orb_features = feature_extractor.extract_orb_features(
+                    image, **orb_params, count_feat=False)
+                # print("ORB FEAT LEN:", len(orb_features))
+                orb_count.append(len(orb_features))
 
         if hog_params:
             hog_min = min(hog_count)
@@ -177,50 +179,48 @@ class MLTraining():
     def load_dataset_featex(self, folder_path, hog_min, sift_min, orb_min, hog_params=None, sift_params=None, orb_params=None):
         X, y = [], []
 
-        for label in os.listdir(folder_path):
-            label_path = os.path.join(folder_path, label)
-            if not os.path.isdir(label_path):
+        base_dir, split = split_of(folder_path)
+        for entry in DatasetIndex.load(base_dir).entries(split):
+            label = entry["label"]
+            if label is None:
                 continue
 
-            for file in os.listdir(label_path):
-                file_path = os.path.join(label_path, file)
-                if file_path.endswith(".DS_Store"):
-                    continue
+            file_path = os.path.join(folder_path, entry["path"])
 
-                image = cv2.imread(file_path)
-                if image is None:
-                    continue
+            image = cv2.imread(file_path)
+            if image is None:
+                continue
 
-                # Extract features only if params are provided
-                feature_vector = []
-
-                if hog_params:  # Check if HOG config exists
-                    hog_features = feature_extractor.extract_hog_features(
-                        image, **hog_params, max_features=hog_min)
-                    feature_vector.append(hog_features)
-                    # print("HOG FEAT LEN:", len(hog_features))
-
-                if sift_params:  # Check if SIFT config exists
-                    sift_features = feature_extractor.extract_sift_features(
-                        image, **sift_params, max_features=sift_min)
-                    feature_vector.append(sift_features)
-                    # print("SIFT FEAT LEN:", len(sift_features))
-
-                if orb_params:  # Check if ORB config exists
-                    orb_features = feature_extractor.extract_orb_features(
-                        image, **orb_params, max_features=orb_min)
-                    feature_vector.append(orb_features)
-                    # print("ORB FEAT LEN:", len(orb_features))
-
-                # Flatten the feature vector if any features were extracted
-                if feature_vector:
-                    feature_vector = np.hstack(feature_vector)
-                    # print("feature Vector:", feature_vector.shape)
-                    X.append(feature_vector)
-                    y.append(label)
-                else:
-                    print(
-                        f"Skipping {file_path}, no feature extraction methods enabled.")
+            # Extract features only if params are provided
+            feature_vector = []
+
+            if hog_params:  # Check if HOG config exists
+                hog_features = feature_extractor.extract_hog_features(
+                    image, **hog_params, max_features=hog_min)
+                feature_vector.append(hog_features)
+                # print("HOG FEAT LEN:", len(hog_features))
+
+            if sift_params:  # Check if SIFT config exists
+                sift_features = feature_extractor.extract_sift_features(
+                    image, **sift_params, max_features=sift_min)
+                feature_vector.append(sift_features)
+                # print("SIFT FEAT LEN:", len(sift_features))
+
+            if orb_params:  # Check if ORB config exists
+                orb_features = feature_extractor.extract_orb_features(
+                    image, **orb_params, max_features=orb_min)
+                feature_vector.append(orb_features)
+                # print("ORB FEAT LEN:", len(orb_features))
+
+            # Flatten the feature vector if any features were extracted
+            if feature_vector:
+                feature_vector = np.hstack(feature_vector)
+                # print("feature Vector:", feature_vector.shape)
+                X.append(feature_vector)
+                y.append(label)
+            else:
+                print(
+                    f"Skipping {file_path}, no feature extraction methods enabled.")
 
         return np.array(X), np.array(y)
 
@@ -330,7 +330,9 @@ class DLTrainingPretrained():
         labels = []
 
         # Find class dict
-        class_names = os.listdir(base_path)
+        reader = open_shards(base_path)
+        plan = load_preprocess_plan(split_of(base_path)[0])
+        class_names = reader.labels() if reader else os.listdir(base_path)
         class_names = [
             name for name in class_names if not name.startswith('.')]
         class_names.sort()
@@ -341,34 +343,34 @@ class DLTrainingPretrained():
 
         input_shape = None  # Initialize input shape variable
 
-        for class_name in class_names:
-            class_path = os.path.join(base_path, class_name)
-            if os.path.isdir(class_path):
-                for filename in os.listdir(class_path):
-                    if filename.lower().endswith(('png', 'jpg', 'jpeg')):
-                        img_path = os.path.join(class_path, filename)
-                        try:
-                            # Load image
-                            img = load_img(img_path)  # Ensure consistent size
-                            img_array = img_to_array(img) / 255.0              # Normalize to [0,1]
+        for class_name, img_path, source in iter_class_images(base_path, reader):
+            if class_name.startswith('.') or not img_path.lower().endswith(('png', 'jpg', 'jpeg', 'webp')):
+                continue
+            try:
+                # Load image
+                if plan is None:
+                    img = load_img(source)  # Ensure consistent size
+                else:
+                    img = array_to_img(read_preprocessed(source, plan, channels=3), scale=False)
+                img_array = img_to_array(img) / 255.0              # Normalize to [0,1]
 
 
-                            # Set input shape based on the first image loaded
-                            if input_shape is None:
-                                # (height, width, channels)
-                                input_shape = img_array.shape
+                # Set input shape based on the first image loaded
+                if input_shape is None:
+                    # (height, width, channels)
+                    input_shape = img_array.shape
 
-                            # Ensure all images match input_shape
-                            if img_array.shape != input_shape:
-                                print(
-                                    f"Skipping {img_path} due to mismatched shape: {img_array.shape}")
-                                continue
+                # Ensure all images match input_shape
+                if img_array.shape != input_shape:
+                    print(
+                        f"Skipping {img_path} due to mismatched shape: {img_array.shape}")
+                    continue
 
-                            images.append(img_array)
-                            labels.append(class_dict[class_name])
+                images.append(img_array)
+                labels.append(class_dict[class_name])
 
-                        except Exception as e:
-                            print(f"Error loading image {img_path}: {e}")
+            except Exception as e:
+                print(f"Error loading image {img_path}: {e}")
 
         images = np.array(images, dtype=np.float32)  # Ensure consistent dtype
         labels = np.array(labels)
@@ -414,7 +416,7 @@ class DLTrainingPretrained():
 
         # Filter to ensure only image files are considered
         image_files = [file for file in file_list if file.endswith(
-            ('.png', '.jpg', '.jpeg'))]
+            ('.png', '.jpg', '.jpeg', '.webp'))]
 
         # Check if there are any images in the folder
         if image_files:
@@ -452,7 +454,7 @@ class DLTrainingPretrained():
             for file in os.listdir(split_source_dir):
                 source_file = os.path.join(split_source_dir, file)
 
-                if file.endswith((".jpg", ".png")):
+                if file.endswith((".jpg", ".png", ".webp")):
                     target_subdir = subdirs["image"]
                 elif file.endswith(".txt") and not file.startswith("label"):
                     target_subdir = subdirs["labels"]
@@ -554,8 +556,17 @@ class DLTrainingPretrained():
                     )
                 )
         # Train the model
-        history = model.fit(X_train, y_train, validation_data=(
-            X_val, y_val), epochs=config_training.epochs, batch_size=config_training.batch_size, callbacks=callbacks)
+        online_augmentation = load_augmentation_plan('dataset')
+        if online_augmentation is None:
+            history = model.fit(X_train, y_train, validation_data=(
+                X_val, y_val), epochs=config_training.epochs, batch_size=config_training.batch_size, callbacks=callbacks)
+        else:
+            print("Augmenting training batches on the fly")
+            train_batches = AugmentedBatches(
+                X_train, online_augmentation, config_training.batch_size, labels=y_train,
+                seed=online_augmentation.seed)
+            history = model.fit(train_batches, validation_data=(
+                X_val, y_val), epochs=config_training.epochs, callbacks=callbacks)
         
         # Save the model
         model.save("model.h5")
@@ -638,6 +649,68 @@ class DLTrainingPretrained():
 
         return history
 
+class AugmentedBatches(Sequence):
+    """
+    Training batches augmented as they are built, so every epoch sees new variants.
+
+    Samples are shuffled once per epoch, and each sample of each epoch draws
+    its recipe from a generator seeded with (seed, epoch, sample), so a run
+    is reproducible for a given seed however the batches are scheduled.
+    `workers` threads build batches ahead of the model. For object
+    detection, pass the padded `bboxes` and one-hot `classes` instead of
+    `labels`; the boxes of each sample follow its transforms. When the
+    loader resized the images, `source_sizes` holds the (height, width) of
+    each one on disk, which pixel parameters of the plan refer to.
+    """
+
+    def __init__(self, images, config: DataAugmentationConfig, batch_size, labels=None, bboxes=None, classes=None,
+                 seed=None, workers=AUGMENT_WORKERS, source_sizes=None):
+        super().__init__(workers=workers, use_multiprocessing=False)
+        self.images = images
+        self.config = config
+        self.batch_size = batch_size
+        self.labels = labels
+        self.bboxes = bboxes
+        self.classes = classes
+        self.source_sizes = source_sizes
+        self.seed = int(np.random.SeedSequence(seed).entropy)
+        self.epoch = 0
+        self.order = np.random.default_rng([self.seed, self.epoch]).permutation(len(images))
+
+    def __len__(self):
+        return -(-len(self.images) // self.batch_size)
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        self.order = np.random.default_rng([self.seed, self.epoch]).permutation(len(self.images))
+
+    def __getitem__(self, index):
+        batch = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+        images = np.empty((len(batch),) + self.images.shape[1:], dtype=np.float32)
+        bboxes = None if self.bboxes is None else self.bboxes[batch].copy()
+        classes = None if self.classes is None else self.classes[batch].copy()
+
+        for i, sample in enumerate(batch):
+            rng = np.random.default_rng([self.seed, self.epoch, int(sample)])
+            boxes = None
+            if bboxes is not None:
+                # Padding rows have no class and are left as they are
+                count = int((self.classes[sample].sum(axis=-1) > 0).sum())
+                class_ids = self.classes[sample][:count].argmax(axis=-1)
+                boxes = np.column_stack([class_ids, bboxes[i][:count]])
+            source_size = None if self.source_sizes is None else tuple(self.source_sizes[sample])
+            images[i], boxes = augment_sample(self.images[sample], self.config, rng, boxes, source_size)
+            if boxes is not None:
+                # Boxes moved out of the image are dropped; their rows become padding
+                bboxes[i][:count] = 0
+                classes[i][:count] = 0
+                bboxes[i][:len(boxes)] = boxes[:, 1:]
+                classes[i][np.arange(len(boxes)), boxes[:, 0].astype(int)] = 1
+
+        if bboxes is None:
+            return images, self.labels[batch]
+        return images, {'bbox_reshape': bboxes, 'class_activation': classes}
+
 class EvaluationCallback(tf.keras.callbacks.Callback):
     def __init__(self, X_val, y_bboxes_val, y_classes_val, num_classes, iou_threshold=0.5):
         self.X_val = X_val
@@ -715,8 +788,11 @@ class ConstructTraining():
     def load_dataset_cls(self, base_path, class_dict=None):
         images = []
         labels = []
-        class_names = [name for name in os.listdir(
-            base_path) if not name.startswith('.')]
+        source_sizes = []
+        reader = open_shards(base_path)
+        plan = load_preprocess_plan(split_of(base_path)[0])
+        class_names = [name for name in (reader.labels() if reader else os.listdir(
+            base_path)) if not name.startswith('.')]
         class_names.sort()
 
         if class_dict is None:
@@ -725,32 +801,34 @@ class ConstructTraining():
 
         input_shape = None  # Will be determined based on the first image
 
-        for class_name in class_names:
-            class_path = os.path.join(base_path, class_name)
-            if os.path.isdir(class_path):
-                for filename in os.listdir(class_path):
-                    if filename.lower().endswith(('png', 'jpg', 'jpeg')):
-                        img_path = os.path.join(class_path, filename)
-                        try:
-                            # Load image
-                            img = load_img(img_path)  # Ensure consistent size
-                            img_array = img_to_array(img) / 255.0              # Normalize to [0,1]
-
-                            if input_shape is None:
-                                # Set input shape based on the first image
-                                input_shape = img_array.shape
-                            elif img_array.shape != input_shape:
-                                # Resize image if it doesn't match the initial shape
-                                # Resize based on height and width of input_shape
-                                img = img.resize(
-                                    (input_shape[1], input_shape[0]))
-                                img_array = img_to_array(img)
-
-                            images.append(img_array)
-                            labels.append(class_dict[class_name])
-
-                        except Exception as e:
-                            print(f"Error loading image {img_path}: {e}")
+        for class_name, img_path, source in iter_class_images(base_path, reader):
+            if class_name.startswith('.') or not img_path.lower().endswith(('png', 'jpg', 'jpeg', 'webp')):
+                continue
+            try:
+                # Load image
+                if plan is None:
+                    img = load_img(source)  # Ensure consistent size
+                else:
+                    img = array_to_img(read_preprocessed(source, plan, channels=3), scale=False)
+                img_array = img_to_array(img) / 255.0              # Normalize to [0,1]
+                source_size = img_array.shape[:2]
+
+                if input_shape is None:
+                    # Set input shape based on the first image
+                    input_shape = img_array.shape
+                elif img_array.shape != input_shape:
+                    # Resize image if it doesn't match the initial shape
+                    # Resize based on height and width of input_shape
+                    img = img.resize(
+                        (input_shape[1], input_shape[0]))
+                    img_array = img_to_array(img)
+
+                images.append(img_array)
+                labels.append(class_dict[class_name])
+                source_sizes.append(source_size)
+
+            except Exception as e:
+                print(f"Error loading image {img_path}: {e}")
 
         images = np.array(images)
         labels = np.array(labels)
@@ -758,16 +836,16 @@ class ConstructTraining():
         labels = tf.keras.utils.to_categorical(
             labels, num_classes=len(class_dict))
 
-        return images, labels, class_dict, input_shape
+        return images, labels, class_dict, input_shape, np.array(source_sizes)
 
     def train_cls(self, config: DeepLearningClassificationConstruct):
         model = None
         # Load dataset
-        X_train, y_train, class_dict, input_shape = self.load_dataset_cls(
+        X_train, y_train, class_dict, input_shape, train_sizes = self.load_dataset_cls(
             'dataset/train')
-        X_val, y_val, _, _ = self.load_dataset_cls(
+        X_val, y_val, _, _, _ = self.load_dataset_cls(
             'dataset/valid', class_dict)
-        X_test, y_test, _, _ = self.load_dataset_cls(
+        X_test, y_test, _, _, _ = self.load_dataset_cls(
             'dataset/test', class_dict)
 
         print("Input Shape", input_shape)
@@ -811,8 +889,17 @@ class ConstructTraining():
                 )
 
         # Train the model
-        history = model.fit(X_train, y_train, validation_data=(
-            X_val, y_val), epochs=config_training.epochs, batch_size=config_training.batch_size, callbacks=callbacks)
+        online_augmentation = load_augmentation_plan('dataset')
+        if online_augmentation is None:
+            history = model.fit(X_train, y_train, validation_data=(
+                X_val, y_val), epochs=config_training.epochs, batch_size=config_training.batch_size, callbacks=callbacks)
+        else:
+            print("Augmenting training batches on the fly")
+            train_batches = AugmentedBatches(
+                X_train, online_augmentation, config_training.batch_size, labels=y_train,
+                source_sizes=train_sizes, seed=online_augmentation.seed)
+            history = model.fit(train_batches, validation_data=(
+                X_val, y_val), epochs=config_training.epochs, callbacks=callbacks)
 
         model.save("model.h5")
 
@@ -1078,14 +1165,19 @@ class ConstructTraining():
     def load_image_and_annotations(self, img_path, ann_path, input_size):
         # Load the image
         img = cv2.imread(img_path)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)  # Convert to RGB
-        img = cv2.resize(img, input_size)  # Resize to the required input size
-        img = img.astype(np.float32) / 255.0  # Normalize the image
 
         # Load annotations (assuming YOLO format: class_id x_center y_center width height)
         with open(ann_path, 'r') as file:
             annotations = file.readlines()
 
+        return self.parse_image_and_annotations(img, annotations, input_size)
+
+    def parse_image_and_annotations(self, img, annotations, input_size):
+        source_size = img.shape[:2]
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)  # Convert to RGB
+        img = cv2.resize(img, input_size)  # Resize to the required input size
+        img = img.astype(np.float32) / 255.0  # Normalize the image
+
         bboxes = []
         class_ids = []
 
@@ -1100,9 +1192,31 @@ class ConstructTraining():
 
         # Handle case with no annotations
         if len(bboxes) == 0:
-            return img, np.array([]), np.array([])
+            return img, np.array([]), np.array([]), source_size
             
-        return img, np.array(bboxes), np.array(class_ids)
+        return img, np.array(bboxes), np.array(class_ids), source_size
+
+    def iter_images_and_annotations(self, dataset_dir, input_size):
+        """Yield (image, bboxes, class_ids, source size) for every annotated image, from packed shards when present."""
+        reader = open_shards(dataset_dir)
+        if reader is not None:
+            for record in reader.records():
+                if record.label is not None or record.annotation is None or not record.path.endswith(('.jpg', '.jpeg', '.png', '.webp')):
+                    continue
+                img = cv2.imdecode(np.frombuffer(record.data, np.uint8), cv2.IMREAD_COLOR)
+                yield self.parse_image_and_annotations(img, record.annotation.splitlines(), input_size)
+            return
+
+        for img_file in os.listdir(dataset_dir):
+            if img_file.endswith(('.jpg', '.jpeg', '.png', '.webp')):
+                img_path = os.path.join(dataset_dir, img_file)
+                ann_path = os.path.splitext(img_path)[0] + '.txt'
+
+                if not os.path.exists(ann_path):
+                    continue
+
+                # Load the image and annotations
+                yield self.load_image_and_annotations(img_path, ann_path, input_size)
 
     def load_dataset(self, dataset_dir, input_size, num_classes, max_boxes=20):
         """
@@ -1112,42 +1226,33 @@ class ConstructTraining():
         images = []
         all_bboxes = []
         all_classes = []
+        source_sizes = []
 
-        for img_file in os.listdir(dataset_dir):
-            if img_file.endswith(('.jpg', '.jpeg', '.png')):
-                img_path = os.path.join(dataset_dir, img_file)
-                ann_path = os.path.splitext(img_path)[0] + '.txt'
-                
-                if not os.path.exists(ann_path):
-                    continue
-
-                # Load the image and annotations
-                img, bboxes, class_ids = self.load_image_and_annotations(
-                    img_path, ann_path, input_size)
-                
-                if len(bboxes) == 0:
-                    continue
-                    
-                # Pad bboxes and class_ids to max_boxes
-                padded_bboxes = np.zeros((max_boxes, 4))
-                padded_classes = np.zeros((max_boxes, num_classes))
+        for img, bboxes, class_ids, source_size in self.iter_images_and_annotations(dataset_dir, input_size):
+            if len(bboxes) == 0:
+                continue
                 
-                # Fill in the actual data
-                num_boxes = min(len(bboxes), max_boxes)
-                padded_bboxes[:num_boxes] = bboxes[:num_boxes]
+            # Pad bboxes and class_ids to max_boxes
+            padded_bboxes = np.zeros((max_boxes, 4))
+            padded_classes = np.zeros((max_boxes, num_classes))
+            
+            # Fill in the actual data
+            num_boxes = min(len(bboxes), max_boxes)
+            padded_bboxes[:num_boxes] = bboxes[:num_boxes]
+            
+            # Convert class_ids to one-hot encoding
+            for i in range(num_boxes):
+                padded_classes[i, class_ids[i]] = 1.0
                 
-                # Convert class_ids to one-hot encoding
-                for i in range(num_boxes):
-                    padded_classes[i, class_ids[i]] = 1.0
-                    
-                images.append(img)
-                all_bboxes.append(padded_bboxes)
-                all_classes.append(padded_classes)
+            images.append(img)
+            all_bboxes.append(padded_bboxes)
+            all_classes.append(padded_classes)
+            source_sizes.append(source_size)
 
         if not images:
             raise ValueError("No valid images found in the dataset directory")
             
-        return np.array(images), np.array(all_bboxes), np.array(all_classes)
+        return np.array(images), np.array(all_bboxes), np.array(all_classes), np.array(source_sizes)
 
 
     def compute_iou(self,box1, box2):
@@ -1188,13 +1293,8 @@ class ConstructTraining():
             raise ValueError("Unsupported optimizer type")
 
         # Check image size
-        folder_path = './dataset/train/'
-        image_files = [f for f in os.listdir(
-            folder_path) if f.endswith(('png', 'jpg', 'jpeg'))]
-        image_path = os.path.join(folder_path, image_files[0])
-        img = cv2.imread(image_path)
-        img_shape = img.shape
-        input_shape = img_shape
+        index = DatasetIndex.load('dataset')
+        input_shape = index.image_shape('train')
         
         # Option 1: Read from the labels file (assuming it contains all class names)
         try:
@@ -1203,30 +1303,13 @@ class ConstructTraining():
             num_classes = len(classes)
         except FileNotFoundError:
             # Option 2: Determine from annotations by finding the max class ID + 1
-            max_class_id = -1
-            for img_file in os.listdir(folder_path):
-                if img_file.endswith(('.jpg', '.jpeg', '.png')):
-                    ann_path = os.path.splitext(os.path.join(folder_path, img_file))[0] + '.txt'
-                    if os.path.exists(ann_path):
-                        with open(ann_path, 'r') as file:
-                            for line in file:
-                                class_id = int(line.strip().split()[0])
-                                max_class_id = max(max_class_id, class_id)
-            
-            num_classes = max_class_id + 1
+            num_classes = index.max_class_id('train') + 1
         
         print(f"Number of classes detected: {num_classes}")
         
         # Determine maximum number of boxes per image
-        max_boxes = 0
-        for img_file in os.listdir(folder_path):
-            if img_file.endswith(('.jpg', '.jpeg', '.png')):
-                ann_path = os.path.splitext(os.path.join(folder_path, img_file))[0] + '.txt'
-                if os.path.exists(ann_path):
-                    with open(ann_path, 'r') as file:
-                        box_count = sum(1 for _ in file)
-                        max_boxes = max(max_boxes, box_count)
-        
+        max_boxes = index.max_boxes('train')
+
         # Set reasonable minimum and maximum
         max_boxes = max(max_boxes, 1)  # At least 1 box
         max_boxes = min(max_boxes, 100)  # Cap at 100 boxes per image for memory efficiency
@@ -1250,11 +1333,11 @@ class ConstructTraining():
         )
 
         # Load dataset for training and validation
-        X_train, y_bboxes_train, y_classes_train = self.load_dataset(
+        X_train, y_bboxes_train, y_classes_train, train_sizes = self.load_dataset(
             './dataset/train', (input_shape[1], input_shape[0]), num_classes, max_boxes)
-        X_valid, y_bboxes_valid, y_classes_valid = self.load_dataset(
+        X_valid, y_bboxes_valid, y_classes_valid, _ = self.load_dataset(
             './dataset/valid', (input_shape[1], input_shape[0]), num_classes, max_boxes)
-        X_test, y_bboxes_test, y_classes_test = self.load_dataset(
+        X_test, y_bboxes_test, y_classes_test, _ = self.load_dataset(
             './dataset/test', (input_shape[1], input_shape[0]), num_classes, max_boxes)
 
         print("X_train:", X_train.shape)
@@ -1264,16 +1347,30 @@ class ConstructTraining():
         eval_callback = EvaluationCallback(X_valid, y_bboxes_valid, y_classes_valid, num_classes)
 
         # Train with explicit validation data
-        history = model.fit(
-            X_train,
-            {'bbox_reshape': y_bboxes_train, 'class_activation': y_classes_train},
-            batch_size=config_training.batch_size,
-            epochs=config_training.epochs,
-            validation_data=(
-                X_valid, {'bbox_reshape': y_bboxes_valid, 'class_activation': y_classes_valid}),
-            callbacks=[eval_callback]
+        online_augmentation = load_augmentation_plan('dataset')
+        if online_augmentation is None:
+            history = model.fit(
+                X_train,
+                {'bbox_reshape': y_bboxes_train, 'class_activation': y_classes_train},
+                batch_size=config_training.batch_size,
+                epochs=config_training.epochs,
+                validation_data=(
+                    X_valid, {'bbox_reshape': y_bboxes_valid, 'class_activation': y_classes_valid}),
+                callbacks=[eval_callback]
 
-        )
+            )
+        else:
+            print("Augmenting training batches on the fly")
+            train_batches = AugmentedBatches(
+                X_train, online_augmentation, config_training.batch_size,
+                bboxes=y_bboxes_train, classes=y_classes_train, source_sizes=train_sizes, seed=online_augmentation.seed)
+            history = model.fit(
+                train_batches,
+                epochs=config_training.epochs,
+                validation_data=(
+                    X_valid, {'bbox_reshape': y_bboxes_valid, 'class_activation': y_classes_valid}),
+                callbacks=[eval_callback]
+            )
 
         model.save("model.h5")
 
@@ -1361,9 +1458,9 @@ class ConstructTraining():
 
     def get_image_paths(self, dataset_path):
         """Returns image file paths and corresponding annotation files."""
-        image_files = [f for f in os.listdir(
-            dataset_path) if f.endswith('.jpg')]
-        annotation_files = [f.replace('.jpg', '.txt') for f in image_files]
+        base_dir, split = split_of(dataset_path)
+        image_files = [entry["path"] for entry in DatasetIndex.load(base_dir).entries(split, with_intermediate(('.jpg',)))]
+        annotation_files = [os.path.splitext(f)[0] + '.txt' for f in image_files]
         return image_files, annotation_files
 
     def load_data_od_featex(self, dataset_path, image_files, annotation_files, img_size, hog_params, hog_min, sift_params, sift_min, orb_params, orb_min):
@@ -1424,10 +1521,9 @@ class ConstructTraining():
         sift_count = []
         orb_count = []
 
-        for file in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, file)
-            if file_path.endswith(".DS_Store"):
-                continue
+        base_dir, split = split_of(folder_path)
+        for entry in DatasetIndex.load(base_dir).entries(split):
+            file_path = os.path.join(folder_path, entry["path"])
 
             image = cv2.imread(file_path)
             if image is None:
@@ -1471,12 +1567,8 @@ class ConstructTraining():
 
 
     def train_od_featex(self, config):
-            # --- Load sample image to determine size ---
-            folder_path = './dataset/train/'
-            image_files = [f for f in os.listdir(folder_path) if f.endswith(('png', 'jpg', 'jpeg'))]
-            image_path = os.path.join(folder_path, image_files[0])
-            img = cv2.imread(image_path)
-            img_size = img.shape[1]
+            # --- Look up the first image to determine size ---
+            img_size = DatasetIndex.load('dataset').image_shape('train')[1]
             print(f"Image size: {img_size}")
 
             config_featex = config.featex
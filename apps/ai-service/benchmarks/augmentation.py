@@ -0,0 +1,323 @@
+"""
+Throughput benchmark for the augmentation and preprocessing transforms.
+
+Times every `Augmentation` transform, typical priority chains, and the
+compiled `Preprocessing` steps on synthetic images of several sizes and
+channel counts, and reports images/sec and the peak memory each call
+allocates. Results are written as JSON so runs of two versions can be
+compared:
+
+    python -m benchmarks.augmentation --output before.json
+    python -m benchmarks.augmentation --output after.json --compare before.json
+
+Run from apps/ai-service. Timings are single threaded, one image per call,
+which is how offline augmentation workers and training batch builders run
+them.
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import cv2
+import numpy as np
+
+from typing import Callable, Dict, List, Optional, Tuple
+from app.models.augmentation import DataAugmentationConfig
+from app.models.preprocessing import ImagePreprocessingConfig
+from app.services.dataset.augmentation import Augmentation
+from app.services.dataset.preprocessing import Preprocessing
+
+DEFAULT_SIZES = "224x224,640x480,1280x720"
+DEFAULT_CHANNELS = "1,3"
+# Slowdown, as a ratio of median times, reported as a regression by --compare
+REGRESSION_THRESHOLD = 1.10
+
+Size = Tuple[int, int]
+
+
+def synthetic_image(size: Size, channels: int, seed: int = 0) -> np.ndarray:
+    """
+    An 8-bit image of `size` (width, height) with smooth gradients, edges and noise.
+
+    Pure noise would make equalization and blurs unrealistically uniform,
+    so the image mixes the structure of a photo with some texture.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width)
+    y = np.linspace(0, 1, height)[:, None]
+    planes = []
+    for channel in range(channels):
+        phase = channel * 2.1
+        plane = 96 * (x + y) / 2 + 48 * np.sin(8 * x + phase) * np.cos(6 * y - phase)
+        plane = plane + np.where((x > 0.3) & (x < 0.6) & (y > 0.25) & (y < 0.7), 64, 0)
+        planes.append(plane + rng.normal(32, 12, (height, width)))
+    image = np.clip(np.stack(planes, axis=-1), 0, 255).astype(np.uint8)
+    return image[:, :, 0] if channels == 1 else image
+
+
+def augmentation_params(size: Size) -> Dict[str, object]:
+    """One always-firing setting for every transform `Augmentation` implements, scaled to `size`."""
+    width, height = size
+    return {
+        'rotate': (1.0, 30),
+        'crop': (1.0, (width // 2, height // 2), (width // 4, height // 4)),
+        'flip': (1.0, 1),
+        'translate': (1.0, (width // 10, height // 10)),
+        'scale': (1.0, (0.8, 1.2)),
+        'grayscale': 1.0,
+        'brightness': (1.0, 0.3),
+        'contrast_stretching': (1.0, 0.1, 0.9),
+        'histogram_equalization': 1.0,
+        'adaptive_equalization': (1.0, 2.0),
+        'saturation': (1.0, 1.5),
+        'hue': (1.0, 10),
+        'gamma': (1.0, 1.5),
+        'gaussian_blur': (1.0, (5, 1.0)),
+        'motion_blur': (1.0, (9, 45)),
+        'zoom_blur': (1.0, 5),
+        'sharpening': (1.0, 1.0),
+        'gaussian_noise': (1.0, (0.0, 25.0)),
+        'salt_pepper_noise': (1.0, (0.02, 0.5)),
+        'random_erasing': (1.0, (width // 4, height // 4, width // 4, height // 4)),
+        'elastic_distortion': (1.0, (34, 4)),
+    }
+
+
+AUGMENTATION_CHAINS = {
+    'geometric': ['rotate', 'flip', 'translate', 'scale'],
+    'photometric': ['brightness', 'contrast_stretching', 'gamma', 'saturation', 'hue'],
+    'blur_noise': ['gaussian_blur', 'motion_blur', 'gaussian_noise', 'salt_pepper_noise'],
+    'typical': ['rotate', 'flip', 'brightness', 'gamma', 'gaussian_blur', 'gaussian_noise'],
+    'heavy': ['rotate', 'scale', 'adaptive_equalization', 'zoom_blur', 'elastic_distortion', 'random_erasing'],
+}
+
+
+def preprocessing_params(size: Size) -> Dict[str, object]:
+    """One setting for every `Preprocessing` step, scaled to `size`."""
+    width, height = size
+    return {
+        'grayscale': True,
+        'resize': (width // 2, height // 2),
+        'crop': ((width // 2, height // 2), (width // 4, height // 4)),
+        'rotate': 30,
+        'flip': 1,
+        'pers_trans': (
+            [(0, 0), (width - 1, 0), (width - 1, height - 1), (0, height - 1)],
+            [(width // 10, height // 10), (width - 1, 0), (width - 1, height - 1), (0, height - 1)],
+        ),
+        'thresh_percent': 50,
+        'normalize': (0, 255),
+        'histogram_equalization': True,
+        'sharpening': 1,
+        'unsharp': (2, 1.5),
+        'laplacian': 3,
+        'gaussian_blur': ((5, 5), 1.0),
+        'median_blur': 5,
+        'mean_blur': (5, 5),
+        'log_trans': True,
+        'dilation': 3,
+        'erosion': 3,
+        'opening': 3,
+        'closing': 3,
+    }
+
+
+PREPROCESSING_CHAINS = {
+    'resize_normalize': ['resize', 'normalize'],
+    'denoise': ['gaussian_blur', 'median_blur', 'sharpening'],
+    'pointwise': ['normalize', 'histogram_equalization', 'log_trans'],
+    'binarize': ['grayscale', 'gaussian_blur', 'thresh_percent', 'opening'],
+}
+
+
+def augmentation_cases(size: Size) -> List[Tuple[str, str, Callable[[np.ndarray, np.random.Generator], np.ndarray]]]:
+    """(kind, name, run) for every transform and chain; `run` augments one image."""
+    augmentation = Augmentation()
+    params = augmentation_params(size)
+
+    def case(keys: List[str]):
+        config = DataAugmentationConfig(priority=keys, **{key: params[key] for key in keys})
+
+        def run(image, rng):
+            return augmentation.apply_recipe(image, augmentation.draw_recipe(config, rng))[0]
+        return run
+
+    cases = [('augmentation', key, case([key])) for key in params]
+    cases += [('augmentation_chain', name, case(keys)) for name, keys in AUGMENTATION_CHAINS.items()]
+    return cases
+
+
+def preprocessing_cases(size: Size) -> List[Tuple[str, str, Callable[[np.ndarray, np.random.Generator], np.ndarray]]]:
+    """(kind, name, run) for every compiled preprocessing step and chain."""
+    preprocessing = Preprocessing()
+    params = preprocessing_params(size)
+
+    def case(keys: List[str]):
+        plan = preprocessing.compile(ImagePreprocessingConfig(priority=keys, **{key: params[key] for key in keys}))
+        return lambda image, rng: plan(image)
+
+    cases = [('preprocessing', key, case([key])) for key in params]
+    cases += [('preprocessing_chain', name, case(keys)) for name, keys in PREPROCESSING_CHAINS.items()]
+    return cases
+
+
+def measure(run: Callable, image: np.ndarray, min_time: float, min_repeat: int) -> dict:
+    """
+    Time `run` on fresh copies of `image` until `min_time` seconds and `min_repeat` calls.
+
+    Some transforms write into their input, so each call gets its own copy,
+    made outside the timed region. Allocation is measured on a separate call,
+    since tracing slows NumPy and OpenCV allocations down.
+    """
+    rng = np.random.default_rng(0)
+    run(image.copy(), rng)  # Warm up caches and lazy initialization
+
+    times = []
+    started = time.perf_counter()
+    while len(times) < min_repeat or time.perf_counter() - started < min_time:
+        sample = image.copy()
+        start = time.perf_counter()
+        run(sample, rng)
+        times.append(time.perf_counter() - start)
+
+    sample = image.copy()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    run(sample, rng)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    times = np.array(times)
+    return {
+        'calls': len(times),
+        'images_per_sec': round(float(len(times) / times.sum()), 2),
+        'mean_ms': round(float(times.mean() * 1000), 4),
+        'median_ms': round(float(np.median(times) * 1000), 4),
+        'p95_ms': round(float(np.percentile(times, 95) * 1000), 4),
+        'peak_alloc_bytes': int(peak),
+    }
+
+
+def run_benchmarks(
+    sizes: List[Size],
+    channels: List[int],
+    min_time: float,
+    min_repeat: int,
+    only: Optional[str] = None,
+) -> dict:
+    results = []
+    for size in sizes:
+        for channel_count in channels:
+            image = synthetic_image(size, channel_count)
+            for kind, name, run in augmentation_cases(size) + preprocessing_cases(size):
+                if only is not None and only not in name:
+                    continue
+                result = {'kind': kind, 'name': name, 'width': size[0], 'height': size[1], 'channels': channel_count}
+                try:
+                    result.update(measure(run, image, min_time, min_repeat))
+                except Exception as e:
+                    # Several transforms only accept color images; OpenCV
+                    # keeps the reason, without its source location, in `err`
+                    message = str(getattr(e, 'err', None) or e).strip().splitlines()[0].lstrip('> ')
+                    result['error'] = f"{type(e).__name__}: {message}"
+                results.append(result)
+                print(format_result(result), flush=True)
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'opencv_threads': cv2.getNumThreads(),
+        },
+        'settings': {'min_time': min_time, 'min_repeat': min_repeat},
+        'results': results,
+    }
+
+
+def result_key(result: dict) -> Tuple:
+    return result['kind'], result['name'], result['width'], result['height'], result['channels']
+
+
+def format_result(result: dict) -> str:
+    label = f"{result['kind']:<20} {result['name']:<24} {result['width']}x{result['height']}x{result['channels']}"
+    if 'error' in result:
+        return f"{label:<62} skipped ({result['error']})"
+    return (f"{label:<62} {result['images_per_sec']:>10.1f} img/s  {result['median_ms']:>9.3f} ms  "
+            f"{result['peak_alloc_bytes'] / 1024:>9.1f} KiB")
+
+
+def compare(baseline: dict, current: dict, threshold: float = REGRESSION_THRESHOLD) -> List[dict]:
+    """Median time ratios of the cases both runs measured; above `threshold` is a regression."""
+    previous = {result_key(r): r for r in baseline['results'] if 'error' not in r}
+    comparisons = []
+    for result in current['results']:
+        before = previous.get(result_key(result))
+        if before is None or 'error' in result:
+            continue
+        ratio = result['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+        comparisons.append({
+            'key': result_key(result),
+            'ratio': ratio,
+            'alloc_ratio': result['peak_alloc_bytes'] / max(before['peak_alloc_bytes'], 1),
+            'regression': ratio > threshold,
+        })
+    return comparisons
+
+
+def parse_sizes(value: str) -> List[Size]:
+    sizes = []
+    for item in value.split(','):
+        width, height = item.lower().split('x')
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark augmentation and preprocessing throughput.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma separated WIDTHxHEIGHT image sizes.")
+    parser.add_argument("--channels", default=DEFAULT_CHANNELS, help="Comma separated channel counts (1 or 3).")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds to time each case for, at least.")
+    parser.add_argument("--min-repeat", type=int, default=5, help="Calls to time each case for, at least.")
+    parser.add_argument("--only", help="Only run cases whose name contains this text.")
+    parser.add_argument("--output", help="Write the results as JSON to this path.")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against.")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Median time ratio above which a case counts as a regression.")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(
+        parse_sizes(args.sizes),
+        [int(c) for c in args.channels.split(',')],
+        args.min_time,
+        args.min_repeat,
+        args.only,
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        comparisons = compare(baseline, report, args.threshold)
+        regressions = [c for c in comparisons if c['regression']]
+        for c in comparisons:
+            kind, name, width, height, channels = c['key']
+            marker = "REGRESSION" if c['regression'] else ""
+            print(f"{kind:<20} {name:<24} {width}x{height}x{channels:<6} "
+                  f"time x{c['ratio']:.2f}  alloc x{c['alloc_ratio']:.2f}  {marker}")
+        print(f"{len(regressions)} of {len(comparisons)} cases slower than x{args.threshold:.2f}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+
+from app.services.dataset.augmentation import Augmentation
+from app.services.dataset.augmentation_recipes import load_recipes
+from app.services.dataset.dataset import augment_dataset_class
+from app.models.augmentation import DataAugmentationConfig
+
+
+def test_translated_boxes_are_clipped_to_the_image():
+    image = np.zeros((100, 200, 3), dtype=np.uint8)
+    boxes = np.array([
+        [0, 0.5, 0.5, 0.2, 0.2],    # stays inside
+        [1, 0.85, 0.5, 0.2, 0.4],   # moves partly off the right edge
+        [2, 0.95, 0.2, 0.1, 0.1],   # moves entirely off it
+    ])
+
+    # 40 px of 200 is a 0.2 shift to the right
+    _, adjusted = Augmentation().apply_recipe(image, [{'key': 'translate', 'shift': [40, 0]}], boxes)
+
+    np.testing.assert_allclose(adjusted, [
+        [0, 0.7, 0.5, 0.2, 0.2],
+        [1, 0.975, 0.5, 0.05, 0.4],
+    ])
+
+
+def test_seeded_augmentation_is_reproducible(tmp_path):
+    for run in ("first", "second"):
+        for label in ("a", "b"):
+            class_dir = tmp_path / run / "train" / label
+            class_dir.mkdir(parents=True)
+            for i in range(3):
+                cv2.imwrite(str(class_dir / f"{i}.png"), np.random.default_rng(i).integers(0, 256, (16, 16, 3), dtype=np.uint8))
+    config = DataAugmentationConfig(
+        number=12, seed=7, flip=(0.5, 1), gaussian_noise=(0.5, (0, 10)), priority=["flip", "gaussian_noise"])
+
+    for run in ("first", "second"):
+        augment_dataset_class(str(tmp_path / run / "train"), config)
+
+    assert load_recipes(str(tmp_path / "first")) == load_recipes(str(tmp_path / "second"))
+    for path in load_recipes(str(tmp_path / "first")):
+        assert (tmp_path / "first" / path).read_bytes() == (tmp_path / "second" / path).read_bytes()
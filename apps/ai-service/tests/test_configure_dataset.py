@@ -0,0 +1,37 @@
+import os
+import cv2
+import numpy as np
+
+from app.services.dataset import dataset, image_format
+from app.services.dataset.dataset_index import DatasetIndex
+from app.services.dataset.derived_cache import DerivedCache
+from app.models.augmentation import DataAugmentationConfig
+from app.models.dataset import DatasetConfigRequest
+from app.models.preprocessing import ImagePreprocessingConfig
+
+
+def test_augmentation_after_preprocessing_renames_images(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_format, "INTERMEDIATE_FORMAT", "png")
+    monkeypatch.setattr(dataset, "preprocess_cache", DerivedCache(str(tmp_path / "preprocessed")))
+    dataset_dir = str(tmp_path / "dataset")
+    train_dir = os.path.join(dataset_dir, "train")
+    os.makedirs(train_dir)
+    rng = np.random.default_rng(0)
+    for i in range(4):
+        cv2.imwrite(os.path.join(train_dir, f"{i}.jpg"), rng.integers(0, 256, (40, 60, 3), dtype=np.uint8))
+        with open(os.path.join(train_dir, f"{i}.txt"), "w") as f:
+            f.write(f"{i % 2} 0.5 0.5 0.2 0.2\n")
+    # As a sync leaves it
+    DatasetIndex.build(dataset_dir).save()
+
+    dataset.configure_dataset(DatasetConfigRequest(
+        type="object_detection",
+        preprocess=ImagePreprocessingConfig(resize=(32, 24), priority=["resize"]),
+        augmentation=DataAugmentationConfig(
+            number=10, flip=(1.0, 1), translate=(1.0, (4, 0)), priority=["flip", "translate"]),
+    ), dataset_dir)
+
+    entries = DatasetIndex.load(dataset_dir).entries("train")
+    assert len(entries) == 10
+    assert all(entry["path"].endswith(".png") and entry["annotation"] for entry in entries)
+    assert all((entry["width"], entry["height"]) == (32, 24) for entry in entries)
@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+
+import httpx
+import pytest
+
+from app.services.dataset.image_cache import ImageCache
+from app.services.dataset.ingest import AsyncImageDownloader
+
+
+def download(downloader, items):
+    async def collect():
+        return [result async for result in downloader.download_all(items)]
+    return asyncio.run(collect())
+
+
+def make_downloader(tmp_path, handler, **kwargs):
+    return AsyncImageDownloader(
+        ImageCache(str(tmp_path / "images")), backoff=0, transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_download_stores_body_in_cache(tmp_path):
+    downloader = make_downloader(tmp_path, lambda request: httpx.Response(200, content=b"pixels", headers={"ETag": '"v1"'}))
+
+    [result] = download(downloader, [("a", "http://images/a.png?sig=1")])
+
+    assert result.error is None and not result.cached
+    assert result.digest == hashlib.sha256(b"pixels").hexdigest() and result.size == 6
+    entry = downloader.cache.lookup("http://images/a.png")
+    assert entry["digest"] == result.digest and entry["etag"] == '"v1"'
+    with open(downloader.cache.blob_path(result.digest), "rb") as f:
+        assert f.read() == b"pixels"
+
+
+def test_download_retries_then_reports_failure(tmp_path):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(503)
+
+    [result] = download(make_downloader(tmp_path, handler, retries=2), [("a", "http://images/a.png")])
+
+    assert len(requests) == 3
+    assert result.digest is None and "503" in result.error
+
+
+def test_download_retries_transport_errors(tmp_path):
+    attempts = []
+
+    def handler(request):
+        attempts.append(request)
+        if len(attempts) == 1:
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(200, content=b"pixels")
+
+    [result] = download(make_downloader(tmp_path, handler, retries=1), [("a", "http://images/a.png")])
+
+    assert len(attempts) == 2 and result.error is None
+
+
+def test_repeated_url_is_downloaded_once(tmp_path):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, content=b"pixels")
+
+    results = download(make_downloader(tmp_path, handler), [
+        ("train", "http://images/a.png?sig=1"),
+        ("valid", "http://images/a.png?sig=2"),
+    ])
+
+    assert len(requests) == 1
+    assert sorted(result.key for result in results) == ["train", "valid"]
+    assert len({result.digest for result in results}) == 1
+    assert sum(result.cached for result in results) == 1
+
+
+def test_negative_retries_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        AsyncImageDownloader(ImageCache(str(tmp_path / "images")), retries=-1)
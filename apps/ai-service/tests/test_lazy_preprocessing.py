@@ -0,0 +1,69 @@
+import os
+import cv2
+import numpy as np
+import pytest
+
+from app.services.dataset import dataset
+from app.services.dataset.derived_cache import DerivedCache
+from app.services.dataset.image_cache import ImageCache
+from app.services.dataset.lazy_preprocessing import load_preprocess_config
+from app.services.dataset.manifest import save_manifest
+from app.models.dataset import DatasetConfigRequest
+from app.models.preprocessing import ImagePreprocessingConfig
+
+FLIP = ImagePreprocessingConfig(flip=1, priority=["flip"])
+BLUR = ImagePreprocessingConfig(gaussian_blur=((5, 5), 1.0), priority=["gaussian_blur"])
+
+
+@pytest.fixture
+def synced(tmp_path, monkeypatch):
+    """A classification dataset synced from the image cache, with the original pixels of each file."""
+    image_cache = ImageCache(str(tmp_path / "images"))
+    monkeypatch.setattr(dataset, "image_cache", image_cache)
+    monkeypatch.setattr(dataset, "preprocess_cache", DerivedCache(str(tmp_path / "preprocessed")))
+
+    dataset_dir = str(tmp_path / "dataset")
+    rng = np.random.default_rng(0)
+    entries, originals = {}, {}
+    for split in ("train", "valid"):
+        for label in ("a", "b"):
+            os.makedirs(os.path.join(dataset_dir, split, label))
+            for i in range(2):
+                image = rng.integers(0, 256, (24, 32, 3), dtype=np.uint8)
+                writer = image_cache.open_writer()
+                writer.write(cv2.imencode(".png", image)[1].tobytes())
+                digest, size = writer.commit()
+                url = f"http://images/{split}/{label}/{i}.png"
+                image_cache.record(url, digest, size)
+                rel_path = os.path.join(split, label, f"{i}.png")
+                image_cache.link(digest, os.path.join(dataset_dir, rel_path))
+                entries[rel_path] = {"url": url, "digest": digest, "width": 32, "height": 24, "annotation": None}
+                originals[rel_path] = image
+    save_manifest(dataset_dir, {"type": "classification", "labels": ["a", "b"], "entries": entries})
+    return dataset_dir, originals
+
+
+def assert_pixels(dataset_dir, originals, transform):
+    for rel_path, image in originals.items():
+        assert np.array_equal(cv2.imread(os.path.join(dataset_dir, rel_path)), transform(image)), rel_path
+
+
+def test_lazy_config_replaces_pending_plan(synced):
+    dataset_dir, originals = synced
+    dataset.configure_dataset(DatasetConfigRequest(preprocess=FLIP, lazy_preprocess=True), dataset_dir)
+    dataset.configure_dataset(DatasetConfigRequest(preprocess=BLUR, lazy_preprocess=True), dataset_dir)
+
+    assert_pixels(dataset_dir, originals, lambda image: image)
+    config, _ = load_preprocess_config(dataset_dir)
+    assert config == BLUR
+    # The first plan was replaced, never written into the files
+    assert not os.path.exists(dataset.preprocess_cache.blob_dir)
+
+
+def test_eager_config_after_lazy_starts_from_sources(synced):
+    dataset_dir, originals = synced
+    dataset.configure_dataset(DatasetConfigRequest(preprocess=FLIP, lazy_preprocess=True), dataset_dir)
+    dataset.configure_dataset(DatasetConfigRequest(preprocess=BLUR), dataset_dir)
+
+    assert_pixels(dataset_dir, originals, dataset.preprocess.compile(BLUR))
+    assert load_preprocess_config(dataset_dir) is None